@@ -14,6 +14,8 @@
         "cc_finance",             
     ],
     "data": [
+        "security/ir.model.access.csv",
+        "data/ir_cron.xml",
         # "views/warranty_bot_settings_views.xml"
     ],
     "external_dependencies": {
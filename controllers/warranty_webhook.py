@@ -4,6 +4,8 @@ from odoo.http import request
 import json
 import logging
 
+from ..services import leader
+
 _logger = logging.getLogger(__name__)
 
 class WarrantyWebhookController(http.Controller):
@@ -23,11 +25,16 @@ class WarrantyWebhookController(http.Controller):
             _logger.warning(f"[WB/TEST] aiogram init warn: {e}")
             aio = False
 
+        from ..services.usta_cache import get_cache
+        from ..services.aiogram_app import dispatch_stats
         payload = {
             "status": "OK",
             "db": request.db,
             "token_exists": bool(token),
             "aiogram_running": aio,
+            "leader": leader.is_leader(),
+            "usta_cache": get_cache().stats(),
+            "dispatch": dispatch_stats(),
         }
         return request.make_response(
             json.dumps(payload, indent=2),
@@ -40,26 +47,19 @@ class WarrantyWebhookController(http.Controller):
     )
     def warranty_webhook(self, **kwargs):
         """
-        Telegram webhook: kelgan update'ni aiogram dispatcher'ga feed qilamiz.
+        Telegram webhook: update'ni faqat navbatga yozamiz (bitta INSERT) va darhol 200 qaytaramiz.
+        Parse/dispatch bot runtime'dagi consumer'da bo'ladi.
         """
         try:
-            raw = request.httprequest.data or b""
-            text = raw.decode("utf-8", "ignore")
-            _logger.info(f"[WB] Incoming {request.httprequest.method} raw={text[:500]}")
-
-            # aiogram ishga tushsin
-            from ..services.aiogram_app import ensure_aiogram_running, feed_update
-            ensure_aiogram_running(request.env)
-
+            raw = request.httprequest.get_data() or b""
             if raw:
-                try:
-                    upd = json.loads(text)
-                except Exception as e:
-                    _logger.warning(f"[WB] JSON parse warn: {e}")
-                    upd = {}
-                # aiogram dispatcher'ga yuboramiz
-                feed_update(upd)
-            return request.make_response("OK", headers=[("Content-Type", "text/plain")])
+                request.env["warranty.bot.update"].sudo()._enqueue(raw.decode("utf-8", "ignore"))
         except Exception as e:
-            _logger.error(f"[WB] webhook error: {e}", exc_info=True)
-            return request.make_response("OK", headers=[("Content-Type", "text/plain")])
+            _logger.error(f"[WB] webhook enqueue error: {e}", exc_info=True)
+            # 200 bermaymiz: Telegram update'ni keyinroq qayta yuboradi
+            return request.make_response("ERROR", status=500, headers=[("Content-Type", "text/plain")])
+
+        # leader election shu jarayonda hali boshlanmagan bo'lsa — boshlanadi
+        # (aiogram importi va ICP o'qishsiz; keyingi so'rovlarda faqat flag tekshiruvi)
+        leader.ensure_started(request.db)
+        return request.make_response("OK", headers=[("Content-Type", "text/plain")])
@@ -1 +1,12 @@
 from . import employee_telegram
+from . import crm_lead
+from . import crm_lead_photo
+from . import cc_finance
+from . import cc_zapchast_move
+from . import cc_employee_zapchast
+from . import bot_fsm
+from . import bot_update
+from . import bot_card
+from . import bot_outbox
+from . import crm_stage
+from . import ir_config_parameter
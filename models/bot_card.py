@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+from odoo import api, fields, models
+
+DEFAULT_CARD_TTL_DAYS = 14
+MAX_CARDS_PER_LEAD = 5
+
+class WarrantyBotCard(models.Model):
+    """
+    Telegram'dagi lead kartochkalari: bitta lead'ning bir nechta chat/xabarda
+    tirik kartochkasi bo'lishi mumkin. crm.lead qatoriga yozilmaydi
+    (write_date, tracking, recompute'lar qo'zg'almaydi).
+    """
+    _name = "warranty.bot.card"
+    _description = "Telegram lead kartochkasi"
+    _log_access = False
+
+    lead_id = fields.Many2one("crm.lead", required=True, index=True, ondelete="cascade")
+    chat_id = fields.Char(required=True)
+    message_id = fields.Integer(required=True)
+    last_hash = fields.Char()
+    updated_at = fields.Datetime(index=True)
+
+    _sql_constraints = [
+        ("chat_message_uniq", "unique(chat_id, message_id)", "Xabar bitta kartochkaga tegishli."),
+    ]
+
+    @api.model
+    def _register(self, rows):
+        """rows: [(lead_id, chat_id, message_id, hash)] — bitta INSERT ... ON CONFLICT."""
+        if not rows:
+            return
+        lead_ids, chat_ids, msg_ids, hashes = zip(*rows)
+        self.env.cr.execute("""
+            INSERT INTO warranty_bot_card (lead_id, chat_id, message_id, last_hash, updated_at)
+            SELECT l, c, m, h, now() at time zone 'UTC'
+              FROM unnest(%s::int[], %s::varchar[], %s::int[], %s::varchar[]) AS t(l, c, m, h)
+            ON CONFLICT (chat_id, message_id) DO UPDATE
+               SET lead_id = EXCLUDED.lead_id,
+                   last_hash = EXCLUDED.last_hash,
+                   updated_at = EXCLUDED.updated_at
+        """, (list(lead_ids), [str(c) for c in chat_ids], list(msg_ids), list(hashes)))
+
+    @api.model
+    def _cards_for(self, lead_ids):
+        """{lead_id: [(chat_id, message_id, last_hash)]} — yangilari birinchi."""
+        res = {}
+        if not lead_ids:
+            return res
+        self.env.cr.execute("""
+            SELECT lead_id, chat_id, message_id, last_hash FROM warranty_bot_card
+             WHERE lead_id = ANY(%s) ORDER BY updated_at DESC NULLS LAST, id DESC
+        """, (list(lead_ids),))
+        for lead_id, chat_id, msg_id, last_hash in self.env.cr.fetchall():
+            res.setdefault(lead_id, []).append((int(chat_id), msg_id, last_hash))
+        return res
+
+    @api.model
+    def _leads_with_cards(self, lead_ids):
+        """lead_ids ichidan tirik kartochkasi borlari — bitta so'rov."""
+        if not lead_ids:
+            return []
+        self.env.cr.execute(
+            "SELECT DISTINCT lead_id FROM warranty_bot_card WHERE lead_id = ANY(%s)", (list(lead_ids),))
+        return [row[0] for row in self.env.cr.fetchall()]
+
+    @api.model
+    def _store_hashes(self, rows):
+        """rows: [(chat_id, message_id, hash)] — muvaffaqiyatli yuborilgan kartochkalar."""
+        if not rows:
+            return
+        chat_ids, msg_ids, hashes = zip(*rows)
+        self.env.cr.execute("""
+            UPDATE warranty_bot_card AS c
+               SET last_hash = t.h, updated_at = now() at time zone 'UTC'
+              FROM unnest(%s::varchar[], %s::int[], %s::varchar[]) AS t(c, m, h)
+             WHERE c.chat_id = t.c AND c.message_id = t.m
+        """, ([str(c) for c in chat_ids], list(msg_ids), list(hashes)))
+
+    @api.model
+    def _forget(self, keys):
+        """keys: [(chat_id, message_id)] — xabar o'chirilgan yoki boshqa narsaga aylangan."""
+        if not keys:
+            return
+        chat_ids, msg_ids = zip(*keys)
+        self.env.cr.execute("""
+            DELETE FROM warranty_bot_card AS c
+             USING unnest(%s::varchar[], %s::int[]) AS t(c, m)
+             WHERE c.chat_id = t.c AND c.message_id = t.m
+        """, ([str(c) for c in chat_ids], list(msg_ids)))
+
+    @api.model
+    def _gc_stale(self):
+        """Eski kartochkalarni va har bir lead uchun oxirgi MAX_CARDS_PER_LEAD'dan ortig'ini o'chiradi."""
+        ttl = self.env["ir.config_parameter"].sudo().get_param(
+            "warranty_bot.card_ttl_days", DEFAULT_CARD_TTL_DAYS
+        )
+        try:
+            ttl = max(1, int(ttl))
+        except (TypeError, ValueError):
+            ttl = DEFAULT_CARD_TTL_DAYS
+        self.env.cr.execute("""
+            DELETE FROM warranty_bot_card
+             WHERE updated_at < (now() at time zone 'UTC') - make_interval(days => %s)
+        """, (ttl,))
+        self.env.cr.execute("""
+            DELETE FROM warranty_bot_card WHERE id IN (
+                SELECT id FROM (
+                    SELECT id, row_number() OVER (
+                        PARTITION BY lead_id ORDER BY updated_at DESC NULLS LAST, id DESC) AS rn
+                      FROM warranty_bot_card
+                ) ranked WHERE rn > %s
+            )
+        """, (MAX_CARDS_PER_LEAD,))
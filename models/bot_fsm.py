@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import json
+
+from odoo import api, fields, models
+
+DEFAULT_FSM_TTL_HOURS = 72
+
+class WarrantyBotFsm(models.Model):
+    """aiogram FSM holati (Reg/Work) — restart va worker'lar orasida saqlanadi."""
+    _name = "warranty.bot.fsm"
+    _description = "Warranty bot FSM holati"
+    _log_access = False
+
+    key = fields.Char(required=True)
+    state = fields.Char()
+    data = fields.Text(default="{}")
+    updated_at = fields.Datetime(index=True)
+
+    _sql_constraints = [
+        ("key_uniq", "unique(key)", "FSM kaliti takrorlanmasligi kerak."),
+    ]
+
+    @api.model
+    def _fsm_load(self, key):
+        """(state, data) yoki None."""
+        self.env.cr.execute("SELECT state, data FROM warranty_bot_fsm WHERE key = %s", (key,))
+        row = self.env.cr.fetchone()
+        if not row:
+            return None
+        try:
+            data = json.loads(row[1] or "{}")
+        except ValueError:
+            data = {}
+        return row[0], data
+
+    @api.model
+    def _fsm_set_state(self, key, state):
+        """Holatni yozadi, natijaviy (state, data) ni qaytaradi."""
+        self.env.cr.execute("""
+            INSERT INTO warranty_bot_fsm (key, state, data, updated_at)
+            VALUES (%s, %s, '{}', now() at time zone 'UTC')
+            ON CONFLICT (key) DO UPDATE
+               SET state = EXCLUDED.state, updated_at = EXCLUDED.updated_at
+            RETURNING state, data
+        """, (key, state))
+        return self._fsm_result(key)
+
+    @api.model
+    def _fsm_set_data(self, key, data):
+        """Ma'lumotni yozadi, natijaviy (state, data) ni qaytaradi."""
+        self.env.cr.execute("""
+            INSERT INTO warranty_bot_fsm (key, state, data, updated_at)
+            VALUES (%s, NULL, %s, now() at time zone 'UTC')
+            ON CONFLICT (key) DO UPDATE
+               SET data = EXCLUDED.data, updated_at = EXCLUDED.updated_at
+            RETURNING state, data
+        """, (key, json.dumps(data or {}, ensure_ascii=False, separators=(",", ":"))))
+        return self._fsm_result(key)
+
+    def _fsm_result(self, key):
+        """Upsert'dan keyingi (state, data); state.clear() bo'lsa bo'sh qator saqlanmaydi."""
+        state, raw = self.env.cr.fetchone()
+        if state is None and raw == "{}":
+            self.env.cr.execute("DELETE FROM warranty_bot_fsm WHERE key = %s", (key,))
+        try:
+            data = json.loads(raw or "{}")
+        except ValueError:
+            data = {}
+        return state, data
+
+    @api.model
+    def _gc_expired(self):
+        """Tashlab ketilgan sessiyalarni (masalan, yarim ro'yxatdan o'tish) o'chiradi."""
+        ttl = self.env["ir.config_parameter"].sudo().get_param(
+            "warranty_bot.fsm_ttl_hours", DEFAULT_FSM_TTL_HOURS
+        )
+        try:
+            ttl = max(1, int(ttl))
+        except (TypeError, ValueError):
+            ttl = DEFAULT_FSM_TTL_HOURS
+        self.env.cr.execute("""
+            DELETE FROM warranty_bot_fsm
+             WHERE updated_at < (now() at time zone 'UTC') - make_interval(hours => %s)
+        """, (ttl,))
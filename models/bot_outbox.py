@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+from odoo import api, fields, models
+
+# bot runtime shu kanalni LISTEN qiladi (yangi xabar navbatga tushdi)
+OUTBOX_CHANNEL = "warranty_bot_outbox"
+MAX_ATTEMPTS = 5
+RETRY_BASE_SECONDS = 30
+DEFAULT_OUTBOX_KEEP_DAYS = 7
+
+class WarrantyBotOutbox(models.Model):
+    """
+    Transactional outbox: usta biriktirilganda xabar shu tranzaksiyada yoziladi,
+    bot runtime partiyalab o'qib yuboradi. Operator saqlashi Telegram'ni kutmaydi;
+    rollback bo'lsa xabar ham yo'q.
+    """
+    _name = "warranty.bot.outbox"
+    _description = "Telegram xabarlari navbati"
+    _log_access = False
+    _order = "id"
+
+    lead_id = fields.Many2one("crm.lead", required=True, ondelete="cascade")
+    employee_id = fields.Many2one("cc.employee", ondelete="cascade")
+    chat_id = fields.Char(required=True)
+    kind = fields.Selection([("assign", "Biriktirildi")], required=True, default="assign")
+    state = fields.Selection(
+        [("pending", "Navbatda"), ("sent", "Yuborildi"), ("failed", "Xato")],
+        required=True, default="pending",
+    )
+    attempts = fields.Integer(default=0)
+    next_try_at = fields.Datetime()
+    last_error = fields.Char()
+    created_at = fields.Datetime()
+    sent_at = fields.Datetime()
+
+    def init(self):
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS warranty_bot_outbox_due_idx
+                ON warranty_bot_outbox (next_try_at, id) WHERE state = 'pending'
+        """)
+
+    @api.model
+    def _enqueue_assignments(self, lead_ids):
+        """Lead'larning hozirgi ustasiga (tg_chat_id bo'lsa) bitta INSERT ... SELECT + NOTIFY."""
+        if not lead_ids:
+            return
+        self.env.flush_all()
+        self.env.cr.execute("""
+            WITH ins AS (
+                INSERT INTO warranty_bot_outbox
+                       (lead_id, employee_id, chat_id, kind, state, attempts, next_try_at, created_at)
+                SELECT l.id, e.id, e.tg_chat_id, 'assign', 'pending', 0,
+                       now() at time zone 'UTC', now() at time zone 'UTC'
+                  FROM crm_lead l
+                  JOIN cc_employee e ON e.id = l.usta_id
+                 WHERE l.id = ANY(%s) AND coalesce(e.tg_chat_id, '') <> ''
+                RETURNING id
+            )
+            SELECT pg_notify(%s, count(*)::text) FROM ins HAVING count(*) > 0
+        """, (list(lead_ids), OUTBOX_CHANNEL))
+
+    @api.model
+    def _fetch_due(self, limit: int):
+        """[(id, chat_id, lead_id, kind, attempts)] — yuborish vaqti kelgan xabarlar."""
+        self.env.cr.execute("""
+            SELECT id, chat_id, lead_id, kind, attempts FROM warranty_bot_outbox
+             WHERE state = 'pending' AND next_try_at <= now() at time zone 'UTC'
+             ORDER BY next_try_at, id LIMIT %s
+        """, (limit,))
+        return self.env.cr.fetchall()
+
+    @api.model
+    def _mark_results(self, sent_ids, failures):
+        """
+        failures: [(id, xato matni, qayta urinish mumkinmi)].
+        Qayta urinish eksponensial kechikish bilan; MAX_ATTEMPTS'dan keyin 'failed'.
+        """
+        cr = self.env.cr
+        if sent_ids:
+            cr.execute("""
+                UPDATE warranty_bot_outbox
+                   SET state = 'sent', sent_at = now() at time zone 'UTC',
+                       attempts = attempts + 1, last_error = NULL
+                 WHERE id = ANY(%s)
+            """, (list(sent_ids),))
+        if failures:
+            ids, errors, retryable = zip(*failures)
+            cr.execute("""
+                UPDATE warranty_bot_outbox AS o
+                   SET attempts = o.attempts + 1,
+                       last_error = left(t.err, 255),
+                       state = CASE WHEN t.retry AND o.attempts + 1 < %s THEN 'pending' ELSE 'failed' END,
+                       next_try_at = (now() at time zone 'UTC')
+                                     + make_interval(secs => %s * power(2, o.attempts))
+                  FROM unnest(%s::int[], %s::varchar[], %s::bool[]) AS t(id, err, retry)
+                 WHERE o.id = t.id
+            """, (MAX_ATTEMPTS, RETRY_BASE_SECONDS, list(ids), list(errors), list(retryable)))
+
+    @api.model
+    def _gc_done(self):
+        """Yuborilgan/yakuniy xato bo'lgan eski yozuvlarni o'chiradi."""
+        days = self.env["ir.config_parameter"].sudo().get_param(
+            "warranty_bot.outbox_keep_days", DEFAULT_OUTBOX_KEEP_DAYS
+        )
+        try:
+            days = max(1, int(days))
+        except (TypeError, ValueError):
+            days = DEFAULT_OUTBOX_KEEP_DAYS
+        self.env.cr.execute("""
+            DELETE FROM warranty_bot_outbox
+             WHERE state IN ('sent', 'failed')
+               AND created_at < (now() at time zone 'UTC') - make_interval(days => %s)
+        """, (days,))
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+from odoo import api, fields, models
+
+# bot runtime shu kanalni LISTEN qiladi (yangi update keldi)
+UPDATE_CHANNEL = "warranty_bot_update"
+# soniya: olingan qator shuncha vaqt shu runtime'ga tegishli (boshqa leader olmaydi)
+LEASE_SECONDS = 120
+
+class WarrantyBotUpdate(models.Model):
+    """
+    Telegram webhook'dan kelgan xom update'lar navbati.
+    Controller faqat INSERT qiladi; bot runtime'dagi consumer o'qib, qayta
+    ishlangandan keyin o'chiradi (at-least-once).
+    """
+    _name = "warranty.bot.update"
+    _description = "Telegram update navbati"
+    _log_access = False
+    _order = "id"
+
+    payload = fields.Text(required=True)
+    received_at = fields.Datetime()
+    # qaysi runtime (leader) olgan va qachongacha — ikki leader bitta qatorni ishlamasin
+    lease_owner = fields.Char()
+    lease_until = fields.Datetime()
+
+    def init(self):
+        # update_id bigint bo'lishi mumkin — bitta qatorli oddiy jadval
+        self.env.cr.execute("""
+            CREATE TABLE IF NOT EXISTS warranty_bot_update_hwm (
+                id integer PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+                update_id bigint NOT NULL
+            )
+        """)
+
+    @api.model
+    def _load_hwm(self) -> int:
+        """Qayta ishlangan update'lar chegarasi (shu update_id'gacha hammasi tugagan)."""
+        self.env.cr.execute("SELECT update_id FROM warranty_bot_update_hwm WHERE id = 1")
+        row = self.env.cr.fetchone()
+        return row[0] if row else 0
+
+    @api.model
+    def _store_hwm(self, update_id: int):
+        self.env.cr.execute("""
+            INSERT INTO warranty_bot_update_hwm (id, update_id) VALUES (1, %s)
+            ON CONFLICT (id) DO UPDATE
+               SET update_id = GREATEST(warranty_bot_update_hwm.update_id, EXCLUDED.update_id)
+        """, (update_id,))
+
+    @api.model
+    def _enqueue(self, payload: str):
+        # bitta so'rov: INSERT + NOTIFY (NOTIFY commit'da yetkaziladi)
+        self.env.cr.execute("""
+            WITH ins AS (
+                INSERT INTO warranty_bot_update (payload, received_at)
+                VALUES (%s, now() at time zone 'UTC')
+                RETURNING id
+            )
+            SELECT pg_notify(%s, ins.id::text) FROM ins
+        """, (payload, UPDATE_CHANNEL))
+
+    @api.model
+    def _fetch_batch(self, owner: str, skip_ids, limit: int):
+        """
+        [(id, payload)] — hali o'chirilmagan update'larni owner nomiga lease bilan oladi.
+        skip_ids (shu runtime'da ishlanayotganlar) va boshqa runtime'ning amaldagi lease'i
+        bor qatorlar olinmaydi; SKIP LOCKED — parallel olish bir qatorni ikki marta bermaydi.
+        id kursori ishlatilmaydi: webhook'lar parallel commit qiladi, kichik id kattasidan
+        keyin ko'rinishi mumkin — u ham keyingi o'qishda olinadi.
+        """
+        self.env.cr.execute("""
+            UPDATE warranty_bot_update AS u
+               SET lease_owner = %s,
+                   lease_until = (now() at time zone 'UTC') + make_interval(secs => %s)
+              FROM (
+                SELECT id FROM warranty_bot_update
+                 WHERE NOT (id = ANY(%s))
+                   AND (lease_owner IS NULL OR lease_owner = %s
+                        OR lease_until < now() at time zone 'UTC')
+                 ORDER BY id LIMIT %s
+                   FOR UPDATE SKIP LOCKED
+              ) AS picked
+             WHERE u.id = picked.id
+            RETURNING u.id, u.payload
+        """, (owner, LEASE_SECONDS, list(skip_ids), owner, limit))
+        return sorted(self.env.cr.fetchall())
+
+    @api.model
+    def _ack(self, ids):
+        if ids:
+            self.env.cr.execute("DELETE FROM warranty_bot_update WHERE id = ANY(%s)", (list(ids),))
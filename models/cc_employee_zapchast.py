@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from odoo import models, tools
+
+
+class CcEmployeeZapchast(models.Model):
+    _inherit = "cc.employee.zapchast"
+
+    def init(self):
+        super().init()
+        cr = self.env.cr
+        # bot: zapchast tanlash sahifalari (list_usta_parts) indeks tartibida o'qiladi
+        if all(tools.sql.column_exists(cr, self._table, col) for col in ("zapchast_code", "zapchast_name")):
+            tools.create_index(
+                cr, "cc_employee_zapchast_usta_pick_idx", self._table,
+                ["employee_id", "zapchast_code", "zapchast_name", "id"], where="qty > 0",
+            )
+            # kod boshi / nom bo'lagi bo'yicha qidiruv (ILIKE) — pg_trgm bo'lsa trigram indeks
+            cr.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            if cr.fetchone():
+                for col in ("zapchast_code", "zapchast_name"):
+                    tools.create_index(
+                        cr, f"cc_employee_zapchast_{col}_trgm_idx", self._table,
+                        [f"{col} gin_trgm_ops"], method="gin",
+                    )
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from odoo import api, models
+
+from ..services import card_sync
+
+
+class CcFinance(models.Model):
+    _inherit = "cc.finance"
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        card_sync.notify_leads(self.env, records.lead_id.ids)
+        return records
+
+    def write(self, vals):
+        lead_ids = set(self.lead_id.ids)
+        res = super().write(vals)
+        card_sync.notify_leads(self.env, lead_ids | set(self.lead_id.ids))
+        return res
+
+    def unlink(self):
+        lead_ids = self.lead_id.ids
+        res = super().unlink()
+        card_sync.notify_leads(self.env, lead_ids)
+        return res
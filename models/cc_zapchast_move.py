@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from odoo import api, models
+
+from ..services import card_sync
+
+
+class CcZapchastMove(models.Model):
+    _inherit = "cc.zapchast.move"
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        card_sync.notify_leads(self.env, records.crm_service_id.ids)
+        return records
+
+    def write(self, vals):
+        lead_ids = set(self.crm_service_id.ids)
+        res = super().write(vals)
+        card_sync.notify_leads(self.env, lead_ids | set(self.crm_service_id.ids))
+        return res
+
+    def unlink(self):
+        lead_ids = self.crm_service_id.ids
+        res = super().unlink()
+        card_sync.notify_leads(self.env, lead_ids)
+        return res
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from odoo import api, models, tools
+
+from ..services import card_sync
+
+# Telegram kartochkasida ko'rinadigan maydonlar: o'zgarsa kartochka yangilanadi
+_CARD_FIELDS = {
+    "stage_id", "work_amount", "product_line_ids", "tag_ids", "name", "partner_id",
+    "partner_name", "phone", "partner_phone", "street", "city", "state_id", "country_id",
+    "work_text", "location_url", "photo_attachment_ids", "service_number", "active",
+}
+
+
+class CrmLead(models.Model):
+    _inherit = "crm.lead"
+
+    def init(self):
+        super().init()
+        # bot: ustaning ochiq zayavkalari (list_usta_open_leads) bitta indeks bo'yicha
+        tools.create_index(
+            self.env.cr, "crm_lead_usta_open_idx", self._table,
+            ["usta_id", "active", "type", "stage_id", "priority DESC", "create_date DESC"],
+        )
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        leads = super().create(vals_list)
+        assigned = leads.filtered("usta_id")
+        if assigned:
+            self.env["warranty.bot.outbox"].sudo()._enqueue_assignments(assigned.ids)
+        return leads
+
+    def write(self, vals):
+        old_usta = {lead.id: lead.usta_id.id for lead in self} if "usta_id" in vals else None
+        res = super().write(vals)
+        if _CARD_FIELDS.intersection(vals):
+            card_sync.notify_leads(self.env, self.ids)
+        if old_usta is not None:
+            # faqat ustasi haqiqatan o'zgargan lead'lar (qayta saqlash xabar yubormaydi)
+            changed = [lead.id for lead in self if lead.usta_id and lead.usta_id.id != old_usta[lead.id]]
+            if changed:
+                self.env["warranty.bot.outbox"].sudo()._enqueue_assignments(changed)
+        return res
@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+from odoo import fields, models
+
+
+class CrmLeadPhoto(models.Model):
+    _inherit = "crm.lead.photo"
+
+    # bot: bir xil rasm (qayta yuborilgan/forward qilingan) ikkinchi marta saqlanmaydi
+    tg_file_unique_id = fields.Char(string="Telegram file_unique_id", index=True, copy=False)
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from odoo import api, models
+
+from ..services import stage_registry
+
+
+class CrmStage(models.Model):
+    _inherit = "crm.stage"
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        stage_registry.notify_changed(self.env)
+        return records
+
+    def write(self, vals):
+        res = super().write(vals)
+        stage_registry.notify_changed(self.env)
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        stage_registry.notify_changed(self.env)
+        return res
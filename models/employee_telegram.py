@@ -1,5 +1,12 @@
 # -*- coding: utf-8 -*-
-from odoo import fields, models
+from functools import partial
+
+from odoo import api, fields, models
+
+from ..services import usta_cache
+
+# bot keshidagi UstaInfo'ga ta'sir qiladigan maydonlar
+_USTA_CACHE_FIELDS = {"tg_user_id", "active", "usta_status", "is_usta", "company_id", "user_id", "tg_lang"}
 
 class CcEmployee(models.Model):
     _inherit = "cc.employee"
@@ -7,3 +14,37 @@ class CcEmployee(models.Model):
     tg_user_id = fields.Char(string="Telegram user id", index=True)
     tg_chat_id = fields.Char(string="Telegram chat id", index=True)
     tg_lang = fields.Selection([("uz","O‘zbekcha"),("ru","Русский")], default="uz", string="TG til")
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        records._invalidate_usta_cache()
+        return records
+
+    def write(self, vals):
+        if not _USTA_CACHE_FIELDS.intersection(vals):
+            return super().write(vals)
+        old_tg_ids = self._tg_user_ids()
+        res = super().write(vals)
+        self._invalidate_usta_cache(old_tg_ids)
+        return res
+
+    def unlink(self):
+        tg_ids = self._tg_user_ids()
+        res = super().unlink()
+        self.env["cc.employee"]._invalidate_usta_cache(tg_ids)
+        return res
+
+    def _tg_user_ids(self):
+        return {r.tg_user_id for r in self if r.tg_user_id}
+
+    def _invalidate_usta_cache(self, extra_tg_ids=()):
+        """
+        Bot keshidan tegishli tg_user_id'larni commit'dan keyin o'chiradi.
+        pg_notify ham tranzaksiya bilan birga yuboriladi (boshqa worker'lar uchun).
+        """
+        tg_ids = self._tg_user_ids() | set(extra_tg_ids)
+        if not tg_ids:
+            return
+        self.env.cr.execute("SELECT pg_notify(%s, %s)", (usta_cache.CHANNEL, ",".join(sorted(tg_ids))))
+        self.env.cr.postcommit.add(partial(usta_cache.invalidate, tg_ids))
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from odoo import api, models
+
+from ..services import stage_registry
+
+
+class IrConfigParameter(models.Model):
+    _inherit = "ir.config_parameter"
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        if any((vals.get("key") or "").startswith(stage_registry.PARAM_PREFIX) for vals in vals_list):
+            stage_registry.notify_changed(self.env)
+        return records
+
+    def write(self, vals):
+        touched = self._touches_stage_params() or (vals.get("key") or "").startswith(stage_registry.PARAM_PREFIX)
+        res = super().write(vals)
+        if touched:
+            stage_registry.notify_changed(self.env)
+        return res
+
+    def unlink(self):
+        touched = self._touches_stage_params()
+        res = super().unlink()
+        if touched:
+            stage_registry.notify_changed(self.env)
+        return res
+
+    def _touches_stage_params(self):
+        return any((r.key or "").startswith(stage_registry.PARAM_PREFIX) for r in self)
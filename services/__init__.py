@@ -5,4 +5,20 @@ from . import usta_services # helpers
 from . import config
 from . import state
 from . import keyboards
-from . import middlewares
\ No newline at end of file
+from . import middlewares
+from . import replies
+from . import ttl_cache
+from . import usta_cache
+from . import pg_listener
+from . import fsm_storage
+from . import leader
+from . import sender
+from . import card_cache
+from . import card_refresh
+from . import stage_registry
+from . import card_sync
+from . import outbox
+from . import history_export
+from . import photo_ingest
+from . import album
+from . import image_stage
@@ -1,19 +1,56 @@
 # -*- coding: utf-8 -*-
 import asyncio
+import json
 import logging
 import threading
+import uuid
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.types import Update
 
 from . import usta_router
 from . import runtime  # <-- MUHIM
+from . import pg_listener
+from . import usta_cache
+from . import leader
+from .fsm_storage import PgStorage
+from .chat_dispatch import ChatDispatcher, update_chat_key, ack_scope
+from . import chat_dispatch
+from .dedupe import UpdateDeduper, DEFAULT_WINDOW as DEDUPE_WINDOW
+from . import sender
+from . import card_cache
+from . import card_refresh
+from . import stage_registry
+from . import card_sync
+from . import outbox
+from . import history_export
+from . import album
+from . import image_stage
+from ..models.bot_update import UPDATE_CHANNEL
+from ..models.bot_outbox import OUTBOX_CHANNEL
 
 _logger = logging.getLogger(__name__)
 
 _AIO_LOOP = None
+_AIO_THREAD = None
 _BOT = None
 _DP = None
+SHUTDOWN_TIMEOUT = 10  # soniya: task'lar bekor qilinib, sessiya yopilishini kutish
+
+# webhook navbati (warranty.bot.update) consumer'i
+UPDATE_BATCH = 50
+UPDATE_POLL_INTERVAL = 5  # soniya: NOTIFY kelmasa ham navbat tekshiriladi
+_UPDATE_WAKE = None
+_CHAT_DISPATCH = None
+_DEDUPER = None
+_SENDER = None
+_OUTBOX = None
+
+# warranty.bot.card last_hash/o'chirishlar shu oraliqda partiyalab yoziladi
+CARD_FLUSH_INTERVAL = 5  # soniya
+
+_NOTIFIED = set()        # kartochkasi tekshirilishi kutilayotgan lead'lar (card_sync NOTIFY)
+_NOTIFY_TASK = None
 
 def _create_loop():
     loop = asyncio.new_event_loop()
@@ -22,10 +59,10 @@ def _create_loop():
 
 def ensure_aiogram_running(env):
     """
-    aiogram 3 dispatcher/botni bir marta ishga tushiramiz.
-    Env'dagi cursorni saqlamaymiz! Faqat DB nomini saqlaymiz.
+    Jarayonda leader election'ni boshlaydi (bir marta).
+    Dispatcher/bot faqat leader jarayonda ishga tushadi; qolganlari faqat
+    update'larni navbatga yozadi. Env'dagi cursorni saqlamaymiz! Faqat DB nomini saqlaymiz.
     """
-    global _AIO_LOOP, _BOT, _DP
     if _BOT and _DP and _AIO_LOOP and _AIO_LOOP.is_running():
         return True
 
@@ -34,38 +71,299 @@ def ensure_aiogram_running(env):
         _logger.warning("[AIO] warranty_bot.bot_token topilmadi")
         return False
 
-    # DB nomini runtime’ga joylaymiz (keyin open_env() orqali env ochamiz)
+    # DB nomini runtime’ga joylaymiz (keyin open_env()/run_in_env() orqali env ochamiz)
     runtime.set_dbname(env.cr.dbname)
+    leader.ensure_started(env.cr.dbname)
+    return True
+
+def _start_runtime():
+    """Leader bo'lganda (elector thread'ida): bot, dispatcher va loop'ni ishga tushiradi."""
+    global _AIO_LOOP, _AIO_THREAD, _BOT, _DP, _SENDER, _OUTBOX
+    with runtime.open_env() as env:
+        ICP = env["ir.config_parameter"].sudo()
+        token = ICP.get_param("warranty_bot.bot_token")
+        db_workers = ICP.get_param("warranty_bot.db_workers", runtime.DEFAULT_DB_WORKERS)
+        cache_size = ICP.get_param("warranty_bot.usta_cache_size", usta_cache.DEFAULT_MAXSIZE)
+        cache_ttl = ICP.get_param("warranty_bot.usta_cache_ttl", usta_cache.DEFAULT_TTL)
+        dispatch_cfg = {
+            "concurrency": ICP.get_param("warranty_bot.dispatch_concurrency", chat_dispatch.DEFAULT_CONCURRENCY),
+            "max_pending": ICP.get_param("warranty_bot.dispatch_max_pending", chat_dispatch.DEFAULT_MAX_PENDING),
+        }
+        dedupe_window = ICP.get_param("warranty_bot.dedupe_window", DEDUPE_WINDOW)
+        update_hwm = env["warranty.bot.update"]._load_hwm()
+        card_cache_size = ICP.get_param("warranty_bot.card_cache_size", card_cache.DEFAULT_RENDER_SIZE)
+        outbox_batch = ICP.get_param("warranty_bot.outbox_batch", outbox.DEFAULT_BATCH)
+        refresh_delay_ms = ICP.get_param("warranty_bot.card_refresh_delay_ms", int(card_refresh.DEFAULT_DELAY * 1000))
+        image_cfg = {
+            "max_dim": ICP.get_param("warranty_bot.photo_max_dim", image_stage.DEFAULT_MAX_DIM),
+            "fmt": ICP.get_param("warranty_bot.photo_format", image_stage.DEFAULT_FORMAT),
+            "quality": ICP.get_param("warranty_bot.photo_quality", image_stage.DEFAULT_QUALITY),
+            "thumb_sizes": ICP.get_param("warranty_bot.photo_thumb_sizes",
+                                         ",".join(map(str, image_stage.DEFAULT_THUMB_SIZES))),
+            "workers": ICP.get_param("warranty_bot.photo_workers", image_stage.DEFAULT_WORKERS),
+        }
+        send_cfg = {
+            "global_rate": ICP.get_param("warranty_bot.send_global_rate", sender.DEFAULT_GLOBAL_RATE),
+            "chat_rate": ICP.get_param("warranty_bot.send_chat_rate", sender.DEFAULT_CHAT_RATE),
+            "group_per_min": ICP.get_param("warranty_bot.send_group_per_min", sender.DEFAULT_GROUP_PER_MIN),
+        }
+    if not token:
+        _logger.warning("[AIO] warranty_bot.bot_token topilmadi")
+        return False
+
+    # DB pool hajmi: db_maxconn'dan kichik bo'lishi kerak
+    runtime.set_db_workers(db_workers)
+    usta_cache.get_cache().configure(maxsize=cache_size, ttl=cache_ttl)
+    card_cache.get_renders().configure(maxsize=card_cache_size)
+    card_refresh.get_coalescer().configure(delay=int(refresh_delay_ms) / 1000.0)
+    image_stage.get_processor().configure(**image_cfg)
+
+    # boshqa worker'lardagi o'zgarishlar (NOTIFY) uchun tinglovchi
+    listener = pg_listener.get_listener(runtime.get_dbname())
+    listener.subscribe(usta_cache.CHANNEL, usta_cache.on_notify)
+    listener.subscribe(UPDATE_CHANNEL, _wake_consumer)
+    listener.subscribe(stage_registry.CHANNEL, stage_registry.on_notify)
+    listener.subscribe(card_sync.CHANNEL, _on_lead_notify)
+    _OUTBOX = outbox.OutboxDrainer(outbox_batch)
+    listener.subscribe(OUTBOX_CHANNEL, _wake_outbox)
+    listener.start()
 
     _BOT = Bot(token=token, default=DefaultBotProperties(parse_mode="HTML"))
-    _DP = Dispatcher()
+    # barcha chiquvchi so'rovlar rate limit va retry_after'dan o'tadi
+    _SENDER = sender.SendScheduler(**send_cfg)
+    _BOT.session.middleware(_SENDER)
+    # har bir xabarda nima ko'rsatilayotgani (o'zgarmagan kartochka qayta yuborilmaydi)
+    _BOT.session.middleware(card_cache.get_sent())
+    # FSM holati Postgres'da: restart va worker'lar orasida yo'qolmaydi
+    _DP = Dispatcher(storage=PgStorage())
     _DP.include_router(usta_router.router)
 
     _AIO_LOOP = _create_loop()
     _AIO_LOOP.create_task(_dp_startup())
-    threading.Thread(target=_AIO_LOOP.run_forever, daemon=True).start()
+    _AIO_LOOP.create_task(_consume_updates(dispatch_cfg, UpdateDeduper(dedupe_window, update_hwm)))
+    _AIO_LOOP.create_task(_flush_card_writes())
+    _AIO_LOOP.create_task(_OUTBOX.run(_BOT))
+    _AIO_THREAD = threading.Thread(target=_AIO_LOOP.run_forever, daemon=True)
+    _AIO_THREAD.start()
 
     _logger.info("[AIO] Aiogram 3 loop/dispatcher ishga tushdi.")
     return True
 
+async def _shutdown(bot, dispatcher):
+    """Loop ichida: dispatcher worker'lari, fon task'lari va taymerlar to'xtatiladi, sessiya yopiladi."""
+    if dispatcher:
+        await dispatcher.stop()
+    card_refresh.get_coalescer().clear()
+    album.get_collector().clear()
+    current = asyncio.current_task()
+    tasks = [t for t in asyncio.all_tasks() if t is not current]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    if bot:
+        await bot.session.close()
+
+def _stop_runtime():
+    """Leader'lik yo'qolganda: loop'ni to'xtatamiz, boshqa jarayon davom ettiradi."""
+    global _AIO_LOOP, _AIO_THREAD, _BOT, _DP, _SENDER, _OUTBOX
+    global _CHAT_DISPATCH, _DEDUPER, _UPDATE_WAKE, _NOTIFY_TASK
+    loop, thread, bot, dispatcher = _AIO_LOOP, _AIO_THREAD, _BOT, _CHAT_DISPATCH
+    if loop and loop.is_running():
+        future = asyncio.run_coroutine_threadsafe(_shutdown(bot, dispatcher), loop)
+        try:
+            future.result(timeout=SHUTDOWN_TIMEOUT)
+        except Exception as e:
+            _logger.warning(f"[AIO] runtime shutdown error: {e}")
+    # callback'lar (NOTIFY, dispatch_stats) o'lik loop'ga murojaat qilmasin
+    _AIO_LOOP = _AIO_THREAD = _BOT = _DP = _SENDER = _OUTBOX = None
+    _CHAT_DISPATCH = _DEDUPER = _UPDATE_WAKE = _NOTIFY_TASK = None
+    _NOTIFIED.clear()
+    if loop and loop.is_running():
+        loop.call_soon_threadsafe(loop.stop)
+        if thread:
+            thread.join(SHUTDOWN_TIMEOUT)
+    if loop and not loop.is_running() and not loop.is_closed():
+        loop.close()
+    usta_cache.invalidate()
+    card_cache.get_renders().invalidate()
+    stage_registry.invalidate()
+    # boshqa leader xabarlarni tahrirlashi mumkin — eslab qolinganlar eskiradi
+    card_cache.get_sent().clear()
+    image_stage.get_processor().shutdown()
+    _logger.warning("[AIO] leader'lik yo'qoldi — dispatcher to'xtatildi.")
+
 async def _dp_startup():
     await asyncio.sleep(0)
 
-def feed_update(update_dict: dict):
+def _wake_consumer(payload=None):
+    """PgListener callback (boshqa thread): navbatga yangi update tushdi."""
+    loop, wake = _AIO_LOOP, _UPDATE_WAKE
+    if loop and loop.is_running() and wake is not None:
+        loop.call_soon_threadsafe(wake.set)
+
+def _wake_outbox(payload=None):
+    """PgListener callback: biriktirish xabari navbatga tushdi (listener bitta callback'ni eslaydi)."""
+    if _OUTBOX:
+        _OUTBOX.wake(payload)
+
+def _on_lead_notify(payload=None):
+    """PgListener callback (boshqa thread): backend'da lead/xarajat/zapchast o'zgardi."""
+    loop, bot = _AIO_LOOP, _BOT
+    lead_ids, from_bot = card_sync.parse_payload(payload)
+    if lead_ids and loop and loop.is_running() and bot:
+        loop.call_soon_threadsafe(_queue_lead_notify, bot, lead_ids, from_bot)
+
+def _queue_lead_notify(bot, lead_ids, from_bot):
+    global _NOTIFY_TASK
+    coalescer = card_refresh.get_coalescer()
+    for lead_id in lead_ids:
+        # botning o'z yozuvi: kartochka reply.card/refresh bilan allaqachon yangilangan
+        if from_bot and coalescer.is_echo(lead_id):
+            continue
+        _NOTIFIED.add(lead_id)
+    if _NOTIFIED and (_NOTIFY_TASK is None or _NOTIFY_TASK.done()):
+        _NOTIFY_TASK = asyncio.get_running_loop().create_task(_request_refreshes(bot))
+
+def _cards_only(env, lead_ids):
+    return env["warranty.bot.card"]._leads_with_cards(lead_ids)
+
+async def _request_refreshes(bot):
     """
-    Controllerdan kelgan update (dict) -> aiogram Update -> Dispatcher.
+    Yig'ilgan NOTIFY id'lari: bitta warranty.bot.card so'rovi bilan faqat Telegram'da
+    kartochkasi borlari qoladi (ommaviy backend yozuvi minglab render qilmaydi);
+    coalescer oynasida bir lead'ning bir nechta o'zgarishi bitta edit'ga aylanadi.
     """
-    global _AIO_LOOP, _BOT, _DP
-    if not (_AIO_LOOP and _AIO_LOOP.is_running() and _BOT and _DP):
-        _logger.warning("[AIO] feed_update: loop/bot/dispatcher tayyor emas")
-        return False
+    coalescer = card_refresh.get_coalescer()
+    while _NOTIFIED:
+        lead_ids = list(_NOTIFIED)
+        _NOTIFIED.clear()
+        try:
+            lead_ids = await runtime.run_in_env(_cards_only, lead_ids)
+        except Exception as e:
+            _logger.warning(f"[AIO] lead notify filter error: {e}")
+            continue
+        for lead_id in lead_ids:
+            coalescer.request(bot, lead_id)
+
+def _fetch_updates(env, owner, skip_ids):
+    return env["warranty.bot.update"]._fetch_batch(owner, skip_ids, UPDATE_BATCH)
+
+def _ack_updates(env, ids, hwm):
+    Queue = env["warranty.bot.update"]
+    Queue._ack(ids)
+    if hwm:
+        Queue._store_hwm(hwm)
+
+async def _handle_update(item):
+    """ChatDispatcher worker'ida: bitta update'ni aiogram'ga beradi."""
+    if callable(item):
+        # chat navbatiga qo'yilgan ish (tayyor albomni saqlash)
+        await item()
+        return
+    row_id, upd, done = item
+
+    def _ack():
+        # xatolik bo'lsa ham o'chiramiz: buzuq update navbatni to'sib qo'ymasin
+        done.append(row_id)
+        if _DEDUPER:
+            _DEDUPER.done(upd.update_id)
+        # consumer darhol ack qilsin va hwm'ni saqlasin (NOTIFY/poll'ni kutmasdan)
+        if _UPDATE_WAKE is not None:
+            _UPDATE_WAKE.set()
+
+    # handler defer_ack() qilgan bo'lsa, ack release() chaqirilganda bo'ladi
+    with ack_scope(_ack):
+        # chatda yig'ilayotgan albom shu update'dan oldin saqlanadi ("✅ Tayyor" rasmlarsiz o'tmasin)
+        group_id = getattr(upd.message, "media_group_id", None)
+        await album.get_collector().flush_chat(update_chat_key(upd), keep=group_id)
+        await _DP.feed_update(_BOT, upd)
 
-    async def _feed():
+def _submit_update(row_id: int, payload: str, done: list):
+    try:
+        data = json.loads(payload)
+        # Telegram qayta yuborgan update — hech qanday DB ishisiz tashlanadi
+        if _DEDUPER.seen(data.get("update_id")):
+            done.append(row_id)
+            return
+        upd = Update.model_validate(data)
+    except Exception as e:
+        _logger.error(f"[AIO] update #{row_id} parse error: {e}")
+        done.append(row_id)
+        return
+    _CHAT_DISPATCH.submit(update_chat_key(upd), (row_id, upd, done))
+
+async def _flush_card_writes():
+    writes = card_cache.get_writes()
+    while True:
+        await asyncio.sleep(CARD_FLUSH_INTERVAL)
+        if not writes:
+            continue
         try:
-            upd = Update.model_validate(update_dict)
-            await _DP.feed_update(_BOT, upd)
+            await runtime.run_in_env(writes.flush)
         except Exception as e:
-            _logger.error(f"[AIO] feed_update error: {e}", exc_info=True)
+            _logger.warning(f"[AIO] card registry flush error: {e}")
 
-    _AIO_LOOP.call_soon_threadsafe(lambda: asyncio.create_task(_feed()))
-    return True
+def dispatch_stats() -> dict:
+    stats = _CHAT_DISPATCH.stats() if _CHAT_DISPATCH else {}
+    if _DEDUPER:
+        stats["dedupe"] = _DEDUPER.stats()
+    if _SENDER:
+        stats["send"] = _SENDER.stats()
+    stats["cards"] = card_cache.stats()
+    if _OUTBOX:
+        stats["outbox"] = _OUTBOX.stats()
+    stats["exports"] = history_export.get_export_cache().stats()
+    stats["cards"]["refresh"] = card_refresh.get_coalescer().stats()
+    stats["albums"] = album.get_collector().stats()
+    stats["images"] = image_stage.get_processor().stats()
+    return stats
+
+async def _consume_updates(dispatch_cfg: dict, deduper: UpdateDeduper):
+    """
+    Yagona consumer: navbatni partiyalab o'qiydi va ChatDispatcher'ga beradi
+    (chat ichida tartib saqlanadi, chatlar orasida parallel). Takroriy update_id'lar
+    undan oldin tashlanadi; tugallangan chegara (hwm) ack bilan birga saqlanadi.
+    Qayta ishlangan qatorlar keyingi aylanishda bitta DELETE bilan o'chiriladi;
+    jarayon o'lsa, o'chirilmaganlari keyingi ishga tushishda qayta o'qiladi.
+    Har o'qishda barcha o'chirilmagan qatorlar olinadi, faqat ishlanayotganlari
+    (in_flight) tashlanadi — kech commit bo'lgan kichik id ham o'tkazib yuborilmaydi.
+    Qatorlar lease bilan olinadi: leader almashish paytida ikki runtime bitta
+    update'ni ishlamaydi.
+    """
+    global _UPDATE_WAKE, _CHAT_DISPATCH, _DEDUPER
+    _UPDATE_WAKE = asyncio.Event()
+    _DEDUPER = deduper
+    _CHAT_DISPATCH = ChatDispatcher(_handle_update, **dispatch_cfg)
+    _CHAT_DISPATCH.start()
+    album.get_collector().configure(runner=_CHAT_DISPATCH.submit)
+    in_flight = set()   # olingan, lekin hali o'chirilmagan qatorlar
+    owner = uuid.uuid4().hex   # shu runtime'ning lease egasi
+    done = []
+    while True:
+        _UPDATE_WAKE.clear()
+        rows = []
+        try:
+            if done:
+                ids, done[:] = list(done), []
+                hwm = deduper.safe_floor()
+                try:
+                    await runtime.run_in_env(_ack_updates, ids, hwm if hwm > deduper.stored else 0)
+                except Exception:
+                    done.extend(ids)
+                    raise
+                in_flight.difference_update(ids)
+                deduper.advance(hwm)
+            await _CHAT_DISPATCH.wait_capacity()
+            rows = await runtime.run_in_env(_fetch_updates, owner, in_flight)
+        except Exception as e:
+            _logger.error(f"[AIO] update queue error: {e}", exc_info=True)
+
+        for row_id, payload in rows:
+            in_flight.add(row_id)
+            _submit_update(row_id, payload, done)
+
+        if len(rows) < UPDATE_BATCH and not done:
+            try:
+                await asyncio.wait_for(_UPDATE_WAKE.wait(), UPDATE_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# Telegram albomi (media_group_id) alohida update'lar bo'lib keladi — ularni yig'ib,
+# bitta partiya sifatida qayta ishlash.
+import asyncio
+import functools
+import logging
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_WAIT = 1.0   # soniya: albomning oxirgi qismidan keyin shuncha kutiladi
+MAX_WAIT = 5.0       # soniya: birinchi qismdan keyin bundan kechikmaydi
+
+
+class AlbumCollector:
+    """
+    Bitta (chat_key, media_group_id) qismlari oxirgisidan DEFAULT_WAIT o'tgach
+    on_complete(items) bilan bir marta chaqiriladi. Handler darhol qaytadi,
+    shuning uchun chat navbatidagi keyingi qism kutib qolmaydi. Tayyor albom
+    runner orqali o'sha chat navbatiga qo'yiladi, chatning boshqa update'i esa
+    flush_chat() bilan albom saqlanganidan keyingina ishlanadi. Loop ichida ishlatiladi.
+    """
+
+    def __init__(self, wait=DEFAULT_WAIT, max_wait=MAX_WAIT):
+        self.wait = wait
+        self.max_wait = max_wait
+        self._groups = {}    # key -> [timer handle, birinchi qism vaqti, items, on_complete]
+        self._runner = None  # runner(chat_key, job) — ChatDispatcher.submit
+        self.albums = 0
+
+    def configure(self, runner=None):
+        self._runner = runner
+
+    def add(self, key, item, on_complete):
+        """on_complete — async fn(items); birinchi qismning callback'i ishlatiladi."""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        group = self._groups.get(key)
+        if group:
+            group[0].cancel()
+            group[2].append(item)
+        else:
+            group = self._groups[key] = [None, now, [item], on_complete]
+        at = min(now + self.wait, group[1] + self.max_wait)
+        group[0] = loop.call_at(at, self._fire, key)
+
+    def _fire(self, key):
+        # guruh shu yerda olinmaydi: navbatdagi ish yetib kelguncha flush_chat ham uni ko'radi
+        job = functools.partial(self._flush, key)
+        if self._runner:
+            self._runner(key[0], job)
+        else:
+            asyncio.get_running_loop().create_task(job())
+
+    async def _flush(self, key):
+        group = self._groups.pop(key, None)
+        if not group:
+            return
+        group[0].cancel()
+        self.albums += 1
+        try:
+            await group[3](group[2])
+        except Exception as e:
+            _logger.error(f"[ALB] album {key} error: {e}", exc_info=True)
+
+    async def flush_chat(self, chat_key, keep=None):
+        """Chatning boshqa update'idan oldin: shu chatda yig'ilayotgan albomlarni darhol saqlaydi."""
+        if not self._groups:
+            return
+        for key in [k for k in self._groups if k[0] == chat_key and k[1] != keep]:
+            await self._flush(key)
+
+    def clear(self):
+        """Runtime to'xtaganda: yig'ilayotgan albomlar tashlanadi (update'lari ack qilinmagan)."""
+        for group in self._groups.values():
+            group[0].cancel()
+        self._groups.clear()
+        self._runner = None
+
+    def stats(self) -> dict:
+        return {"collecting": len(self._groups), "albums": self.albums}
+
+
+_COLLECTOR = AlbumCollector()
+
+
+def get_collector() -> AlbumCollector:
+    return _COLLECTOR
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+# Lead kartochkasi keshi: render natijasi (lead holati bo'yicha) va har bir
+# (chat, xabar)da oxirgi ko'rsatilgan matn+tugmalar xeshi.
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramBadRequest
+
+from .ttl_cache import TTLCache
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_RENDER_SIZE = 2048
+DEFAULT_RENDER_TTL = 600     # soniya: hamkor nomi kabi stamp'ga kirmaydigan o'zgarishlar uchun
+DEFAULT_SENT_SIZE = 8192
+
+# lead kartochkasiga ta'sir qiladigan bog'liq jadvallar: (model, lead maydoni)
+_STAMP_SOURCES = (
+    ("cc.finance", "lead_id"),
+    ("cc.zapchast.move", "crm_service_id"),
+    ("crm.lead.photo", "lead_id"),
+)
+
+
+def lead_stamp(lead, extra=()):
+    """
+    Kartochka holatining arzon "versiyasi": lead.write_date va bog'liq
+    yozuvlarning soni + oxirgi write_date'i (o'chirish ham sezilsin) — bitta so'rov.
+    """
+    env = lead.env
+    env.flush_all()
+    cols, params = ["l.write_date::text"], []
+    for model, fname in _STAMP_SOURCES:
+        if model not in env:
+            continue
+        table = env[model]._table
+        cols.append(f"(SELECT count(*) || '/' || coalesce(max(write_date)::text, '') FROM {table} WHERE {fname} = l.id)")
+    params.append(lead.id)
+    env.cr.execute(f"SELECT {', '.join(cols)} FROM crm_lead l WHERE l.id = %s", params)
+    row = env.cr.fetchone()
+    return (tuple(row) if row else None), tuple(extra)
+
+
+def content_hash(text, markup) -> str:
+    """Barqaror xesh (warranty.bot.card.last_hash'da jarayonlar orasida saqlanadi)."""
+    markup_json = markup.model_dump_json(exclude_none=True) if markup is not None else ""
+    return hashlib.blake2b(f"{text or ''}\x00{markup_json}".encode(), digest_size=12).hexdigest()
+
+
+class CardWrites:
+    """
+    Yuborilgandan keyingi warranty.bot.card yangilanishlari buferi: har bir
+    edit uchun alohida tranzaksiya o'rniga flush() bitta partiyada yozadi.
+    Faqat registrdagi kartochkalar (track() qilingan xabarlar) yoziladi —
+    boshqa xabarlarning edit'lari buferga tushmaydi.
+    """
+
+    def __init__(self, maxsize=DEFAULT_SENT_SIZE):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._known = OrderedDict()   # (chat_id, msg_id) — ma'lum kartochkalar (LRU)
+        self._hashes = {}     # (chat_id, msg_id) -> hash
+        self._gone = set()    # (chat_id, msg_id)
+
+    def track(self, keys):
+        """Registrdagi kartochka xabarlari (send_lead_card nishonlari, yangi ro'yxatdan o'tganlar)."""
+        with self._lock:
+            for key in keys:
+                self._known[key] = True
+                self._known.move_to_end(key)
+            while len(self._known) > self.maxsize:
+                self._known.popitem(last=False)
+
+    def sent(self, chat_id, msg_id, value):
+        key = (chat_id, msg_id)
+        with self._lock:
+            if key not in self._known:
+                return
+            self._hashes[key] = value
+            self._gone.discard(key)
+
+    def gone(self, chat_id, msg_id):
+        with self._lock:
+            self._known.pop((chat_id, msg_id), None)
+            self._hashes.pop((chat_id, msg_id), None)
+            self._gone.add((chat_id, msg_id))
+
+    def __bool__(self):
+        return bool(self._hashes or self._gone)
+
+    def flush(self, env):
+        with self._lock:
+            hashes, self._hashes = self._hashes, {}
+            gone, self._gone = self._gone, set()
+        Card = env["warranty.bot.card"].sudo()
+        Card._store_hashes([(c, m, h) for (c, m), h in hashes.items()])
+        Card._forget(list(gone))
+
+
+class SentCards(BaseRequestMiddleware):
+    """
+    Bot sessiyasi middleware'i: har bir (chat, xabar)da hozir nima ko'rsatilayotganini
+    eslab qoladi. send_lead_card xuddi shu matn+tugmalarni qayta yubormaydi —
+    Telegram'ga "message is not modified" uchun borilmaydi. Kartochka xabari
+    boshqa narsaga (zapchast ro'yxati va h.k.) tahrirlansa, xesh ham yangilanadi.
+    Loop ichida ishlatiladi.
+    """
+
+    def __init__(self, maxsize=DEFAULT_SENT_SIZE):
+        self.maxsize = maxsize
+        self._hashes = OrderedDict()
+        self.skipped = 0
+
+    def _remember(self, key, value):
+        self._hashes[key] = value
+        self._hashes.move_to_end(key)
+        while len(self._hashes) > self.maxsize:
+            self._hashes.popitem(last=False)
+
+    def clear(self):
+        self._hashes.clear()
+
+    def current(self, chat_id, msg_id):
+        """Xabardagi tarkib xeshi; "" — noma'lum tarkib; None — bu jarayon bilmaydi."""
+        return self._hashes.get((chat_id, msg_id))
+
+    def unchanged(self, chat_id, msg_id, text, markup, fallback=None) -> bool:
+        """fallback — jarayon bilmasa ishlatiladigan xesh (warranty.bot.card.last_hash)."""
+        known = self._hashes.get((chat_id, msg_id))
+        if (known if known is not None else fallback) == content_hash(text, markup):
+            self.skipped += 1
+            return True
+        return False
+
+    async def __call__(self, make_request, bot, method):
+        api_method = getattr(method, "__api_method__", "")
+        if api_method not in ("sendMessage", "editMessageText", "editMessageReplyMarkup",
+                              "editMessageCaption", "deleteMessage"):
+            return await make_request(bot, method)
+
+        chat_id = getattr(method, "chat_id", None)
+        msg_id = getattr(method, "message_id", None)
+        try:
+            result = await make_request(bot, method)
+        except TelegramBadRequest as e:
+            err = str(e).lower()
+            if api_method == "editMessageText" and "message is not modified" in err:
+                self._shown(chat_id, msg_id, content_hash(method.text, method.reply_markup))
+            elif "not found" in err:
+                self._hashes.pop((chat_id, msg_id), None)
+                _WRITES.gone(chat_id, msg_id)
+            else:
+                self._shown(chat_id, msg_id, "")
+            raise
+
+        if api_method == "sendMessage":
+            self._remember((chat_id, getattr(result, "message_id", None)),
+                           content_hash(method.text, method.reply_markup))
+        elif api_method == "editMessageText":
+            self._shown(chat_id, msg_id, content_hash(method.text, method.reply_markup))
+        elif api_method == "deleteMessage":
+            self._hashes.pop((chat_id, msg_id), None)
+            _WRITES.gone(chat_id, msg_id)
+        else:
+            # tugmalar/caption o'zgardi — tarkib endi noma'lum
+            self._shown(chat_id, msg_id, "")
+        return result
+
+    def _shown(self, chat_id, msg_id, value):
+        # registrdagi kartochka bo'lsa last_hash ham yangilanadi (partiyada)
+        self._remember((chat_id, msg_id), value)
+        _WRITES.sent(chat_id, msg_id, value)
+
+    def stats(self) -> dict:
+        return {"tracked": len(self._hashes), "skipped": self.skipped}
+
+
+_RENDERS = TTLCache(DEFAULT_RENDER_SIZE, DEFAULT_RENDER_TTL)
+_SENT = SentCards()
+_WRITES = CardWrites()
+
+
+def get_renders() -> TTLCache:
+    return _RENDERS
+
+
+def get_sent() -> SentCards:
+    return _SENT
+
+
+def get_writes() -> CardWrites:
+    return _WRITES
+
+
+def stats() -> dict:
+    return {"render": _RENDERS.stats(), "sent": _SENT.stats()}
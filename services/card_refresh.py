@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# Lead kartochkasini yangilash so'rovlarini birlashtirish (debounce).
+import asyncio
+import logging
+
+from .keyboards import render_lead_card, send_lead_card
+from .runtime import run_in_env
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_DELAY = 0.8       # soniya: oxirgi so'rovdan keyin shuncha jimlik kutiladi
+DEFAULT_MAX_DELAY = 2.5   # soniya: birinchi so'rovdan keyin bundan kechikmaydi
+ECHO_WINDOW = 5.0         # soniya: bot yangilagan lead'ning o'z yozuvi NOTIFY'i tashlanadi
+
+
+class RefreshCoalescer:
+    """
+    Bitta lead uchun ketma-ket kelgan refresh so'rovlari (10 ta foto, bir nechta
+    xarajat) bitta render + bitta edit'ga aylanadi — oxirgi holat bilan.
+    Bosqich o'zgarishi kabi darhol ko'rinishi kerak bo'lgan holatlar uchun
+    flush()/cancel() bor. Loop ichida ishlatiladi.
+    """
+
+    def __init__(self, delay=DEFAULT_DELAY, max_delay=DEFAULT_MAX_DELAY):
+        self.delay = delay
+        self.max_delay = max_delay
+        self._pending = {}      # lead_id -> [timer handle, birinchi so'rov vaqti, bot]
+        self._gen = {}          # lead_id -> avlod: eskirgan render yuborilmasin
+        self._rendered = {}     # lead_id -> bot kartochkani oxirgi marta yuborgan/yangilagan vaqt
+        self.requested = 0
+        self.emitted = 0
+        self.echoes = 0
+
+    def configure(self, delay=None, max_delay=None):
+        if delay is not None:
+            self.delay = max(0.0, float(delay))
+        if max_delay is not None:
+            self.max_delay = float(max_delay)
+        self.max_delay = max(self.delay, self.max_delay)
+
+    def request(self, bot, lead_id: int):
+        """Kartochkani "tez orada" yangilash; qayta chaqiruv taymerni suradi."""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        self.requested += 1
+        entry = self._pending.get(lead_id)
+        if entry:
+            entry[0].cancel()
+            first = entry[1]
+        else:
+            first = now
+        at = min(now + self.delay, first + self.max_delay)
+        handle = loop.call_at(at, self._fire, lead_id)
+        self._pending[lead_id] = [handle, first, bot]
+
+    def cancel(self, lead_id: int):
+        """Kutilayotgan va ishlayotgan refresh'ni bekor qiladi (yangiroq kartochka yuborilmoqda)."""
+        entry = self._pending.pop(lead_id, None)
+        if entry:
+            entry[0].cancel()
+        self._gen[lead_id] = self._gen.get(lead_id, 0) + 1
+        self._mark_rendered(lead_id)
+
+    def _mark_rendered(self, lead_id: int):
+        now = asyncio.get_running_loop().time()
+        self._rendered[lead_id] = now
+        if len(self._rendered) > 1024:
+            self._rendered = {k: t for k, t in self._rendered.items() if now - t < ECHO_WINDOW}
+
+    def is_echo(self, lead_id: int) -> bool:
+        """Bot o'zi yozgan lead NOTIFY'i: kartochka yaqinda bot tomonidan chizilgan."""
+        at = self._rendered.get(lead_id)
+        if at is not None and asyncio.get_running_loop().time() - at < ECHO_WINDOW:
+            self.echoes += 1
+            return True
+        return False
+
+    async def flush(self, bot, lead_id: int):
+        """Kutmasdan hozir yangilaydi (kutilayotgan so'rov shu bilan yopiladi)."""
+        self.cancel(lead_id)
+        await self._run(bot, lead_id)
+
+    def _fire(self, lead_id: int):
+        entry = self._pending.pop(lead_id, None)
+        if entry:
+            asyncio.get_running_loop().create_task(self._run(entry[2], lead_id))
+
+    async def _run(self, bot, lead_id: int):
+        gen = self._gen.get(lead_id, 0)
+        try:
+            card = await run_in_env(lambda env: render_lead_card(env["crm.lead"].browse(lead_id)))
+            if self._gen.get(lead_id, 0) != gen:
+                return
+            await send_lead_card(bot, card)
+            self._mark_rendered(lead_id)
+            self.emitted += 1
+        except Exception as e:
+            _logger.warning(f"[CRD] lead {lead_id} refresh error: {e}")
+        finally:
+            if lead_id not in self._pending and self._gen.get(lead_id, 0) == gen:
+                self._gen.pop(lead_id, None)
+
+    def clear(self):
+        """Runtime to'xtaganda: taymerlar shu loop bilan birga yo'qoladi."""
+        for entry in self._pending.values():
+            entry[0].cancel()
+        self._pending.clear()
+        self._gen.clear()
+        self._rendered.clear()
+
+    def stats(self) -> dict:
+        return {"pending": len(self._pending), "requested": self.requested,
+                "emitted": self.emitted, "echoes": self.echoes}
+
+
+_COALESCER = RefreshCoalescer()
+
+
+def get_coalescer() -> RefreshCoalescer:
+    return _COALESCER
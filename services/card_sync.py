@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Odoo backend'dagi o'zgarishlar (operator bosqich/summa/mahsulotni o'zgartirdi)
+# Telegram kartochkalariga NOTIFY orqali yetkaziladi.
+
+# bot runtime shu kanalni LISTEN qiladi; payload — vergul bilan ajratilgan lead id'lar
+CHANNEL = "warranty_bot_lead"
+# NOTIFY payload chegarasi 8000 bayt — id'lar bo'laklab yuboriladi
+_CHUNK = 500
+# bot runtime env'lari shu kontekst kaliti bilan ochiladi; ularning yozuvlari
+# "bot:" prefiksi bilan yuboriladi (bot kartochkani o'zi allaqachon yangilagan)
+BOT_CONTEXT_KEY = "warranty_bot"
+_BOT_PREFIX = "bot:"
+
+
+def notify_leads(env, lead_ids):
+    """Tranzaksiya ichida pg_notify — commit bo'lganda yetkaziladi, rollback'da yo'qoladi."""
+    ids = sorted({int(i) for i in lead_ids if i})
+    prefix = _BOT_PREFIX if env.context.get(BOT_CONTEXT_KEY) else ""
+    for start in range(0, len(ids), _CHUNK):
+        payload = prefix + ",".join(map(str, ids[start:start + _CHUNK]))
+        env.cr.execute("SELECT pg_notify(%s, %s)", (CHANNEL, payload))
+
+
+def parse_payload(payload: str):
+    """(lead id'lar, bot o'zi yozganmi)."""
+    payload = payload or ""
+    from_bot = payload.startswith(_BOT_PREFIX)
+    if from_bot:
+        payload = payload[len(_BOT_PREFIX):]
+    ids = []
+    for part in payload.split(","):
+        part = part.strip()
+        if part.isdigit():
+            ids.append(int(part))
+    return ids, from_bot
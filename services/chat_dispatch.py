@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+# Update'larni chat bo'yicha ketma-ket, chatlar orasida parallel (cheklangan) qayta ishlash.
+import asyncio
+import contextlib
+import contextvars
+import logging
+from collections import deque
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 16
+DEFAULT_MAX_PENDING = 1000
+
+# joriy update'ning [ack fn, kechiktirilganmi] juftligi (handler ichidan defer_ack uchun)
+_ACK = contextvars.ContextVar("warranty_bot_ack", default=None)
+
+
+class ChatDispatcher:
+    """
+    Har bir chat uchun FIFO navbat: bitta chatning update'lari qat'iy tartibda
+    (Work.PartsQty -> Work.PartsPrice kabi FSM oqimlari uchun), turli chatlar
+    esa `concurrency` ta worker'da parallel ishlaydi. Loop ichida ishlatiladi.
+    """
+
+    def __init__(self, handler, concurrency=DEFAULT_CONCURRENCY, max_pending=DEFAULT_MAX_PENDING):
+        self._handler = handler          # async handler(item)
+        self.concurrency = max(1, int(concurrency))
+        self.max_pending = max(1, int(max_pending))
+        self._queues = {}                # chat_key -> deque (chat faol bo'lsa bor)
+        self._ready = asyncio.Queue()    # navbatida ishi bor, hech kim olmagan chatlar
+        self._capacity = asyncio.Condition()
+        self._workers = []
+        self.pending = 0
+        self.in_flight = 0
+        self.submitted = 0
+        self.processed = 0
+        self.failed = 0
+        self.max_chat_depth = 0
+
+    def start(self):
+        if self._workers:
+            return
+        loop = asyncio.get_running_loop()
+        self._workers = [loop.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        """Worker'larni to'xtatadi (leader'lik yo'qolganda); navbatdagi update'lar DB'da qoladi."""
+        workers, self._workers = self._workers, []
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    def submit(self, chat_key, item):
+        q = self._queues.get(chat_key)
+        if q is None:
+            q = self._queues[chat_key] = deque()
+            self._ready.put_nowait(chat_key)
+        q.append(item)
+        self.pending += 1
+        self.submitted += 1
+        self.max_chat_depth = max(self.max_chat_depth, len(q))
+
+    async def wait_capacity(self):
+        """Kutilayotgan update'lar max_pending'dan kam bo'lguncha kutadi (backpressure)."""
+        async with self._capacity:
+            await self._capacity.wait_for(lambda: self.pending < self.max_pending)
+
+    async def _worker(self):
+        while True:
+            chat_key = await self._ready.get()
+            q = self._queues[chat_key]
+            item = q.popleft()
+            self.in_flight += 1
+            try:
+                await self._handler(item)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                _logger.error(f"[DSP] chat {chat_key} handler error: {e}", exc_info=True)
+            finally:
+                self.in_flight -= 1
+                self.pending -= 1
+                if q:
+                    # adolat uchun chat navbat oxiriga qaytadi
+                    self._ready.put_nowait(chat_key)
+                else:
+                    del self._queues[chat_key]
+                async with self._capacity:
+                    self._capacity.notify_all()
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "pending": self.pending,
+            "in_flight": self.in_flight,
+            "active_chats": len(self._queues),
+            "ready_chats": self._ready.qsize(),
+            "max_chat_depth": self.max_chat_depth,
+            "submitted": self.submitted,
+            "processed": self.processed,
+            "failed": self.failed,
+        }
+
+
+def defer_ack():
+    """
+    Handler ichida: joriy update'ni handler qaytganda emas, qaytgan release()
+    chaqirilganda ack qiladi (masalan albom saqlangandan keyin). Update
+    ChatDispatcher orqali kelmagan bo'lsa None.
+    """
+    slot = _ACK.get()
+    if slot is None:
+        return None
+    slot[1] = True
+    return slot[0]
+
+
+@contextlib.contextmanager
+def ack_scope(ack):
+    """Handler atrofida: ichida defer_ack() chaqirilmasa, chiqishda ack() qilinadi."""
+    slot = [ack, False]
+    token = _ACK.set(slot)
+    try:
+        yield
+    finally:
+        _ACK.reset(token)
+        if not slot[1]:
+            ack()
+
+
+def update_chat_key(upd):
+    """Update qaysi chat navbatiga tushishi: chat id, bo'lmasa user id, bo'lmasa update_id."""
+    try:
+        event = upd.event
+    except Exception:
+        return ("upd", upd.update_id)
+    chat = getattr(event, "chat", None) or getattr(getattr(event, "message", None), "chat", None)
+    if chat is not None:
+        return chat.id
+    user = getattr(event, "from_user", None)
+    if user is not None:
+        return user.id
+    return ("upd", upd.update_id)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# Telegram update_id bo'yicha takroriy yetkazishlarni tashlab yuborish.
+from collections import deque
+
+DEFAULT_WINDOW = 4096
+
+
+class UpdateDeduper:
+    """
+    Ish vaqtida takror faqat sirpanuvchi oyna bo'yicha aniqlanadi: oxirgi
+    `window` ta update_id (ring + set, O(1)). Telegram update'larni parallel
+    yetkazadi (101 100'dan oldin kelishi mumkin), shuning uchun "shu id'gacha
+    hammasi bor" degan chegara ish vaqtida qo'llanmaydi.
+
+    floor — ishga tushishda o'qilgan saqlangan chegara; faqat restart'dan keyingi
+    qayta yetkazishlar uchun, xotirada oshirilmaydi. Saqlanadigan chegara
+    (safe_floor) oynadan chiqib ketgan id'lardan va tugallanmagan update'lardan
+    oshmaydi — hali kelmagan yangi id'ni hech qachon qoplamaydi.
+    Loop ichida ishlatiladi (thread-safe emas).
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW, floor=0):
+        self.window = max(1, int(window))
+        self.floor = int(floor or 0)
+        self.stored = self.floor
+        self._ring = deque()
+        self._seen = set()
+        self._in_flight = set()
+        self._evicted_max = 0
+        self.duplicates = 0
+
+    def seen(self, update_id) -> bool:
+        """True — takroriy (tashlab yuborilsin); False — yangi, oynaga qo'shildi."""
+        if update_id is None:
+            return False
+        if update_id in self._seen or update_id <= self.floor:
+            self.duplicates += 1
+            return True
+        self._ring.append(update_id)
+        self._seen.add(update_id)
+        if len(self._ring) > self.window:
+            old = self._ring.popleft()
+            self._seen.discard(old)
+            self._evicted_max = max(self._evicted_max, old)
+        self._in_flight.add(update_id)
+        return False
+
+    def done(self, update_id):
+        self._in_flight.discard(update_id)
+
+    def advance(self, floor):
+        """Saqlangan chegarani eslab qoladi (ish vaqtidagi tekshiruvga ta'sir qilmaydi)."""
+        self.stored = max(self.stored, int(floor or 0))
+
+    def safe_floor(self) -> int:
+        """Saqlash mumkin bo'lgan chegara: oynadan eski va tugallanmaganlardan kichik."""
+        floor = self._evicted_max
+        if self._in_flight:
+            floor = min(floor, min(self._in_flight) - 1)
+        return max(self.stored, floor)
+
+    def stats(self) -> dict:
+        return {
+            "window": self.window,
+            "floor": self.floor,
+            "stored": self.stored,
+            "in_flight": len(self._in_flight),
+            "duplicates": self.duplicates,
+        }
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# aiogram FSM storage: Postgres (warranty.bot.fsm) + jarayon ichidagi write-through kesh.
+import copy
+import time
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+from .runtime import run_in_env
+
+DEFAULT_CACHE_TTL = 300      # soniya: keshdagi yozuv shuncha vaqt ishlatilmasa chiqariladi
+DEFAULT_CACHE_SIZE = 10000
+SWEEP_INTERVAL = 60          # soniya
+
+
+class PgStorage(BaseStorage):
+    """
+    Holat va ma'lumot har bir o'zgarishda DB'ga yoziladi (write-through),
+    o'qish keshdan. Kesh TTL bilan tozalanadi; DB'dagi tashlab ketilgan
+    sessiyalarni warranty.bot.fsm._gc_expired (cron) o'chiradi.
+    """
+
+    def __init__(self, key_builder: Optional[KeyBuilder] = None,
+                 cache_ttl: int = DEFAULT_CACHE_TTL, cache_size: int = DEFAULT_CACHE_SIZE):
+        self.key_builder = key_builder or DefaultKeyBuilder(with_destiny=True)
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        # key -> [state, data, last_used]
+        self._cache: Dict[str, list] = {}
+        self._last_sweep = time.monotonic()
+
+    # ---- kesh ----
+    def _sweep(self, now):
+        if now - self._last_sweep < SWEEP_INTERVAL and len(self._cache) <= self.cache_size:
+            return
+        self._last_sweep = now
+        expired = [k for k, v in self._cache.items() if now - v[2] > self.cache_ttl]
+        for k in expired:
+            del self._cache[k]
+        if len(self._cache) > self.cache_size:
+            oldest = sorted(self._cache.items(), key=lambda kv: kv[1][2])
+            for k, _ in oldest[:len(self._cache) - self.cache_size]:
+                del self._cache[k]
+
+    def _remember(self, key: str, state, data) -> list:
+        now = time.monotonic()
+        entry = [state, data, now]
+        self._cache[key] = entry
+        self._sweep(now)
+        return entry
+
+    async def _entry(self, key: str) -> list:
+        now = time.monotonic()
+        entry = self._cache.get(key)
+        if entry is None or now - entry[2] > self.cache_ttl:
+            row = await run_in_env(lambda env: env["warranty.bot.fsm"]._fsm_load(key))
+            state, data = row if row else (None, {})
+            return self._remember(key, state, data)
+        entry[2] = now
+        return entry
+
+    # ---- BaseStorage ----
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        k = self.key_builder.build(key)
+        value = state.state if isinstance(state, State) else state
+        row = await run_in_env(lambda env: env["warranty.bot.fsm"]._fsm_set_state(k, value))
+        self._remember(k, *row)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        entry = await self._entry(self.key_builder.build(key))
+        return entry[0]
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        k = self.key_builder.build(key)
+        data = copy.deepcopy(data or {})
+        row = await run_in_env(lambda env: env["warranty.bot.fsm"]._fsm_set_data(k, data))
+        self._remember(k, *row)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        entry = await self._entry(self.key_builder.build(key))
+        return copy.deepcopy(entry[1])
+
+    async def close(self) -> None:
+        self._cache.clear()
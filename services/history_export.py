@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+# Usta zayavkalari tarixini Excel'ga oqim bilan yozish (xotira lead soniga bog'liq emas).
+import logging
+
+from .ttl_cache import TTLCache
+
+_logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 500
+
+# usta_id -> (stamp, Telegram file_id, qatorlar soni): o'zgarmagan tarix qayta qurilmaydi
+DEFAULT_EXPORT_CACHE_SIZE = 512
+DEFAULT_EXPORT_CACHE_TTL = 24 * 3600  # soniya: stamp'ga kirmaydigan o'zgarishlar (hamkor nomi) uchun
+_EXPORTS = TTLCache(DEFAULT_EXPORT_CACHE_SIZE, DEFAULT_EXPORT_CACHE_TTL)
+
+HEADERS = ["Servis #", "Nomi", "Mijoz", "Telefon", "Manzil",
+           "Yaratilgan", "Holati", "Ish summasi", "Xarajatlar (jami)",
+           "Zapchastlar (soni)", "Izoh"]
+WIDTHS = [12, 28, 22, 18, 40, 20, 18, 14, 18, 18, 50]
+
+_FIELDS = ["service_number", "name", "partner_name", "partner_id", "phone", "partner_phone",
+           "street", "city", "state_id", "country_id", "create_date", "stage_id",
+           "work_amount", "cc_move_out_count", "description"]
+
+
+def history_domain(usta):
+    """usta — UstaInfo. user_id bo'lmasa biriktirilmagan lead'lar kirib qolmasin."""
+    dom = [("type", "=", "opportunity")]
+    if usta.user_id:
+        dom += ["|", ("usta_id", "=", usta.id), ("user_id", "=", usta.user_id)]
+    else:
+        dom.append(("usta_id", "=", usta.id))
+    return dom
+
+
+def get_export_cache() -> TTLCache:
+    return _EXPORTS
+
+
+def history_stamp(env, usta):
+    """
+    Eksport tarkibining arzon "versiyasi" (bitta so'rov): lead'lar, ularning
+    xarajatlari va zapchast harakatlari soni + oxirgi write_date.
+    """
+    env.flush_all()
+    where = "l.type = 'opportunity' AND l.active AND (l.usta_id = %s"
+    params = [usta.id]
+    if usta.user_id:
+        where += " OR l.user_id = %s"
+        params.append(usta.user_id)
+    where += ")"
+    cols = ["(SELECT count(*) || '/' || coalesce(max(write_date)::text, '') FROM l)"]
+    for model, fname in (("cc.finance", "lead_id"), ("cc.zapchast.move", "crm_service_id")):
+        if model in env:
+            cols.append(f"(SELECT count(*) || '/' || coalesce(max(x.write_date)::text, '') "
+                        f"FROM {env[model]._table} x JOIN l ON x.{fname} = l.id)")
+    env.cr.execute(f"WITH l AS (SELECT l.id, l.write_date FROM crm_lead l WHERE {where}) "
+                   f"SELECT {', '.join(cols)}", params)
+    return tuple(env.cr.fetchone())
+
+
+def _name(val):
+    # search_read many2one: (id, display_name) yoki False
+    return val[1] if val else ""
+
+
+def _expense_totals(env, lead_ids):
+    """{lead_id: xarajat summasi} — bitta read_group (bo'lak uchun)."""
+    groups = env["cc.finance"].sudo()._read_group(
+        [("lead_id", "in", lead_ids), ("direction", "=", "expense")],
+        groupby=["lead_id"], aggregates=["amount:sum"],
+    )
+    return {lead.id: int(round(total or 0)) for lead, total in groups}
+
+
+def _partner_info(env, rows):
+    """{partner_id: (manzil, telefon)} — bo'lakdagi hamkorlar uchun bitta read."""
+    partner_ids = {r["partner_id"][0] for r in rows if r["partner_id"]}
+    if not partner_ids:
+        return {}
+    return {p["id"]: (p["contact_address"] or "", p["phone"] or "")
+            for p in env["res.partner"].sudo().browse(list(partner_ids)).read(["contact_address", "phone"])}
+
+
+def _address(row, partners):
+    parts = [row["street"], row["city"], _name(row["state_id"]), _name(row["country_id"])]
+    addr = ", ".join(p for p in parts if p)
+    if not addr and row["partner_id"]:
+        addr = partners.get(row["partner_id"][0], ("", ""))[0]
+    return addr or "-"
+
+
+def _phone(row, partners):
+    if row["phone"] or row["partner_phone"]:
+        return row["phone"] or row["partner_phone"]
+    return partners.get(row["partner_id"][0], ("", ""))[1] if row["partner_id"] else ""
+
+
+def iter_history_chunks(env, usta, chunk_size=CHUNK_SIZE):
+    """(create_date desc, id desc) bo'yicha keyset bo'laklari; har bo'lakdan keyin ORM keshi tozalanadi."""
+    Lead = env["crm.lead"].sudo()
+    fields_ = [f for f in _FIELDS if f in Lead._fields]
+    base = history_domain(usta)
+    last = None
+    while True:
+        dom = list(base)
+        if last:
+            dom += ["|", ("create_date", "<", last[0]),
+                    "&", ("create_date", "=", last[0]), ("id", "<", last[1])]
+        rows = Lead.search_read(dom, fields_, order="create_date desc, id desc", limit=chunk_size)
+        if not rows:
+            return
+        for row in rows:
+            for f in _FIELDS:
+                row.setdefault(f, False)
+        yield rows
+        last = (rows[-1]["create_date"], rows[-1]["id"])
+        env.invalidate_all()
+        if len(rows) < chunk_size:
+            return
+
+
+def build_history_xlsx(env, usta, path) -> int:
+    """DB thread'ida: tarixni path'ga yozadi, qatorlar sonini qaytaradi."""
+    import xlsxwriter
+
+    if usta.company_id:
+        env = env(context=dict(env.context or {}, allowed_company_ids=[usta.company_id]))
+
+    # constant_memory: qatorlar tartib bilan diskka yoziladi, xotirada faqat joriy qator
+    wb = xlsxwriter.Workbook(path, {"constant_memory": True})
+    f_hdr = wb.add_format({"bold": True, "bg_color": "#F2F2F2", "border": 1})
+    f_txt = wb.add_format({"border": 1})
+    f_num = wb.add_format({"border": 1, "num_format": "# ##0"})
+    f_date = wb.add_format({"border": 1, "num_format": "yyyy-mm-dd hh:mm"})
+    ws = wb.add_worksheet("Zayavkalar")
+    for i, w in enumerate(WIDTHS):
+        ws.set_column(i, i, w)
+    ws.write_row(0, 0, HEADERS, f_hdr)
+
+    r = 1
+    try:
+        for rows in iter_history_chunks(env, usta):
+            expenses = _expense_totals(env, [row["id"] for row in rows])
+            partners = _partner_info(env, rows)
+            for row in rows:
+                ws.write(r, 0, (row["service_number"] or ""), f_txt)
+                ws.write(r, 1, (row["name"] or ""), f_txt)
+                ws.write(r, 2, (row["partner_name"] or _name(row["partner_id"]) or ""), f_txt)
+                ws.write(r, 3, _phone(row, partners), f_txt)
+                ws.write(r, 4, _address(row, partners), f_txt)
+                if row["create_date"]:
+                    ws.write_datetime(r, 5, row["create_date"], f_date)
+                else:
+                    ws.write(r, 5, "", f_txt)
+                ws.write(r, 6, _name(row["stage_id"]), f_txt)
+                ws.write_number(r, 7, float(row["work_amount"] or 0.0), f_num)
+                ws.write_number(r, 8, expenses.get(row["id"], 0), f_num)
+                ws.write_number(r, 9, int(row["cc_move_out_count"] or 0), f_num)
+                ws.write(r, 10, (row["description"] or "")[:2000], f_txt)
+                r += 1
+    finally:
+        wb.close()
+    return r - 1
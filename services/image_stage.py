@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# Lead fotolarini saqlashdan oldin siqish va miniatyuralar: CPU ishi loop va DB
+# thread'laridan tashqarida, alohida jarayonlarda (spawn) bajariladi.
+import asyncio
+import importlib.util
+import logging
+import multiprocessing
+import os
+import site
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import NamedTuple
+
+_logger = logging.getLogger(__name__)
+
+# bola jarayon ishchi modulni shu papkadan top-level nom bilan import qiladi;
+# papka faqat pool jarayonlarining sys.path'iga qo'shiladi (initializer)
+_WORKER_DIR = os.path.join(os.path.dirname(__file__), "imaging")
+_WORKER_MODULE = "usta_bot_imaging"
+
+DEFAULT_MAX_DIM = 1600
+DEFAULT_FORMAT = "jpeg"
+DEFAULT_QUALITY = 82
+# crm.lead.photo'dagi image_<o'lcham> maydonlari (image.mixin) oldindan to'ldiriladi
+DEFAULT_THUMB_SIZES = (1024, 512, 256, 128)
+DEFAULT_WORKERS = 2
+
+
+def _worker_module():
+    """
+    Ota jarayonda modul fayldan yuklanadi (sys.path o'zgarmaydi): funksiya
+    pickle'da "usta_bot_imaging.process" nomi bilan uzatiladi.
+    """
+    module = sys.modules.get(_WORKER_MODULE)
+    if module is None:
+        spec = importlib.util.spec_from_file_location(
+            _WORKER_MODULE, os.path.join(_WORKER_DIR, f"{_WORKER_MODULE}.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        sys.modules[_WORKER_MODULE] = module
+    return module
+
+
+class Processed(NamedTuple):
+    data: bytes
+    mimetype: str
+    thumbs: dict          # {o'lcham: bytes}; bo'sh — Odoo o'zi hisoblaydi
+
+
+def parse_sizes(value) -> tuple:
+    """"1024,512" -> (1024, 512); noto'g'ri qiymatlar tashlanadi."""
+    if isinstance(value, (tuple, list)):
+        return tuple(int(v) for v in value)
+    sizes = []
+    for part in str(value or "").split(","):
+        try:
+            size = int(part.strip())
+        except ValueError:
+            continue
+        if size > 0:
+            sizes.append(size)
+    return tuple(sizes)
+
+
+class ImageProcessor:
+    """
+    Process pool birinchi rasmda ochiladi. Xato bo'lsa (Pillow yo'q, buzilgan
+    rasm, pool yiqilgan) rasm o'zgarishsiz saqlanadi — foto yo'qolmaydi.
+    Loop ichida ishlatiladi.
+    """
+
+    def __init__(self, max_dim=DEFAULT_MAX_DIM, fmt=DEFAULT_FORMAT, quality=DEFAULT_QUALITY,
+                 thumb_sizes=DEFAULT_THUMB_SIZES, workers=DEFAULT_WORKERS):
+        self._pool = None
+        self.processed = 0
+        self.failed = 0
+        self.saved_bytes = 0
+        self.configure(max_dim, fmt, quality, thumb_sizes, workers)
+
+    def configure(self, max_dim=None, fmt=None, quality=None, thumb_sizes=None, workers=None):
+        if max_dim is not None:
+            self.max_dim = max(64, int(max_dim))
+        if fmt is not None:
+            self.fmt = fmt if fmt in ("jpeg", "webp") else DEFAULT_FORMAT
+        if quality is not None:
+            self.quality = min(95, max(10, int(quality)))
+        if thumb_sizes is not None:
+            self.thumb_sizes = parse_sizes(thumb_sizes)
+        if workers is not None:
+            workers = max(1, int(workers))
+            if self._pool and workers != getattr(self, "workers", workers):
+                self.shutdown()
+            self.workers = workers
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                initializer=site.addsitedir, initargs=(_WORKER_DIR,))
+        return self._pool
+
+    async def process(self, raw: bytes) -> Processed:
+        loop = asyncio.get_running_loop()
+        try:
+            data, mimetype, thumbs = await loop.run_in_executor(
+                self._executor(), _worker_module().process,
+                raw, self.max_dim, self.fmt, self.quality, self.thumb_sizes)
+        except BrokenProcessPool as e:
+            _logger.error(f"[IMG] process pool yiqildi: {e}")
+            self.shutdown()
+            self.failed += 1
+            return Processed(raw, "image/jpeg", {})
+        except Exception as e:
+            _logger.warning(f"[IMG] rasmni qayta ishlab bo'lmadi, asl holicha saqlanadi: {e}")
+            self.failed += 1
+            return Processed(raw, "image/jpeg", {})
+        self.processed += 1
+        self.saved_bytes += max(0, len(raw) - len(data))
+        return Processed(data, mimetype, thumbs)
+
+    def shutdown(self):
+        pool, self._pool = self._pool, None
+        if pool:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {
+            "max_dim": self.max_dim, "format": self.fmt, "quality": self.quality,
+            "thumbs": list(self.thumb_sizes), "workers": self.workers,
+            "processed": self.processed, "failed": self.failed, "saved_bytes": self.saved_bytes,
+        }
+
+
+_PROCESSOR = ImageProcessor()
+
+
+def get_processor() -> ImageProcessor:
+    return _PROCESSOR
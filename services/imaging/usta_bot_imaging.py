@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Process pool (spawn) ishchisi: faqat Pillow. Bola jarayonda odoo.addons yo'li
+# sozlanmagan, shuning uchun bu modul alohida top-level nom bilan import qilinadi
+# (services/imaging faqat pool jarayonlarining sys.path'ida) va addon paketiga bog'liq emas.
+import io
+
+from PIL import Image, ImageOps
+
+MIMETYPES = {"jpeg": "image/jpeg", "webp": "image/webp"}
+
+
+def _encode(img, fmt, quality) -> bytes:
+    out = io.BytesIO()
+    if fmt == "webp":
+        img.save(out, "WEBP", quality=quality, method=4)
+    else:
+        img.save(out, "JPEG", quality=quality, optimize=True, progressive=True)
+    return out.getvalue()
+
+
+def process(raw: bytes, max_dim: int, fmt: str, quality: int, thumb_sizes) -> tuple:
+    """
+    (asosiy rasm, mimetype, {o'lcham: miniatyura}) — EXIF bo'yicha buriladi,
+    max_dim'gacha kichraytiriladi va qayta kodlanadi. Rasmdan katta yoki teng
+    miniatyura o'rniga asosiy rasmning o'zi beriladi (image.mixin ham shunday saqlaydi).
+    """
+    fmt = fmt if fmt in MIMETYPES else "jpeg"
+    with Image.open(io.BytesIO(raw)) as src:
+        img = ImageOps.exif_transpose(src)
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        if max(img.size) > max_dim:
+            img.thumbnail((max_dim, max_dim), Image.LANCZOS)
+        main = _encode(img, fmt, quality)
+        thumbs = {}
+        for size in sorted(thumb_sizes, reverse=True):
+            if size >= max(img.size):
+                thumbs[size] = main
+                continue
+            small = img.copy()
+            small.thumbnail((size, size), Image.LANCZOS)
+            thumbs[size] = _encode(small, fmt, quality)
+    return main, MIMETYPES[fmt], thumbs
@@ -7,10 +7,13 @@ from aiogram.types import (
 )
 from aiogram.exceptions import TelegramBadRequest
 
+from . import card_cache
+
 from .usta_services import (
-    find_usta_by_tg, find_usta_by_phone, upsert_usta_tg, _lead_address,
+    find_usta_by_tg, find_usta_by_phone, upsert_usta_tg, lead_address,
     transition_lead_stage, is_ready_to_start, list_active_requests,
-    request_stage, format_rq_card, list_usta_open_leads,
+    request_stage, format_rq_card, list_usta_open_leads, load_card_data,
+    get_stage_ids,
 )
 
 router = Router()
@@ -86,15 +89,51 @@ def request_actions_kb(rq_id: int, stage: str, ready: bool=False) -> InlineKeybo
         ]])
     return InlineKeyboardMarkup(inline_keyboard=[])
 
-async def refresh_lead_card(bot: Bot, env, lead):
+def _card_targets(lead):
+    """[(chat_id, msg_id, last_hash)] — lead'ning Telegram'dagi tirik kartochkalari."""
+    targets = lead.env["warranty.bot.card"].sudo()._cards_for([lead.id]).get(lead.id, [])
+    if not targets and lead.tg_card_chat_id and lead.tg_card_msg_id:
+        # registr'dan oldin yuborilgan kartochka
+        targets = [(int(lead.tg_card_chat_id), int(lead.tg_card_msg_id), None)]
+    return targets
+
+def render_lead_card(lead):
+    """
+    DB fazasi: lead'ning barcha kartochkalari uchun matn va tugmalarni hisoblaydi:
+    ([(chat_id, msg_id, last_hash)], text, markup). Kartochka bo'lmasa None.
+    Lead va bog'liq yozuvlar o'zgarmagan bo'lsa render keshdan olinadi.
+    """
     lead = lead.sudo()
-    if not (lead.tg_card_chat_id and lead.tg_card_msg_id):
+    targets = _card_targets(lead)
+    if not targets:
+        return None
+    renders = card_cache.get_renders()
+    stamp = card_cache.lead_stamp(lead, extra=tuple(get_stage_ids(lead.env).values()))
+    found, cached = renders.get(lead.id)
+    if found and cached[0] == stamp:
+        text, markup = cached[1], cached[2]
+    else:
+        data = load_card_data(lead)[lead.id]
+        stage = request_stage(lead)
+        ready = is_ready_to_start(lead, data) if stage == "accepted" else False
+        text = format_rq_card(lead, data)
+        markup = request_actions_kb(lead.id, stage, ready)
+        renders.put(lead.id, (stamp, text, markup))
+    return targets, text, markup
+
+async def send_lead_card(bot: Bot, card):
+    """Telegram fazasi: render_lead_card natijasini yuboradi (cursor ushlanmaydi)."""
+    if not card:
         return
-    stage = request_stage(lead)
-    ready = is_ready_to_start(lead) if stage == "accepted" else False
-    text = format_rq_card(lead)
-    markup = request_actions_kb(lead.id, stage, ready)
-    await _safe_edit_message(bot, int(lead.tg_card_chat_id), int(lead.tg_card_msg_id), text, markup)
+    targets, text, markup = card
+    sent = card_cache.get_sent()
+    # edit'dan keyingi last_hash faqat registrdagi shu xabarlar uchun yoziladi
+    card_cache.get_writes().track((chat_id, msg_id) for chat_id, msg_id, _ in targets)
+    for chat_id, msg_id, last_hash in targets:
+        # xabarda aynan shu kartochka turgan bo'lsa Telegram'ga bormaymiz
+        if sent.unchanged(chat_id, msg_id, text, markup, fallback=last_hash):
+            continue
+        await _safe_edit_message(bot, chat_id, msg_id, text, markup)
 
 def _finish_confirm_kb(rq_id: int) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[[
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# Postgres advisory lock orqali leader election: dispatcher faqat bitta jarayonda ishlaydi.
+import logging
+import threading
+
+_logger = logging.getLogger(__name__)
+
+# advisory lock kaliti (har bir DB uchun alohida amal qiladi)
+LEADER_LOCK_KEY = 0x5742_4C44  # "WBLD"
+RETRY_INTERVAL = 10       # soniya: standby jarayon lock'ni shu oraliqda so'raydi
+# soniya: leader ulanishi tirikligini tekshirish — RETRY_INTERVAL'dan qisqa, aks holda
+# ulanish uzilganda yangi leader eski leader to'xtaguncha parallel ishlaydi
+HEARTBEAT_INTERVAL = 3
+
+
+class LeaderElector:
+    """
+    Session darajasidagi pg_try_advisory_lock: lock'ni ushlab turgan ulanish
+    yopilsa (jarayon o'lsa) Postgres uni avtomatik bo'shatadi, standby jarayon
+    keyingi urinishda leader bo'ladi. on_elected/on_lost elector thread'ida
+    chaqiriladi; on_elected False qaytarsa lock darhol bo'shatiladi.
+    """
+
+    def __init__(self, dbname: str, on_elected, on_lost):
+        self.dbname = dbname
+        self.on_elected = on_elected
+        self.on_lost = on_lost
+        self.is_leader = False
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="warranty-bot-leader", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self._campaign()
+            except Exception as e:
+                _logger.warning(f"[LDR] leader election xatosi: {e}")
+            if self.is_leader:
+                self.is_leader = False
+                self._notify(self.on_lost)
+            self._stop.wait(RETRY_INTERVAL)
+
+    def _campaign(self):
+        from odoo.sql_db import db_connect  # importni kechiktirib
+
+        with db_connect(self.dbname).cursor() as cr:
+            cr.execute("SELECT pg_try_advisory_lock(%s)", (LEADER_LOCK_KEY,))
+            acquired = cr.fetchone()[0]
+            cr.commit()
+            if not acquired:
+                return
+            try:
+                self.is_leader = True
+                _logger.info("[LDR] bu jarayon leader — dispatcher ishga tushadi")
+                if not self._notify(self.on_elected):
+                    # ishga tushmadi (masalan token yo'q) — lock'ni boshqalarga bo'shatamiz;
+                    # ishga tushmagan runtime uchun on_lost chaqirilmaydi
+                    self.is_leader = False
+                    return
+                # ulanish uzilsa lock ham yo'qoladi: execute xato beradi va chiqamiz
+                while not self._stop.wait(HEARTBEAT_INTERVAL):
+                    cr.execute("SELECT 1")
+                    cr.commit()
+            finally:
+                # pool ulanishi yopilmaydi — lock'ni aniq bo'shatamiz
+                try:
+                    cr.execute("SELECT pg_advisory_unlock(%s)", (LEADER_LOCK_KEY,))
+                    cr.commit()
+                except Exception:
+                    pass
+
+    def _notify(self, cb):
+        try:
+            return cb()
+        except Exception as e:
+            _logger.error(f"[LDR] callback error: {e}", exc_info=True)
+            return False
+
+
+_ELECTOR = None
+_ELECTOR_LOCK = threading.Lock()
+
+
+def get_elector(dbname: str, on_elected, on_lost) -> LeaderElector:
+    """Jarayon uchun yagona elector."""
+    global _ELECTOR
+    with _ELECTOR_LOCK:
+        if _ELECTOR is None:
+            _ELECTOR = LeaderElector(dbname, on_elected, on_lost)
+    return _ELECTOR
+
+
+def _start_runtime(dbname):
+    # aiogram faqat leader bo'lganda (elector thread'ida) yuklanadi
+    from . import aiogram_app, runtime
+    runtime.set_dbname(dbname)
+    return aiogram_app._start_runtime()
+
+
+def _stop_runtime():
+    from . import aiogram_app
+    aiogram_app._stop_runtime()
+
+
+def ensure_started(dbname: str):
+    """
+    Webhook yo'lidan: jarayonda election'ni bir marta boshlaydi. aiogram import
+    qilinmaydi va DB'ga murojaat yo'q — keyingi chaqiruvlar faqat flag tekshiradi.
+    Token yo'qligi on_elected'da (elector thread'ida) aniqlanadi.
+    """
+    if _ELECTOR is not None:
+        return
+    get_elector(dbname, on_elected=lambda: _start_runtime(dbname), on_lost=_stop_runtime).start()
+
+
+def is_leader() -> bool:
+    return bool(_ELECTOR and _ELECTOR.is_leader)
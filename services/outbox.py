@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# warranty.bot.outbox navbatini yuboruvchi: partiyalar, rate limit (SendScheduler), retry.
+import asyncio
+import html
+import logging
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from .runtime import run_in_env
+from .usta_services import lead_address
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH = 50
+POLL_INTERVAL = 30  # soniya: NOTIFY kelmasa ham (retry vaqti kelganlar uchun) tekshiriladi
+
+
+def format_assignment(lead) -> str:
+    sn = getattr(lead, "service_number", None) or lead.id
+    who = lead.partner_name or (lead.partner_id and lead.partner_id.name) or "—"
+    return "\n".join([
+        f"🆕 <b>Sizga yangi zayavka biriktirildi: #{html.escape(str(sn))}</b>",
+        f"📄 {html.escape(lead.name or '')}",
+        f"👤 {html.escape(who)}",
+        f"📍 {html.escape(lead_address(lead))}",
+    ])
+
+
+def _load_due(env, limit):
+    rows = env["warranty.bot.outbox"].sudo()._fetch_due(limit)
+    leads = env["crm.lead"].sudo().browse([r[2] for r in rows])
+    leads.mapped("partner_id.name")  # prefetch
+    out = []
+    for (row_id, chat_id, lead_id, kind, attempts), lead in zip(rows, leads):
+        kb = InlineKeyboardMarkup(inline_keyboard=[[
+            InlineKeyboardButton(text="📄 Kartochkani ochish", callback_data=f"inb:open:{lead_id}")
+        ]])
+        # Char ustun: SendScheduler per-chat limitlarini faqat int chat_id'ga qo'llaydi
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            pass
+        out.append((row_id, chat_id, format_assignment(lead), kb))
+    return out
+
+
+def _mark(env, sent_ids, failures):
+    env["warranty.bot.outbox"].sudo()._mark_results(sent_ids, failures)
+
+
+class OutboxDrainer:
+    """
+    Leader jarayonda yagona consumer. Yuborish SendScheduler orqali o'tadi —
+    yuzlab biriktirish global/per-chat limitlarga bo'ysunadi, 429 qayta yuboriladi.
+    Loop ichida ishlatiladi (wake() — istalgan thread'dan).
+    """
+
+    def __init__(self, batch=DEFAULT_BATCH):
+        self.batch = max(1, int(batch))
+        self._loop = None
+        self._wake = None
+        self.sent = 0
+        self.failed = 0
+
+    def wake(self, payload=None):
+        """PgListener callback (boshqa thread)."""
+        if self._loop and self._wake is not None and self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    async def _send(self, bot, row):
+        row_id, chat_id, text, kb = row
+        try:
+            await bot.send_message(chat_id, text, reply_markup=kb, parse_mode="HTML")
+            return row_id, None, False
+        except TelegramForbiddenError as e:
+            # usta botni bloklagan — qayta urinishdan foyda yo'q
+            return row_id, str(e), False
+        except TelegramBadRequest as e:
+            # noto'g'ri chat yoki matn — qayta yuborish ham xuddi shunday rad etiladi
+            return row_id, str(e), False
+        except Exception as e:
+            return row_id, str(e), True
+
+    async def drain_once(self, bot) -> int:
+        rows = await run_in_env(_load_due, self.batch)
+        if not rows:
+            return 0
+        results = await asyncio.gather(*(self._send(bot, row) for row in rows))
+        sent_ids = [row_id for row_id, err, _ in results if err is None]
+        failures = [(row_id, err, retry) for row_id, err, retry in results if err is not None]
+        await run_in_env(_mark, sent_ids, failures)
+        self.sent += len(sent_ids)
+        self.failed += len(failures)
+        if failures:
+            _logger.warning(f"[OBX] {len(failures)} ta xabar yuborilmadi: {failures[0][1]}")
+        return len(rows)
+
+    async def run(self, bot):
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        while True:
+            self._wake.clear()
+            processed = 0
+            try:
+                processed = await self.drain_once(bot)
+            except Exception as e:
+                _logger.error(f"[OBX] outbox error: {e}", exc_info=True)
+            if processed < self.batch:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+
+    def stats(self) -> dict:
+        return {"batch": self.batch, "sent": self.sent, "failed": self.failed}
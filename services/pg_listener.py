@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# Postgres LISTEN/NOTIFY tinglovchi: bitta thread, o'z ulanishi, kanal -> callback.
+import logging
+import selectors
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+SELECT_TIMEOUT = 50      # soniya (ulanishni tekshirib turish uchun)
+RECONNECT_DELAY = 5      # soniya
+
+
+class PgListener:
+    """
+    Odoo bus'dagi kabi: alohida cursor'ni autocommit rejimida LISTEN qiladi
+    va kelgan NOTIFY payload'larini obunachilarga uzatadi.
+    Callback'lar listener thread'ida chaqiriladi — tez va thread-safe bo'lsin.
+    """
+
+    def __init__(self, dbname: str):
+        self.dbname = dbname
+        self._handlers = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def subscribe(self, channel: str, callback):
+        """start()'dan oldin chaqiring: yangi kanal keyingi ulanishda LISTEN qilinadi."""
+        with self._lock:
+            handlers = self._handlers.setdefault(channel, [])
+            if callback not in handlers:
+                handlers.append(callback)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="warranty-bot-listen", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self._listen()
+            except Exception as e:
+                _logger.warning(f"[PGL] listener xatosi, qayta ulanamiz: {e}")
+                time.sleep(RECONNECT_DELAY)
+
+    def _listen(self):
+        from odoo.sql_db import db_connect  # importni kechiktirib
+
+        with db_connect(self.dbname).cursor() as cr, selectors.DefaultSelector() as sel:
+            with self._lock:
+                channels = list(self._handlers)
+            for channel in channels:
+                cr.execute(f'LISTEN "{channel}"')
+            cr.commit()
+            conn = cr._cnx
+            sel.register(conn, selectors.EVENT_READ)
+            _logger.info(f"[PGL] LISTEN {', '.join(channels)}")
+            while not self._stop.is_set():
+                if not sel.select(SELECT_TIMEOUT):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    note = conn.notifies.pop(0)
+                    self._dispatch(note.channel, note.payload)
+
+    def _dispatch(self, channel, payload):
+        with self._lock:
+            handlers = list(self._handlers.get(channel, ()))
+        for cb in handlers:
+            try:
+                cb(payload)
+            except Exception as e:
+                _logger.error(f"[PGL] {channel} callback error: {e}", exc_info=True)
+
+
+_LISTENER = None
+
+
+def get_listener(dbname: str) -> PgListener:
+    """Jarayon uchun yagona listener (bot ishlayotgan jarayonda)."""
+    global _LISTENER
+    if _LISTENER is None:
+        _LISTENER = PgListener(dbname)
+    return _LISTENER
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# Telegram fotosini lead'ga saqlash: xotirada, takrorlanmasdan, bitta nusxada.
+import base64
+import hashlib
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+def photos_known(env, lead_id: int, file_unique_ids) -> set:
+    """Yuklab olishdan oldin: shu lead'ga allaqachon saqlangan Telegram fayllari (bitta so'rov)."""
+    ids = [u for u in file_unique_ids if u]
+    if not ids:
+        return set()
+    photos = env["crm.lead.photo"].sudo().search_read(
+        [("lead_id", "=", lead_id), ("tg_file_unique_id", "in", ids)], ["tg_file_unique_id"])
+    return {p["tg_file_unique_id"] for p in photos}
+
+
+def photo_known(env, lead_id: int, file_unique_id: str) -> bool:
+    return file_unique_id in photos_known(env, lead_id, [file_unique_id])
+
+
+def _store_thumbs(env, photos, thumbs_list):
+    """
+    image.mixin miniatyuralari (image_1024 ... image_128) stored related maydonlar:
+    create'ga berilgan qiymatlar image_1920'dan qayta hisoblanadi. Shuning uchun
+    ular create'dan keyin, hisoblash navbatidan olinib, protecting ostida yoziladi —
+    process pool'da tayyorlangan miniatyuralar tranzaksiya ichida qayta o'lchanmaydi.
+    """
+    Photo = env["crm.lead.photo"]
+    for photo, thumbs in zip(photos, thumbs_list):
+        vals = {}
+        for size, thumb in (thumbs or {}).items():
+            fname = f"image_{size}"
+            if fname in Photo._fields and fname != "image_1920":
+                vals[fname] = base64.b64encode(thumb)
+        if not vals:
+            continue
+        fields_ = [Photo._fields[fname] for fname in vals]
+        with env.protecting(fields_, photo):
+            for field in fields_:
+                env.remove_to_compute(field, photo)
+            photo.write(vals)
+
+
+def ingest_photos(env, lead_id: int, items, name: str = "photo") -> int:
+    """
+    DB fazasi, bitta tranzaksiya: items — [(image_stage.Processed, file_unique_id)].
+    Saqlanganlar sonini qaytaradi; lead'da bor rasmlar (file_unique_id yoki
+    siqilgan baytlarning sha1'i bo'yicha) tashlanadi. Baytlar bitta base64 bilan
+    ikkala modelga beriladi: rasm allaqachon max_dim'gacha kichraytirilgan,
+    shuning uchun image_1920 qayta kodlanmaydi va filestore ikkala attachment'ni
+    bitta checksum faylida saqlaydi.
+    """
+    known = photos_known(env, lead_id, [uid for _, uid in items])
+    Attachment = env["ir.attachment"].sudo()
+    Photo = env["crm.lead.photo"].sudo()
+    fresh = {}
+    for img, uid in items:
+        if uid and uid in known:
+            continue
+        fresh.setdefault(hashlib.sha1(img.data).hexdigest(), (img, uid))
+    if fresh:
+        existing = Attachment.search_read([
+            ("res_model", "=", "crm.lead"), ("res_id", "=", lead_id), ("checksum", "in", list(fresh)),
+        ], ["checksum"])
+        for att in existing:
+            fresh.pop(att["checksum"], None)
+    if not fresh:
+        return 0
+
+    encoded = [(base64.b64encode(img.data), img, uid) for img, uid in fresh.values()]
+    atts = Attachment.create([{
+        "name": f"{name}.{img.mimetype.split('/')[-1].replace('jpeg', 'jpg')}",
+        "datas": data_b64,
+        "res_model": "crm.lead",
+        "res_id": lead_id,
+        "mimetype": img.mimetype,
+    } for data_b64, img, _ in encoded])
+    photos = Photo.create([{
+        "lead_id": lead_id,
+        "name": "Foto",
+        "image_1920": data_b64,
+        "note": "",
+        "tg_file_unique_id": uid or False,
+    } for data_b64, _, uid in encoded])
+    _store_thumbs(env, photos, [img.thumbs for _, img, _ in encoded])
+    env["crm.lead"].sudo().browse(lead_id).write({"photo_attachment_ids": [(4, att.id) for att in atts]})
+    return len(encoded)
+
+
+def ingest_photo(env, lead_id: int, img, file_unique_id: str = None, name: str = "photo") -> bool:
+    """Bitta rasm (image_stage.Processed); False — bu rasm lead'da bor."""
+    return bool(ingest_photos(env, lead_id, [(img, file_unique_id)], name=name))
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# Handler javoblari rejasi: DB fazasi Reply yig'adi, yuborish fazasi cursor'siz ishlaydi.
+from aiogram import Bot
+from aiogram.types import CallbackQuery
+
+from .keyboards import send_lead_card
+from .card_refresh import get_coalescer
+from .runtime import run_in_env
+
+
+class Reply:
+    """
+    DB fazasida (run_in_env ichida) to'ldiriladigan yuborishlar ro'yxati.
+    Faqat tayyor matn/markup saqlanadi, recordset emas.
+    """
+
+    def __init__(self):
+        self._cards = []
+        self._refreshes = []
+        self._messages = []
+        self._callback = None
+        self.result = None
+
+    def card(self, card, lead_id=None):
+        """
+        render_lead_card natijasini darhol tahrirlash uchun qo'shadi (bosqich
+        o'zgarishi). lead_id berilsa, shu lead'ning kutilayotgan refresh'i bekor qilinadi.
+        """
+        if lead_id:
+            self._refreshes.append((lead_id, False))
+        if card:
+            self._cards.append(card)
+        return self
+
+    def refresh(self, lead_id):
+        """Kartochkani birlashtirilgan (debounce) refresh orqali yangilash."""
+        self._refreshes.append((lead_id, True))
+        return self
+
+    def message(self, text, **kwargs):
+        """Chatga yangi xabar (m.answer / c.message.answer)."""
+        self._messages.append((text, kwargs))
+        return self
+
+    def callback(self, text=None, show_alert=False):
+        """CallbackQuery javobi (c.answer)."""
+        self._callback = (text, show_alert)
+        return self
+
+    async def send(self, event, bot: Bot = None):
+        bot = bot or event.bot
+        is_cb = isinstance(event, CallbackQuery)
+        # callback spinner'ini birinchi yopamiz
+        if is_cb and self._callback is not None:
+            text, show_alert = self._callback
+            await event.answer(text, show_alert=show_alert)
+        coalescer = get_coalescer()
+        for lead_id, deferred in self._refreshes:
+            if deferred:
+                coalescer.request(bot, lead_id)
+            else:
+                coalescer.cancel(lead_id)
+        for card in self._cards:
+            await send_lead_card(bot, card)
+        target = event.message if is_cb else event
+        for text, kwargs in self._messages:
+            await target.answer(text, **kwargs)
+
+
+async def db_phase(fn, *args, **kwargs) -> Reply:
+    """
+    fn(env, reply, *args, **kwargs) ni bitta tranzaksiyada bajaradi.
+    Commit bo'lgandan keyin to'ldirilgan Reply qaytadi — uni send() qiling.
+    fn qaytargan qiymat reply.result'da bo'ladi (masalan FSM qarori uchun).
+    """
+    def _run(env):
+        reply = Reply()
+        reply.result = fn(env, reply, *args, **kwargs)
+        return reply
+    return await run_in_env(_run)
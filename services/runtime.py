@@ -1,9 +1,24 @@
 # -*- coding: utf-8 -*-
 # Global DB konteyner va env ochish utilitilari (thread-safe, import-safe)
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
+from functools import partial
+
+from .card_sync import BOT_CONTEXT_KEY
+
+_logger = logging.getLogger(__name__)
 
 _DBNAME = None
 
+# DB ishlari uchun cheklangan thread pool (aiogram loop'ini bloklamaslik uchun)
+DEFAULT_DB_WORKERS = 4
+_DB_WORKERS = DEFAULT_DB_WORKERS
+_DB_EXECUTOR = None
+_EXECUTOR_LOCK = threading.Lock()
+
 def set_dbname(dbname: str):
     """Aiogram ishga tushganda DB nomini saqlab qo'yamiz."""
     global _DBNAME
@@ -12,6 +27,35 @@ def set_dbname(dbname: str):
 def get_dbname() -> str:
     return _DBNAME
 
+def set_db_workers(count):
+    """
+    DB pool hajmini belgilaydi (warranty_bot.db_workers).
+    Pool birinchi marta ishlatilgandan keyin o'zgartirilmaydi.
+    """
+    global _DB_WORKERS
+    try:
+        count = int(count)
+    except (TypeError, ValueError):
+        count = DEFAULT_DB_WORKERS
+    _DB_WORKERS = max(1, count)
+
+def _db_thread_init(dbname):
+    # Odoo logger'lari thread'dagi dbname'ni ko'rsatadi
+    threading.current_thread().dbname = dbname
+
+def get_db_executor() -> ThreadPoolExecutor:
+    global _DB_EXECUTOR
+    if _DB_EXECUTOR is None:
+        with _EXECUTOR_LOCK:
+            if _DB_EXECUTOR is None:
+                _DB_EXECUTOR = ThreadPoolExecutor(
+                    max_workers=_DB_WORKERS,
+                    thread_name_prefix="warranty-bot-db",
+                    initializer=_db_thread_init,
+                    initargs=(_DBNAME,),
+                )
+    return _DB_EXECUTOR
+
 @contextmanager
 def open_env():
     """
@@ -20,15 +64,40 @@ def open_env():
     """
     if not _DBNAME:
         raise RuntimeError("Runtime DB is not configured. Call runtime.set_dbname(db) first.")
+    if _on_event_loop():
+        # tranzaksiya Telegram I/O davomida ochiq qolmasin: run_in_env() ishlating
+        _logger.warning("[RT] open_env() event loop thread'ida chaqirildi", stack_info=True)
 
     from odoo import api, SUPERUSER_ID  # importni kechiktirib
     from odoo.sql_db import db_connect   # importni kechiktirib
 
     with db_connect(_DBNAME).cursor() as cr:
-        env = api.Environment(cr, SUPERUSER_ID, {})
+        # kontekst kaliti: bot yozuvlarining NOTIFY'lari aks-sado sifatida tanib olinadi
+        env = api.Environment(cr, SUPERUSER_ID, {BOT_CONTEXT_KEY: True})
         try:
             yield env
             cr.commit()
         except Exception:
             cr.rollback()
             raise
+
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+def call_in_env(fn, *args, **kwargs):
+    """fn(env, *args, **kwargs) ni o'z cursori bilan bitta tranzaksiyada bajaradi."""
+    with open_env() as env:
+        return fn(env, *args, **kwargs)
+
+async def run_in_env(fn, *args, **kwargs):
+    """
+    fn(env, *args, **kwargs) ni DB pool thread'ida bajaradi va natijasini qaytaradi.
+    Har bir chaqiruv o'z cursori/tranzaksiyasiga ega; loop faqat Telegram I/O bilan band.
+    fn ichida recordset emas, oddiy qiymatlar (int, str, dict) qaytaring.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_db_executor(), partial(call_in_env, fn, *args, **kwargs))
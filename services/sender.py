@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+# Chiquvchi Bot API so'rovlari rejalashtiruvchisi: token bucket limitlari,
+# retry_after va ustuvorlik (callback javoblari bulk yuborishlardan oldin).
+import asyncio
+import logging
+import time
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_GLOBAL_RATE = 30.0      # xabar/soniya (butun bot)
+DEFAULT_CHAT_RATE = 1.0         # xabar/soniya (bitta shaxsiy chat)
+DEFAULT_CHAT_BURST = 3
+DEFAULT_GROUP_PER_MIN = 20      # xabar/daqiqa (guruh)
+MAX_RETRIES = 3
+BUCKET_IDLE_TTL = 300           # soniya: ishlatilmagan chat bucket'lari tozalanadi
+
+# ustuvorlik yo'laklari: kichik raqam — oldinroq
+LANE_CALLBACK = 0
+LANE_EDIT = 1
+LANE_BULK = 2
+LANE_NAMES = {LANE_CALLBACK: "callback", LANE_EDIT: "edit", LANE_BULK: "bulk"}
+
+_LANE_BY_METHOD = {
+    "answerCallbackQuery": LANE_CALLBACK,
+    "editMessageText": LANE_EDIT,
+    "editMessageReplyMarkup": LANE_EDIT,
+    "editMessageCaption": LANE_EDIT,
+    "deleteMessage": LANE_EDIT,
+}
+# chat'ga xabar yubormaydigan so'rovlar limitlanmaydi
+_UNLIMITED = {"getFile", "getMe", "getUpdates", "setWebhook", "deleteWebhook", "getWebhookInfo"}
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "stamp", "paused_until")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.stamp = time.monotonic()
+        self.paused_until = 0.0
+
+    def delay(self, now: float) -> float:
+        """Bitta token uchun qancha kutish kerak (0 — hozir mumkin)."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        wait = max(0.0, self.paused_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class SendScheduler(BaseRequestMiddleware):
+    """
+    Bot sessiyasiga ulanadigan request middleware: barcha m.answer /
+    edit_message_text / answer_document shu yerdan o'tadi. Limitga yetganda
+    so'rov kutadi, 429 kelsa retry_after'dan keyin qayta yuboriladi.
+    """
+
+    def __init__(self, global_rate=DEFAULT_GLOBAL_RATE, chat_rate=DEFAULT_CHAT_RATE,
+                 group_per_min=DEFAULT_GROUP_PER_MIN, chat_burst=DEFAULT_CHAT_BURST):
+        self.global_bucket = TokenBucket(float(global_rate), float(global_rate))
+        self.chat_rate = float(chat_rate)
+        self.chat_burst = float(chat_burst)
+        self.group_rate = float(group_per_min) / 60.0
+        self._chats = {}
+        self._last_gc = time.monotonic()
+        self._waiting = {lane: 0 for lane in LANE_NAMES}
+        # faqat global token kutayotganlar (chat bucket'i tayyor, 429 pauzasida emas)
+        self._global_waiting = {lane: 0 for lane in LANE_NAMES}
+        self.sent = 0
+        self.throttled = 0
+        self.retries = 0
+        self.failed = 0
+        self.wait_seconds = 0.0
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if chat_id < 0:
+                bucket = TokenBucket(self.group_rate, self.group_rate * 60)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _gc(self, now):
+        if now - self._last_gc < BUCKET_IDLE_TTL:
+            return
+        self._last_gc = now
+        idle = [k for k, b in self._chats.items() if now - b.stamp > BUCKET_IDLE_TTL]
+        for k in idle:
+            del self._chats[k]
+
+    def _higher_waiting(self, lane: int) -> bool:
+        """
+        Ustuvorroq yo'lakda global token kutayotgan so'rov bormi. O'z chat
+        bucket'ini yoki chat 429 pauzasini kutayotganlar hisoblanmaydi — aks holda
+        bitta sekin chat boshqa hamma chatlarning yuborishlarini to'xtatib qo'yadi.
+        """
+        return any(n for ln, n in self._global_waiting.items() if ln < lane)
+
+    async def _acquire(self, chat_id, lane: int):
+        chat_bucket = self._chat_bucket(chat_id) if isinstance(chat_id, int) else None
+        started = time.monotonic()
+        self._waiting[lane] += 1
+        on_global = False
+        try:
+            while True:
+                now = time.monotonic()
+                global_wait = self.global_bucket.delay(now)
+                chat_wait = chat_bucket.delay(now) if chat_bucket is not None else 0.0
+                blocked = bool(global_wait) and not chat_wait
+                if blocked != on_global:
+                    self._global_waiting[lane] += 1 if blocked else -1
+                    on_global = blocked
+                wait = max(global_wait, chat_wait)
+                if not wait and self._higher_waiting(lane):
+                    # ustuvorroq yo'lakka global token qoldiramiz
+                    wait = 1.0 / self.global_bucket.rate
+                if not wait:
+                    self.global_bucket.take()
+                    if chat_bucket is not None:
+                        chat_bucket.take()
+                    break
+                await asyncio.sleep(wait)
+        finally:
+            self._waiting[lane] -= 1
+            if on_global:
+                self._global_waiting[lane] -= 1
+        waited = time.monotonic() - started
+        if waited > 0.001:
+            self.throttled += 1
+            self.wait_seconds += waited
+        self._gc(time.monotonic())
+
+    async def __call__(self, make_request, bot, method):
+        api_method = getattr(method, "__api_method__", "")
+        if api_method in _UNLIMITED:
+            return await make_request(bot, method)
+        lane = _LANE_BY_METHOD.get(api_method, LANE_BULK)
+        chat_id = getattr(method, "chat_id", None)
+
+        for attempt in range(MAX_RETRIES + 1):
+            await self._acquire(chat_id, lane)
+            try:
+                result = await make_request(bot, method)
+                self.sent += 1
+                return result
+            except TelegramRetryAfter as e:
+                self.retries += 1
+                if attempt >= MAX_RETRIES:
+                    self.failed += 1
+                    raise
+                _logger.warning(f"[SND] {api_method} chat={chat_id}: 429, {e.retry_after}s kutamiz")
+                if isinstance(chat_id, int):
+                    self._chat_bucket(chat_id).pause(e.retry_after)
+                else:
+                    self.global_bucket.pause(e.retry_after)
+
+    def stats(self) -> dict:
+        return {
+            "waiting": {LANE_NAMES[ln]: n for ln, n in self._waiting.items()},
+            "chats_tracked": len(self._chats),
+            "sent": self.sent,
+            "throttled": self.throttled,
+            "wait_seconds": round(self.wait_seconds, 3),
+            "retries": self.retries,
+            "failed": self.failed,
+        }
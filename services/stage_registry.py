@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+# crm.stage reyestri: bosqichlar bir marta o'qiladi, har biri oldindan
+# klassifikatsiya qilinadi; request_stage / transition uchun O(1) lookup.
+import logging
+import threading
+from typing import NamedTuple, Optional
+
+_logger = logging.getLogger(__name__)
+
+# boshqa worker'lar uchun bekor qilish signali (pg_notify kanali)
+CHANNEL = "warranty_bot_stage"
+# shu prefiksdagi ir.config_parameter o'zgarsa reyestr qayta o'qiladi
+PARAM_PREFIX = "warranty_bot.stage_"
+
+CLOSED_KEYWORDS = ("done", "finished", "closed", "cancel", "lost", "won", "yopildi", "tugadi", "bekor")
+
+# transition_lead_stage maqsadlari -> nom bo'laklari (ustuvorlik tartibida)
+TARGET_NAMES = {
+    "accepted": ("Qabul", "Accept"),
+    "waiting":  ("Kutilmoqda", "Waiting", "Pending", "Qabul"),
+    "progress": ("Boshlandi", "Progress", "In Progress"),
+    "done":     ("Tasdiq", "Done", "Yakun", "Finished"),
+}
+
+
+class StageInfo(NamedTuple):
+    id: int
+    name: str
+    sequence: int
+    fold: bool
+    team_ids: tuple       # bo'sh — hamma jamoalar uchun
+    company_id: int
+    cls: str              # new | waiting | accepted | progress | done
+    closed: bool          # aktiv ro'yxatda ko'rsatilmaydi
+
+
+def _param_int(ICP, key):
+    try:
+        return int(ICP.get_param(key, "") or 0)
+    except Exception:
+        return 0
+
+
+def _classify(sid: int, name: str, cfg: dict) -> str:
+    if sid and cfg.get("done") and sid == cfg["done"]:
+        return "done"
+    if sid and cfg.get("progress") and sid == cfg["progress"]:
+        return "progress"
+    if sid and cfg.get("waiting") and sid == cfg["waiting"]:
+        return "waiting"
+    if sid and cfg.get("accept") and sid == cfg["accept"]:
+        return "accepted"
+    name = (name or "").lower()
+    if "yakunlandi" in name or "done" in name or "finished" in name:
+        return "done"
+    if "jarayonda" in name or "progress" in name:
+        return "progress"
+    if "kutilmoqda" in name or "waiting" in name or "pending" in name:
+        return "waiting"
+    if "qabul" in name or "accept" in name:
+        return "accepted"
+    return "new"
+
+
+class StageRegistry:
+    """
+    Bitta DB uchun snapshot. Yozuvlar o'zgarmas, shuning uchun o'qish lock'siz;
+    bekor qilinganda butun snapshot almashtiriladi. Jamoa/kompaniya bo'yicha
+    maqsad bosqichlar birinchi so'rovda hisoblanib, eslab qolinadi.
+    """
+
+    def __init__(self, stages, config):
+        self.config = config
+        self._stages = {st.id: st for st in stages}
+        self._ordered = sorted(stages, key=lambda st: (st.sequence, st.id))
+        self.closed_ids = frozenset(st.id for st in stages if st.closed)
+        self._targets = {}
+
+    @classmethod
+    def load(cls, env) -> "StageRegistry":
+        ICP = env["ir.config_parameter"].sudo()
+        waiting = _param_int(ICP, "warranty_bot.stage_waiting_id")
+        config = {
+            "waiting":  waiting,
+            "accept":   waiting,
+            "progress": _param_int(ICP, "warranty_bot.stage_progress_id"),
+            "done":     _param_int(ICP, "warranty_bot.stage_done_id"),
+        }
+        Stage = env["crm.stage"].sudo()
+        fields_ = Stage._fields
+        stages = []
+        for st in Stage.search([]):
+            if "team_ids" in fields_:
+                team_ids = tuple(st.team_ids.ids)
+            elif "team_id" in fields_:
+                team_ids = (st.team_id.id,) if st.team_id else ()
+            else:
+                team_ids = ()
+            name = st.name or ""
+            closed = (
+                bool(getattr(st, "is_won", False))
+                or bool(getattr(st, "is_lost", False))
+                or bool(getattr(st, "fold", False))
+                or any(kw in name.lower() for kw in CLOSED_KEYWORDS)
+            )
+            stages.append(StageInfo(
+                id=st.id,
+                name=name,
+                sequence=getattr(st, "sequence", 0) or 0,
+                fold=bool(getattr(st, "fold", False)),
+                team_ids=team_ids,
+                company_id=st.company_id.id if "company_id" in fields_ and st.company_id else False,
+                cls=_classify(st.id, name, config),
+                closed=closed,
+            ))
+        return cls(stages, config)
+
+    def get(self, stage_id) -> Optional[StageInfo]:
+        return self._stages.get(stage_id)
+
+    def stage_class(self, stage_id) -> str:
+        st = self._stages.get(stage_id)
+        return st.cls if st else "new"
+
+    def is_closed(self, stage_id) -> bool:
+        st = self._stages.get(stage_id)
+        return bool(st and st.closed)
+
+    def _for_team(self, team_id, company_id):
+        for st in self._ordered:
+            if team_id and st.team_ids and team_id not in st.team_ids:
+                continue
+            if company_id and st.company_id and st.company_id != company_id:
+                continue
+            yield st
+
+    def find_stage(self, team_id, company_id, names_like) -> Optional[int]:
+        """Nom bo'laklari bo'yicha birinchi mos bosqich (ilike, sequence tartibida)."""
+        key = (tuple(names_like), team_id or False, company_id or False)
+        if key not in self._targets:
+            found = None
+            candidates = list(self._for_team(team_id, company_id))
+            for frag in names_like:
+                frag = frag.lower()
+                found = next((st.id for st in candidates if frag in st.name.lower()), None)
+                if found:
+                    break
+            self._targets[key] = found
+        return self._targets[key]
+
+    def target_stage(self, target: str, team_id, company_id) -> Optional[int]:
+        return self.find_stage(team_id, company_id, TARGET_NAMES.get(target, ()))
+
+    def next_open_stage(self, team_id, company_id, current_id) -> Optional[int]:
+        stages = [st for st in self._for_team(team_id, company_id) if not st.fold]
+        if not stages:
+            return None
+        cur = self._stages.get(current_id)
+        cur_seq = cur.sequence if cur else -1
+        for st in stages:
+            if st.sequence >= cur_seq and st.id != current_id:
+                return st.id
+        for st in stages:
+            if st.id != current_id:
+                return st.id
+        return None
+
+    def same_name_for_team(self, stage_id, team_id) -> Optional[int]:
+        """move_lead_to_stage: shu nomdagi, lead jamoasiga tegishli bosqich."""
+        st = self._stages.get(stage_id)
+        if not st:
+            return None
+        for other in self._for_team(team_id, False):
+            if other.name == st.name:
+                return other.id
+        return st.id
+
+
+_REGISTRIES = {}
+_VERSION = {}
+_LOCK = threading.Lock()
+
+
+def get_registry(env) -> StageRegistry:
+    dbname = env.cr.dbname
+    reg = _REGISTRIES.get(dbname)
+    if reg is not None:
+        return reg
+    with _LOCK:
+        version = _VERSION.get(dbname, 0)
+    reg = StageRegistry.load(env)
+    with _LOCK:
+        # yuklash paytida bekor qilingan bo'lsa eskirgan snapshot saqlanmaydi
+        if _VERSION.get(dbname, 0) == version:
+            _REGISTRIES[dbname] = reg
+    return reg
+
+
+def invalidate(dbname=None):
+    with _LOCK:
+        dbnames = [dbname] if dbname else list(set(_REGISTRIES) | set(_VERSION))
+        for name in dbnames:
+            _VERSION[name] = _VERSION.get(name, 0) + 1
+            _REGISTRIES.pop(name, None)
+
+
+def on_notify(payload: str):
+    """PgListener callback: boshqa worker'da crm.stage yoki sozlama o'zgardi."""
+    invalidate((payload or "").strip() or None)
+
+
+def notify_changed(env):
+    """
+    Model override'laridan: shu worker'da darhol va commit/rollback'dan keyin
+    bekor qiladi, boshqa worker'larga pg_notify (commit'da yetkaziladi).
+    """
+    dbname = env.cr.dbname
+    invalidate(dbname)
+    env.cr.execute("SELECT pg_notify(%s, %s)", (CHANNEL, dbname))
+    env.cr.postcommit.add(lambda: invalidate(dbname))
+    env.cr.postrollback.add(lambda: invalidate(dbname))
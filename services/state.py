@@ -17,6 +17,7 @@ class Work(StatesGroup):
     ExpNote = State()
     
     PartsPick = State()    
+    PartsSearch = State()  # kod boshi yoki nom bo'lagi
     PartsQty  = State()    
     PartsPrice = State()   
 
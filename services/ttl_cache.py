@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# Umumiy LRU + TTL kesh (usta identifikatsiyasi, kartochka renderlari, eksportlar).
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Thread-safe LRU+TTL kesh; kalitlar str'ga keltiriladi, qiymat None ham bo'lishi mumkin."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def configure(self, maxsize=None, ttl=None):
+        with self._lock:
+            if maxsize:
+                self.maxsize = max(1, int(maxsize))
+            if ttl:
+                self.ttl = max(1, int(ttl))
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get(self, key):
+        """(topildi, qiymat) qaytaradi."""
+        key = str(key)
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < now:
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return False, None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return True, item[1]
+
+    def put(self, key, value):
+        key = str(key)
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, keys=None):
+        """keys=None bo'lsa hammasi tozalanadi."""
+        with self._lock:
+            self.invalidations += 1
+            if keys is None:
+                self._data.clear()
+                return
+            for key in keys:
+                self._data.pop(str(key), None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+            }
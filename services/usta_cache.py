@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# tg_user_id -> UstaInfo keshi (LRU + TTL), cc.employee o'zgarishida tozalanadi.
+from .runtime import run_in_env
+from .ttl_cache import TTLCache
+from .usta_services import find_usta_snapshot
+
+# boshqa worker'lar uchun bekor qilish signali (pg_notify kanali)
+CHANNEL = "warranty_bot_usta"
+# kanal payload'i: vergul bilan ajratilgan tg_user_id'lar yoki "*" (hammasi)
+ALL = "*"
+
+DEFAULT_MAXSIZE = 4096
+DEFAULT_TTL = 300  # soniya
+
+
+class UstaCache(TTLCache):
+    """
+    tg_user_id -> UstaInfo. Qiymat None bo'lishi ham mumkin (ro'yxatdan
+    o'tmagan foydalanuvchi) — bu ham kesh, chunki create() uni bekor qiladi.
+    """
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE, ttl=DEFAULT_TTL):
+        super().__init__(maxsize, ttl)
+
+
+_CACHE = UstaCache()
+
+
+def get_cache() -> UstaCache:
+    return _CACHE
+
+
+def invalidate(keys=None):
+    _CACHE.invalidate(keys)
+
+
+def on_notify(payload: str):
+    """PgListener callback: boshqa worker'dagi cc.employee o'zgarishi."""
+    payload = (payload or "").strip()
+    if not payload or payload == ALL:
+        invalidate()
+    else:
+        invalidate([k for k in payload.split(",") if k])
+
+
+async def resolve_usta(tg_user_id):
+    """Keshdan UstaInfo (yoki None); kesh o'tkazib yuborsa DB'dan o'qiydi."""
+    found, usta = _CACHE.get(tg_user_id)
+    if found:
+        return usta
+    usta = await run_in_env(find_usta_snapshot, tg_user_id)
+    _CACHE.put(tg_user_id, usta)
+    return usta
@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
-import os, tempfile, logging, base64
+import asyncio, html, io, os, tempfile, logging
 from aiogram import Router, F, types, Bot
-from aiogram.filters import CommandStart
+from aiogram.filters import CommandStart, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.types import (
     ReplyKeyboardMarkup, KeyboardButton,
@@ -11,19 +11,28 @@ from aiogram.types import (
 from aiogram.exceptions import TelegramBadRequest
 from odoo import fields
 
-from .runtime import open_env
+from .runtime import run_in_env
 from .usta_services import (
-    find_usta_by_tg, find_usta_by_phone, upsert_usta_tg, _lead_address,
-    transition_lead_stage, is_ready_to_start, list_active_requests,
-    request_stage, format_rq_card, list_usta_open_leads, expense_total_for_lead,
+    UstaInfo, find_usta_by_phone, upsert_usta_tg,
+    transition_lead_stage, is_ready_to_start,
+    request_stage, format_rq_card, list_usta_open_leads,
+    load_card_data, lead_cursor, list_usta_parts, PARTS_PAGE_SIZE, open_leads_domain,
     get_stage_ids, move_lead_to_stage, finance_exists_for_lead,  # <-- added import
 )
 from .state import Reg, Work
 from .keyboards import (
-    _safe_edit_message, main_kb, share_phone_kb, request_actions_kb,
-    refresh_lead_card, photo_done_kb, expense_type_kb
+    main_kb, share_phone_kb, request_actions_kb,
+    render_lead_card, photo_done_kb, expense_type_kb
 )
 from .middlewares import UstaStatusMiddleware
+from .replies import db_phase
+from .card_refresh import get_coalescer
+from .photo_ingest import photo_known, photos_known, ingest_photo, ingest_photos
+from .album import get_collector as get_album_collector
+from .chat_dispatch import defer_ack
+from .image_stage import get_processor as get_image_processor
+from .history_export import build_history_xlsx, history_stamp, get_export_cache
+from . import card_cache
 
 router = Router()
 _logger = logging.getLogger(__name__)
@@ -41,14 +50,7 @@ def get_stage_names():
     }
 
 
-def _paginate(items, page: int, per_page: int = 8):
-    total = len(items)
-    start = max(page * per_page, 0)
-    end = min(start + per_page, total)
-    return items[start:end], total
-
-
-def _parts_kb(rq_id: int, items, page: int, total: int, per_page: int = 8):
+def _parts_kb(rq_id: int, items, page: int, total: int, query: str = "", per_page: int = PARTS_PAGE_SIZE):
     rows = []
     for it in items:
         rows.append([
@@ -67,32 +69,33 @@ def _parts_kb(rq_id: int, items, page: int, total: int, per_page: int = 8):
     if nav:
         rows.append(nav)
 
+    search = [InlineKeyboardButton(text="🔎 Qidirish", callback_data=f"zp:find:{rq_id}")]
+    if query:
+        search.append(InlineKeyboardButton(text="✖️ Hammasi", callback_data=f"zp:clr:{rq_id}"))
+    rows.append(search)
     rows.append([InlineKeyboardButton(text="🔙 Ortga", callback_data=f"zp:back:{rq_id}")])
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
 
-async def _show_parts_page(message_or_cb, rq_id: int, page: int = 0):
-    with open_env() as env:
-        from_user = getattr(message_or_cb, "from_user", None) or getattr(message_or_cb.message, "from_user")
-        usta = find_usta_by_tg(env, from_user.id)
-        if not usta:
-            return await message_or_cb.answer("Ro‘yxatdan o‘ting: /start")
+async def _show_parts_page(message_or_cb, usta: UstaInfo | None, rq_id: int, page: int = 0, query: str = ""):
+    if not usta:
+        return await message_or_cb.answer("Ro‘yxatdan o‘ting: /start")
 
-        lines = env["cc.employee.zapchast"].sudo().search(
-            [("employee_id", "=", usta.id), ("qty", ">", 0)],
-            order="zapchast_code asc, zapchast_name asc, id asc",
-        )
-        data = [(l.zapchast_id.id, f"[{l.zapchast_code}] {l.zapchast_name}", l.uom, l.qty) for l in lines]
-        page_items, total = _paginate(data, page)
+    # faqat ko'rsatiladigan sahifa o'qiladi (search_count + offset/limit)
+    page_items, total, page = await run_in_env(list_usta_parts, usta.id, page, query)
 
+    if query:
+        text = f"🔎 <b>«{html.escape(query)}»</b> bo‘yicha: {total} ta zapchast"
+        text += "\nTanlang:" if total else "\nHech narsa topilmadi."
+    else:
         text = "🔩 <b>Ustaga biriktirilgan zapchastlar</b>\nTanlang:"
-        kb = _parts_kb(rq_id, page_items, page, total)
-        msg = getattr(message_or_cb, "message", message_or_cb)
-        if isinstance(message_or_cb, types.CallbackQuery):
-            await msg.edit_text(text, reply_markup=kb, parse_mode="HTML")
-            await message_or_cb.answer()
-        else:
-            await msg.answer(text, reply_markup=kb, parse_mode="HTML")
+    kb = _parts_kb(rq_id, page_items, page, total, query)
+    msg = getattr(message_or_cb, "message", message_or_cb)
+    if isinstance(message_or_cb, types.CallbackQuery):
+        await msg.edit_text(text, reply_markup=kb, parse_mode="HTML")
+        await message_or_cb.answer()
+    else:
+        await msg.answer(text, reply_markup=kb, parse_mode="HTML")
 
 
 async def _register_or_link_usta(env, tg_user_id: int, tg_chat_id: int, phone_plus: str, full_name: str):
@@ -129,48 +132,59 @@ def _compact_uz_phone(raw):
 
 
 @router.message(CommandStart())
-async def cmd_start(m: types.Message, state: FSMContext):
-    with open_env() as env:
-        usta = find_usta_by_tg(env, m.from_user.id)
-        if not usta:
-            await state.set_state(Reg.Phone)
-            return await m.answer(
-                "👋 Assalomu alaykum!\n\nRo'yxatdan o'tish uchun telefon raqamingizni yuboring.",
-                reply_markup=share_phone_kb()
-            )
-        if not getattr(usta, "active", False):
-            return await m.answer(
-                "⏳ Arizangiz qabul qilindi.\nAdministrator tasdiqlaganidan so'ng, bot funksiyalari ochiladi.",
-                reply_markup=ReplyKeyboardRemove()
-            )
+async def cmd_start(m: types.Message, state: FSMContext, usta: UstaInfo | None = None):
+    if not usta:
+        await state.set_state(Reg.Phone)
+        return await m.answer(
+            "👋 Assalomu alaykum!\n\nRo'yxatdan o'tish uchun telefon raqamingizni yuboring.",
+            reply_markup=share_phone_kb()
+        )
+    if not usta.active:
+        return await m.answer(
+            "⏳ Arizangiz qabul qilindi.\nAdministrator tasdiqlaganidan so'ng, bot funksiyalari ochiladi.",
+            reply_markup=ReplyKeyboardRemove()
+        )
     await m.answer("✅ Assalomu alaykum! Kerakli bo'limni tanlang.", reply_markup=main_kb())
 
 
+def _link_phone(env, phone_plus: str, tg_user_id: int, tg_chat_id: int):
+    """
+    Telefon bo'yicha ustani bog'laydi.
+    ("linked", active) yoki ("viloyat", kb | None) qaytaradi.
+    """
+    usta = find_usta_by_phone(env, phone_plus)
+    if usta:
+        usta.sudo().write({"tg_user_id": str(tg_user_id), "tg_chat_id": str(tg_chat_id)})
+        return "linked", bool(usta.active)
+    states = env["res.country.state"].sudo().search([("country_id.code", "=", "UZ")], order="name")
+    return "viloyat", (_build_viloyat_kb(states) if states else None)
+
+
+async def _reply_phone_step(m: types.Message, state: FSMContext, phone_plus: str, not_found_text: str):
+    kind, payload = await run_in_env(_link_phone, phone_plus, m.from_user.id, m.chat.id)
+    if kind == "linked":
+        await state.clear()
+        if payload:
+            return await m.answer("✅ Siz muvaffaqiyatli ro'yxatdan o'tdingiz!", reply_markup=main_kb())
+        return await m.answer(
+            "⏳ Hisobingiz topildi, lekin hali faollashtirilmagan.\nAdministrator tasdiqlaganidan so'ng xabar beramiz.",
+            reply_markup=ReplyKeyboardRemove(),
+        )
+
+    await state.update_data(phone=phone_plus)
+    await state.set_state(Reg.Viloyat)
+    if not payload:
+        await state.clear()
+        return await m.answer(not_found_text)
+    await m.answer("📍 Ish hududingizni tanlang.\n\nAvval <b>Viloyatni</b> tanlang:", reply_markup=payload, parse_mode="HTML")
+
+
 @router.message(Reg.Phone, F.contact)
 async def reg_phone_contact(m: types.Message, state: FSMContext):
     phone_plus = _compact_uz_phone(m.contact.phone_number)
     if not phone_plus:
         return await m.answer("❌ Iltimos, to'g'ri telefon raqam yuboring.", reply_markup=share_phone_kb())
-    with open_env() as env:
-        usta = find_usta_by_phone(env, phone_plus)
-        if usta:
-            usta.sudo().write({"tg_user_id": str(m.from_user.id), "tg_chat_id": str(m.chat.id)})
-            await state.clear()
-            if usta.active:
-                return await m.answer("✅ Siz muvaffaqiyatli ro'yxatdan o'tdingiz!", reply_markup=main_kb())
-            return await m.answer(
-                "⏳ Hisobingiz topildi, lekin hali faollashtirilmagan.\nAdministrator tasdiqlaganidan so'ng xabar beramiz.",
-                reply_markup=ReplyKeyboardRemove(),
-            )
-
-        await state.update_data(phone=phone_plus)
-        await state.set_state(Reg.Viloyat)
-        states = env["res.country.state"].sudo().search([("country_id.code", "=", "UZ")], order="name")
-        if not states:
-            await state.clear()
-            return await m.answer("❌ Viloyatlar topilmadi. Adminga murojaat qiling.")
-        kb = _build_viloyat_kb(states)
-        await m.answer("📍 Ish hududingizni tanlang.\n\nAvval <b>Viloyatni</b> tanlang:", reply_markup=kb, parse_mode="HTML")
+    await _reply_phone_step(m, state, phone_plus, "❌ Viloyatlar topilmadi. Adminga murojaat qiling.")
 
 
 @router.message(Reg.Phone, F.text)
@@ -178,27 +192,7 @@ async def reg_phone_text(m: types.Message, state: FSMContext):
     phone_plus = _compact_uz_phone(m.text)
     if not phone_plus:
         return await m.answer("❌ Iltimos, telefon raqamini to'g'ri kiriting yoki kontakt ulashing.", reply_markup=share_phone_kb())
-
-    with open_env() as env:
-        usta = find_usta_by_phone(env, phone_plus)
-        if usta:
-            usta.sudo().write({"tg_user_id": str(m.from_user.id), "tg_chat_id": str(m.chat.id)})
-            await state.clear()
-            if usta.active:
-                return await m.answer("✅ Siz muvaffaqiyatli ro'yxatdan o'tdingiz!", reply_markup=main_kb())
-            return await m.answer(
-                "⏳ Hisobingiz topildi, lekin hali faollashtirilmagan.\nAdministrator tasdiqlaganidan so'ng xabar beramiz.",
-                reply_markup=ReplyKeyboardRemove(),
-            )
-
-        await state.update_data(phone=phone_plus)
-        await state.set_state(Reg.Viloyat)
-        states = env["res.country.state"].sudo().search([("country_id.code", "=", "UZ")], order="name")
-        if not states:
-            await state.clear()
-            return await m.answer("❌ Viloyatlar topilmadi.")
-        kb = _build_viloyat_kb(states)
-        await m.answer("📍 Ish hududingizni tanlang.\n\nAvval <b>Viloyatni</b> tanlang:", reply_markup=kb, parse_mode="HTML")
+    await _reply_phone_step(m, state, phone_plus, "❌ Viloyatlar topilmadi.")
 
 
 def _build_viloyat_kb(states):
@@ -208,28 +202,37 @@ def _build_viloyat_kb(states):
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
 
+def _viloyat_kb(env):
+    states = env["res.country.state"].sudo().search([("country_id.code", "=", "UZ")], order="name")
+    return _build_viloyat_kb(states)
+
+
 @router.callback_query(F.data.startswith("reg:vil:"), Reg.Viloyat)
 async def reg_viloyat(c: types.CallbackQuery, state: FSMContext):
     state_id = int(c.data.split(":")[2])
-    with open_env() as env:
+
+    def _load(env):
         viloyat = env["res.country.state"].sudo().browse(state_id)
         if not viloyat.exists():
-            return await c.answer("❌ Viloyat topilmadi.", show_alert=True)
+            return None, None
+        tumans = env["cc.region"].sudo().search([("state_id", "=", state_id), ("active", "=", True)], order="name")
+        return viloyat.name, (_build_tuman_kb(tumans, selected_ids=set()) if tumans else None)
 
-        await state.update_data(state_id=state_id, state_name=viloyat.name, region_ids=[], region_names=[])
-        await state.set_state(Reg.Tuman)
+    viloyat_name, kb = await run_in_env(_load)
+    if viloyat_name is None:
+        return await c.answer("❌ Viloyat topilmadi.", show_alert=True)
 
-        tumans = env["cc.region"].sudo().search([("state_id", "=", state_id), ("active", "=", True)], order="name")
-        if not tumans:
-            await c.answer("❌ Bu viloyat uchun tumanlar topilmadi.", show_alert=True)
-            await state.set_state(Reg.Viloyat)
-            return
+    await state.update_data(state_id=state_id, state_name=viloyat_name, region_ids=[], region_names=[])
+    await state.set_state(Reg.Tuman)
+    if kb is None:
+        await c.answer("❌ Bu viloyat uchun tumanlar topilmadi.", show_alert=True)
+        await state.set_state(Reg.Viloyat)
+        return
 
-        kb = _build_tuman_kb(tumans, selected_ids=set())
-        await c.message.edit_text(
-            f"📍 Viloyat: <b>{viloyat.name}</b>\n\nEndi <b>Tuman(lar)</b> ni tanlang (bir nechta tanlash mumkin), so‘ng «✅ Tasdiqlash»:",
-            reply_markup=kb, parse_mode="HTML"
-        )
+    await c.message.edit_text(
+        f"📍 Viloyat: <b>{viloyat_name}</b>\n\nEndi <b>Tuman(lar)</b> ni tanlang (bir nechta tanlash mumkin), so‘ng «✅ Tasdiqlash»:",
+        reply_markup=kb, parse_mode="HTML"
+    )
     await c.answer()
 
 
@@ -249,15 +252,14 @@ def _build_tuman_kb(regions, selected_ids: set[int] | None = None):
 @router.callback_query(F.data.regexp(r"^reg:tum:\d+$"), Reg.Tuman)
 async def reg_tuman_toggle(c: types.CallbackQuery, state: FSMContext):
     region_id = int(c.data.rsplit(":", 1)[1])
-    with open_env() as env:
+    data = await state.get_data()
+    selected: list[int] = list(data.get("region_ids") or [])
+    selected_names: list[str] = list(data.get("region_names") or [])
+
+    def _load(env):
         region = env["cc.region"].sudo().browse(region_id)
         if not region.exists():
-            return await c.answer("❌ Tuman topilmadi.", show_alert=True)
-
-        data = await state.get_data()
-        selected: list[int] = list(data.get("region_ids") or [])
-        selected_names: list[str] = list(data.get("region_names") or [])
-
+            return None
         if region_id in selected:
             idx = selected.index(region_id)
             selected.pop(idx)
@@ -269,19 +271,23 @@ async def reg_tuman_toggle(c: types.CallbackQuery, state: FSMContext):
             selected.append(region_id)
             selected_names.append(region.name)
 
-        await state.update_data(region_ids=selected, region_names=selected_names)
-
         tumans = env["cc.region"].sudo().search(
             [("state_id", "=", data.get("state_id")), ("active", "=", True)], order="name"
         )
-        kb = _build_tuman_kb(tumans, selected_ids=set(selected))
-        sel_count = len(selected)
-        await c.message.edit_text(
-            f"📍 Viloyat: <b>{data.get('state_name')}</b>\n"
-            f"✅ Tanlangan tumanlar: <b>{sel_count}</b>\n\n"
-            f"Tuman(lar) ni tanlang, so‘ng «✅ Tasdiqlash» tugmasini bosing.",
-            reply_markup=kb, parse_mode="HTML"
-        )
+        return _build_tuman_kb(tumans, selected_ids=set(selected))
+
+    kb = await run_in_env(_load)
+    if kb is None:
+        return await c.answer("❌ Tuman topilmadi.", show_alert=True)
+
+    await state.update_data(region_ids=selected, region_names=selected_names)
+    sel_count = len(selected)
+    await c.message.edit_text(
+        f"📍 Viloyat: <b>{data.get('state_name')}</b>\n"
+        f"✅ Tanlangan tumanlar: <b>{sel_count}</b>\n\n"
+        f"Tuman(lar) ni tanlang, so‘ng «✅ Tasdiqlash» tugmasini bosing.",
+        reply_markup=kb, parse_mode="HTML"
+    )
     await c.answer()
 
 
@@ -319,34 +325,34 @@ async def reg_location_received(m: types.Message, state: FSMContext):
 
 @router.message(Reg.Location, F.text == "⬅️ Ortga")
 async def reg_location_back(m: types.Message, state: FSMContext):
-    with open_env() as env:
-        data = await state.get_data()
-        state_id = data.get("state_id")
-        if not state_id:
-            await state.set_state(Reg.Viloyat)
-            states = env["res.country.state"].sudo().search([("country_id.code", "=", "UZ")], order="name")
-            kb = _build_viloyat_kb(states)
-            return await m.answer("📍 Ish hududingizni tanlang.\n\nAvval <b>Viloyatni</b> tanlang:", reply_markup=kb, parse_mode="HTML")
+    data = await state.get_data()
+    state_id = data.get("state_id")
+    if not state_id:
+        await state.set_state(Reg.Viloyat)
+        kb = await run_in_env(_viloyat_kb)
+        return await m.answer("📍 Ish hududingizni tanlang.\n\nAvval <b>Viloyatni</b> tanlang:", reply_markup=kb, parse_mode="HTML")
 
+    sel_ids = set(data.get("region_ids") or [])
+
+    def _load(env):
         tumans = env["cc.region"].sudo().search([("state_id", "=", state_id), ("active", "=", True)], order="name")
-        sel_ids = set(data.get("region_ids") or [])
-        kb = _build_tuman_kb(tumans, selected_ids=sel_ids)
-        await state.set_state(Reg.Tuman)
-        await m.answer(
-            f"📍 Viloyat: <b>{data.get('state_name')}</b>\n"
-            f"✅ Tanlangan tumanlar: <b>{len(sel_ids)}</b>\n\n"
-            f"Tuman(lar) ni tanlang, so‘ng «✅ Tasdiqlash».",
-            reply_markup=kb, parse_mode="HTML"
-        )
+        return _build_tuman_kb(tumans, selected_ids=sel_ids)
+
+    kb = await run_in_env(_load)
+    await state.set_state(Reg.Tuman)
+    await m.answer(
+        f"📍 Viloyat: <b>{data.get('state_name')}</b>\n"
+        f"✅ Tanlangan tumanlar: <b>{len(sel_ids)}</b>\n\n"
+        f"Tuman(lar) ni tanlang, so‘ng «✅ Tasdiqlash».",
+        reply_markup=kb, parse_mode="HTML"
+    )
 
 
 @router.callback_query(F.data == "reg:back:vil", Reg.Tuman)
 async def reg_back_to_viloyat(c: types.CallbackQuery, state: FSMContext):
     await state.set_state(Reg.Viloyat)
-    with open_env() as env:
-        states = env["res.country.state"].sudo().search([("country_id.code", "=", "UZ")], order="name")
-        kb = _build_viloyat_kb(states)
-        await c.message.edit_text("📍 Ish hududingizni tanlang.\n\nAvval <b>Viloyatni</b> tanlang:", reply_markup=kb, parse_mode="HTML")
+    kb = await run_in_env(_viloyat_kb)
+    await c.message.edit_text("📍 Ish hududingizni tanlang.\n\nAvval <b>Viloyatni</b> tanlang:", reply_markup=kb, parse_mode="HTML")
     await c.answer()
 
 
@@ -367,90 +373,173 @@ async def reg_fullname(m: types.Message, state: FSMContext):
         await state.clear()
         return await m.answer("❌ Ma'lumotlar to‘liq emas (telefon/viloyat/tumanlar). Qaytadan /start bosing.")
 
-    with open_env() as env:
-        try:
-            User = env["res.users"].sudo()
-            base_group = env.ref("base.group_user")
-            user_vals = {
-                "name": full_name,
-                "login": phone,
-                "phone": phone,
-                "active": True,
-                "groups_id": [(4, base_group.id)] if base_group else [],
-            }
-            user = User.search([("login", "=", phone)], limit=1)
-            if user:
-                user.write({"name": full_name, "phone": phone})
-            else:
-                user = User.create(user_vals)
-
-            Employee = env["cc.employee"].sudo()
-            emp_vals = {
-                "name": full_name,
-                "phone": phone,
-                "is_usta": True,
-                "active": True,
-                "usta_status": False,
-                "tg_user_id": str(m.from_user.id),
-                "tg_chat_id": str(m.chat.id),
-                "user_id": user.id,
-                "service_region_ids": [(6, 0, region_ids)],
-                "state_ids": [(4, state_id)],
-            }
-            if geo_lat and geo_lng:
-                emp_vals["geo_lat"] = float(geo_lat)
-                emp_vals["geo_lng"] = float(geo_lng)
-            if "state" in Employee._fields:
-                emp_vals["state"] = "pending"
-
-            usta = Employee.create(emp_vals)
-
-            await state.clear()
-            regions_txt = ", ".join(region_names) if region_names else f"{len(region_ids)} ta tuman"
-            loc_txt = f"\n📍 Joylashuv: {geo_lat:.6f}, {geo_lng:.6f}" if (geo_lat and geo_lng) else ""
-            await m.answer(
-                "✅ <b>Ro'yxatdan o'tish muvaffaqiyatli!</b>\n\n"
-                f"👤 Ism: {full_name}\n"
-                f"📞 Telefon: {phone}\n"
-                f"📍 Hudud: {data.get('state_name')} / {regions_txt}"
-                f"{loc_txt}\n\n"
-                "⏳ Arizangiz administratorga yuborildi.\n"
-                "Tasdiqlangandan so'ng sizga xabar beramiz.",
-                reply_markup=ReplyKeyboardRemove(),
-                parse_mode="HTML",
-            )
-            _logger.info(f"New usta registered: {full_name} ({phone}) - ID: {usta.id}")
-        except Exception as e:
-            _logger.exception("Registration failed")
-            await state.clear()
-            await m.answer("❌ Xatolik yuz berdi. Iltimos, qaytadan urinib ko'ring: /start\n\n" f"Xato: {str(e)}")
+    def _register(env):
+        User = env["res.users"].sudo()
+        base_group = env.ref("base.group_user")
+        user_vals = {
+            "name": full_name,
+            "login": phone,
+            "phone": phone,
+            "active": True,
+            "groups_id": [(4, base_group.id)] if base_group else [],
+        }
+        user = User.search([("login", "=", phone)], limit=1)
+        if user:
+            user.write({"name": full_name, "phone": phone})
+        else:
+            user = User.create(user_vals)
+
+        Employee = env["cc.employee"].sudo()
+        emp_vals = {
+            "name": full_name,
+            "phone": phone,
+            "is_usta": True,
+            "active": True,
+            "usta_status": False,
+            "tg_user_id": str(m.from_user.id),
+            "tg_chat_id": str(m.chat.id),
+            "user_id": user.id,
+            "service_region_ids": [(6, 0, region_ids)],
+            "state_ids": [(4, state_id)],
+        }
+        if geo_lat and geo_lng:
+            emp_vals["geo_lat"] = float(geo_lat)
+            emp_vals["geo_lng"] = float(geo_lng)
+        if "state" in Employee._fields:
+            emp_vals["state"] = "pending"
+
+        return Employee.create(emp_vals).id
+
+    try:
+        usta_id = await run_in_env(_register)
+    except Exception as e:
+        _logger.exception("Registration failed")
+        await state.clear()
+        return await m.answer("❌ Xatolik yuz berdi. Iltimos, qaytadan urinib ko'ring: /start\n\n" f"Xato: {str(e)}")
+
+    await state.clear()
+    regions_txt = ", ".join(region_names) if region_names else f"{len(region_ids)} ta tuman"
+    loc_txt = f"\n📍 Joylashuv: {geo_lat:.6f}, {geo_lng:.6f}" if (geo_lat and geo_lng) else ""
+    await m.answer(
+        "✅ <b>Ro'yxatdan o'tish muvaffaqiyatli!</b>\n\n"
+        f"👤 Ism: {full_name}\n"
+        f"📞 Telefon: {phone}\n"
+        f"📍 Hudud: {data.get('state_name')} / {regions_txt}"
+        f"{loc_txt}\n\n"
+        "⏳ Arizangiz administratorga yuborildi.\n"
+        "Tasdiqlangandan so'ng sizga xabar beramiz.",
+        reply_markup=ReplyKeyboardRemove(),
+        parse_mode="HTML",
+    )
+    _logger.info(f"New usta registered: {full_name} ({phone}) - ID: {usta_id}")
+
+
+INBOX_PAGE_SIZE = 8
+_STAGE_ICONS = {"new": "🆕", "waiting": "⏳", "accepted": "⏳", "progress": "🔧", "done": "✅"}
+
+
+def _inbox_page(env, usta: UstaInfo, after_id=None, before_id=None):
+    """
+    Bitta sahifa: [(lead_id, qator)], oldingi/keyingi sahifa bormi.
+    Faqat ro'yxat uchun kerakli maydonlar; kartochka ma'lumoti ochilganda yuklanadi.
+    """
+    Lead = env["crm.lead"].sudo()
+    after = lead_cursor(Lead.browse(after_id)) if after_id else None
+    before = lead_cursor(Lead.browse(before_id)) if before_id else None
+    leads = list_usta_open_leads(env, usta.record(env), limit=INBOX_PAGE_SIZE + 1, after=after, before=before)
+    if before:
+        has_prev, has_next = len(leads) > INBOX_PAGE_SIZE, True
+        leads = leads[-INBOX_PAGE_SIZE:]
+    else:
+        has_prev, has_next = bool(after), len(leads) > INBOX_PAGE_SIZE
+        leads = leads[:INBOX_PAGE_SIZE]
+    rows = []
+    for lead in leads:
+        sn = getattr(lead, "service_number", None) or lead.id
+        who = lead.partner_name or (lead.partner_id and lead.partner_id.name) or lead.name or ""
+        rows.append((lead.id, f"{_STAGE_ICONS.get(request_stage(lead), '•')} #{sn} · {who[:40]}"))
+    return rows, has_prev, has_next
+
+
+def _inbox_kb(rows, has_prev: bool, has_next: bool) -> InlineKeyboardMarkup:
+    kb = [[InlineKeyboardButton(text=label, callback_data=f"inb:open:{lead_id}")] for lead_id, label in rows]
+    nav = []
+    if has_prev:
+        nav.append(InlineKeyboardButton(text="⬅️", callback_data=f"inb:prev:{rows[0][0]}"))
+    if has_next:
+        nav.append(InlineKeyboardButton(text="➡️", callback_data=f"inb:next:{rows[-1][0]}"))
+    if nav:
+        kb.append(nav)
+    return InlineKeyboardMarkup(inline_keyboard=kb)
 
 
 @router.message(F.text == "📝 Aktiv zayafkalar")
-async def show_active_requests(m: types.Message, state: FSMContext):
-    with open_env() as env:
-        usta = find_usta_by_tg(env, m.from_user.id)
-        if not usta:
-            await state.set_state(Reg.Phone)
-            return await m.answer("Ro‘yxatdan o‘tish uchun telefon raqamingizni yuboring.", reply_markup=share_phone_kb())
-
-        leads = list_usta_open_leads(env, usta, limit=20)
-        if not leads:
-            return await m.answer("Hozircha sizga biriktirilgan, yakunlanmagan zayavkalar yo‘q ✅", reply_markup=main_kb())
-
-        for lead in leads:
-            stage = request_stage(lead)
-            ready = is_ready_to_start(lead) if stage == "accepted" else False
-            text = format_rq_card(lead)
-            kb = request_actions_kb(lead.id, stage, ready)
-            msg = await m.answer(text, reply_markup=kb, parse_mode="HTML")
-            lead.sudo().write({"tg_card_chat_id": str(m.chat.id), "tg_card_msg_id": str(msg.message_id)})
+async def show_active_requests(m: types.Message, state: FSMContext, usta: UstaInfo | None = None):
+    if not usta:
+        await state.set_state(Reg.Phone)
+        return await m.answer("Ro‘yxatdan o‘tish uchun telefon raqamingizni yuboring.", reply_markup=share_phone_kb())
+
+    # bitta xabar: ro'yxat + sahifalash; kartochka faqat tanlanganda yuboriladi
+    rows, has_prev, has_next = await run_in_env(_inbox_page, usta)
+    if not rows:
+        return await m.answer("Hozircha sizga biriktirilgan, yakunlanmagan zayavkalar yo‘q ✅", reply_markup=main_kb())
+    await m.answer("📝 <b>Aktiv zayavkalar</b>\nKartochkani ochish uchun tanlang:",
+                   reply_markup=_inbox_kb(rows, has_prev, has_next), parse_mode="HTML")
+
+
+@router.callback_query(F.data.regexp(r"^inb:(next|prev):\d+$"))
+async def inbox_page(c: types.CallbackQuery, usta: UstaInfo | None = None):
+    if not usta:
+        return await c.answer("Ro‘yxatdan o‘ting: /start", show_alert=True)
+    _, direction, lead_id = c.data.split(":")
+    if direction == "next":
+        rows, has_prev, has_next = await run_in_env(_inbox_page, usta, after_id=int(lead_id))
+    else:
+        rows, has_prev, has_next = await run_in_env(_inbox_page, usta, before_id=int(lead_id))
+    if not rows:
+        return await c.answer("Boshqa zayavka yo‘q.")
+    await c.message.edit_reply_markup(reply_markup=_inbox_kb(rows, has_prev, has_next))
+    await c.answer()
+
+
+@router.callback_query(F.data.startswith("inb:open:"))
+async def inbox_open(c: types.CallbackQuery, usta: UstaInfo | None = None):
+    if not usta:
+        return await c.answer("Ro‘yxatdan o‘ting: /start", show_alert=True)
+    lead_id = int(c.data.split(":")[2])
+
+    def _render(env):
+        # eskirgan (boshqa ustaga o'tgan) yoki soxta callback boshqa lead'ni ochmasin
+        lead = env["crm.lead"].sudo().search(
+            [("id", "=", lead_id)] + open_leads_domain(env, usta.record(env)), limit=1)
+        if not lead:
+            return None
+        data = load_card_data(lead)[lead.id]
+        stage = request_stage(lead)
+        ready = is_ready_to_start(lead, data) if stage == "accepted" else False
+        return format_rq_card(lead, data), request_actions_kb(lead.id, stage, ready)
+
+    card = await run_in_env(_render)
+    if not card:
+        return await c.answer("Zayavka topilmadi.", show_alert=True)
+    text, kb = card
+    msg = await c.message.answer(text, reply_markup=kb, parse_mode="HTML")
+    await c.answer()
+
+    def _save(env):
+        # crm.lead qatoriga emas — kartochkalar registriga
+        env["warranty.bot.card"].sudo()._register(
+            [(lead_id, msg.chat.id, msg.message_id, card_cache.content_hash(text, kb))])
+
+    await run_in_env(_save)
+    card_cache.get_writes().track([(msg.chat.id, msg.message_id)])
 
 
 @router.callback_query(F.data.startswith("rq:accept:"))
 async def rq_accept(c: types.CallbackQuery):
     rq_id = int(c.data.split(":")[2])
-    with open_env() as env:
+
+    def _accept(env, reply):
         lead = env["crm.lead"].sudo().browse(rq_id)
         stage_ids = get_stage_ids(env)
         target_id = stage_ids.get("waiting") or stage_ids.get("accept") or 0
@@ -460,38 +549,41 @@ async def rq_accept(c: types.CallbackQuery):
         else:
             new_id = transition_lead_stage(env, lead, "waiting") or transition_lead_stage(env, lead, "accepted")
             ok = bool(new_id)
+        reply.card(render_lead_card(lead), lead.id)
+        reply.callback("✅ Zayavka qabul qilindi. Kutilmoqda.", show_alert=not ok)
 
-        from .aiogram_app import _BOT
-        await refresh_lead_card(_BOT, env, lead)
-    await c.answer("✅ Zayavka qabul qilindi. Kutilmoqda.", show_alert=not ok)
+    reply = await db_phase(_accept)
+    await reply.send(c)
 
 
 @router.callback_query(F.data.startswith("rq:start:"))
 async def rq_start(c: types.CallbackQuery):
     rq_id = int(c.data.split(":")[2])
-    with open_env() as env:
+
+    def _start(env, reply):
         lead = env["crm.lead"].sudo().browse(rq_id)
-        stage_ids = get_stage_ids(env)
-        ok = move_lead_to_stage(env, lead, stage_ids["progress"])
-        from .aiogram_app import _BOT
-        await refresh_lead_card(_BOT, env, lead)
-    await c.answer("🔧 Ish boshlandi. TZMda: Jarayonda" if ok else "❗️ Xatolik", show_alert=False)
+        ok = move_lead_to_stage(env, lead, get_stage_ids(env)["progress"])
+        reply.card(render_lead_card(lead), lead.id)
+        reply.callback("🔧 Ish boshlandi. TZMda: Jarayonda" if ok else "❗️ Xatolik", show_alert=False)
+
+    reply = await db_phase(_start)
+    await reply.send(c)
 
 
 async def _refresh_card(c_message, lead_id):
-    with open_env() as env:
+    def _render(env):
         lead = env["crm.lead"].sudo().browse(lead_id)
+        data = load_card_data(lead)[lead.id]
         stage = request_stage(lead)
-        ready = is_ready_to_start(lead) if stage == "accepted" else False
-        await c_message.edit_text(
-            format_rq_card(lead),
-            reply_markup=request_actions_kb(lead.id, stage, ready),
-            parse_mode="HTML"
-        )
+        ready = is_ready_to_start(lead, data) if stage == "accepted" else False
+        return format_rq_card(lead, data), request_actions_kb(lead.id, stage, ready)
+
+    text, kb = await run_in_env(_render)
+    await c_message.edit_text(text, reply_markup=kb, parse_mode="HTML")
 
 
 @router.message(Work.Amount)
-async def set_amount(m: types.Message, state: FSMContext):
+async def set_amount(m: types.Message, state: FSMContext, usta: UstaInfo | None = None):
     data = await state.get_data()
     rq_id = data["rq_id"]
     amt_text = m.text.replace(" ", "")
@@ -499,11 +591,10 @@ async def set_amount(m: types.Message, state: FSMContext):
         return await m.answer("Faqat raqam kiriting. Masalan: 120000")
     amount = int(amt_text)
 
-    with open_env() as env:
+    def _save(env, reply):
         lead = env["crm.lead"].sudo().browse(rq_id)
         lead.write({"work_amount": amount})
 
-        usta = find_usta_by_tg(env, m.from_user.id)
         ft_id = False
         try:
             ft_id = env["cc.finance.type"].sudo().search([
@@ -526,12 +617,12 @@ async def set_amount(m: types.Message, state: FSMContext):
             vals["type_id"] = ft_id
 
         env["cc.finance"].sudo().create(vals)
+        reply.refresh(rq_id)
+        reply.message("Saqlandi ✅")
 
-        from .aiogram_app import _BOT
-        await refresh_lead_card(_BOT, env, lead)
-
+    reply = await db_phase(_save)
     await state.clear()
-    await m.answer("Saqlandi ✅")
+    await reply.send(m)
 
 
 @router.callback_query(F.data.startswith("rq:amount:"))
@@ -546,7 +637,8 @@ async def rq_amount(c: types.CallbackQuery, state: FSMContext):
 @router.callback_query(F.data.startswith("rq:finish:"))
 async def rq_finish(c: types.CallbackQuery):
     rq_id = int(c.data.split(":")[2])
-    with open_env() as env:
+
+    def _finish(env, reply):
         lead = env["crm.lead"].sudo().browse(rq_id)
 
         has_amount = bool(getattr(lead, "work_amount", False))
@@ -561,47 +653,77 @@ async def rq_finish(c: types.CallbackQuery):
         if not has_photos: missing.append("🖼️ Foto")
 
         if missing:
-            from .aiogram_app import _BOT
-            await refresh_lead_card(_BOT, env, lead)
-            return await c.answer("Ishni yakunlash uchun quyidagilarni to‘ldiring:\n- " + "\n- ".join(missing), show_alert=True)
+            reply.card(render_lead_card(lead), lead.id)
+            reply.callback("Ishni yakunlash uchun quyidagilarni to‘ldiring:\n- " + "\n- ".join(missing), show_alert=True)
+            return
 
         stage_ids = get_stage_ids(env)
-        ok = move_lead_to_stage(env, lead, stage_ids["done"])
+        move_lead_to_stage(env, lead, stage_ids["done"])
         lead.message_post(body="⏳ Usta ishni yakunladi. Operator tasdiqini kutmoqda.", message_type="notification")
+        reply.card(render_lead_card(lead), lead.id)
+        reply.callback("✅ Ish yakunlandi! Operator tasdiqlashi kutilmoqda.", show_alert=True)
+
+    reply = await db_phase(_finish)
+    await reply.send(c)
 
-        from .aiogram_app import _BOT
-        await refresh_lead_card(_BOT, env, lead)
 
-    await c.answer("✅ Ish yakunlandi! Operator tasdiqlashi kutilmoqda.", show_alert=True)
+# qidiruv matni kutilayotganda ham ro'yxat tugmalari ishlaydi
+_PARTS_PICKER = StateFilter(Work.PartsPick, Work.PartsSearch)
 
 
 @router.callback_query(F.data.startswith("rq:parts:"))
-async def rq_parts(c: types.CallbackQuery, state: FSMContext):
+async def rq_parts(c: types.CallbackQuery, state: FSMContext, usta: UstaInfo | None = None):
     rq_id = int(c.data.split(":")[2])
-    await state.update_data(rq_id=rq_id, parts_page=0)
+    await state.update_data(rq_id=rq_id, parts_page=0, parts_query="")
     await state.set_state(Work.PartsPick)
-    await _show_parts_page(c, rq_id, page=0)
+    await _show_parts_page(c, usta, rq_id, page=0)
 
 
-@router.callback_query(F.data.startswith("zp:pg:"), Work.PartsPick)
-async def zp_page(c: types.CallbackQuery, state: FSMContext):
+@router.callback_query(F.data.startswith("zp:pg:"), _PARTS_PICKER)
+async def zp_page(c: types.CallbackQuery, state: FSMContext, usta: UstaInfo | None = None):
     _, _, rq_id, page = c.data.split(":")
+    data = await state.get_data()
     await state.update_data(parts_page=int(page))
-    await _show_parts_page(c, int(rq_id), int(page))
+    await state.set_state(Work.PartsPick)
+    await _show_parts_page(c, usta, int(rq_id), int(page), data.get("parts_query") or "")
+
+
+@router.callback_query(F.data.startswith("zp:find:"), _PARTS_PICKER)
+async def zp_find(c: types.CallbackQuery, state: FSMContext):
+    await state.set_state(Work.PartsSearch)
+    await c.message.answer("🔎 Zapchast kodi boshini yoki nomidan bo‘lak yozing. Masalan: 12A yoki nasos")
+    await c.answer()
+
+
+@router.message(Work.PartsSearch)
+async def zp_search(m: types.Message, state: FSMContext, usta: UstaInfo | None = None):
+    query = (m.text or "").strip()[:64]
+    if not query:
+        return await m.answer("Qidiruv uchun matn yozing.")
+    data = await state.get_data()
+    await state.update_data(parts_page=0, parts_query=query)
+    await state.set_state(Work.PartsPick)
+    await _show_parts_page(m, usta, int(data["rq_id"]), 0, query)
 
 
-@router.callback_query(F.data.startswith("zp:back:"), Work.PartsPick)
+@router.callback_query(F.data.startswith("zp:clr:"), _PARTS_PICKER)
+async def zp_clear(c: types.CallbackQuery, state: FSMContext, usta: UstaInfo | None = None):
+    rq_id = int(c.data.split(":")[2])
+    await state.update_data(parts_page=0, parts_query="")
+    await state.set_state(Work.PartsPick)
+    await _show_parts_page(c, usta, rq_id, 0)
+
+
+@router.callback_query(F.data.startswith("zp:back:"), _PARTS_PICKER)
 async def zp_back(c: types.CallbackQuery, state: FSMContext):
     rq_id = int(c.data.split(":")[2])
-    with open_env() as env:
-        from .aiogram_app import _BOT
-        lead = env["crm.lead"].sudo().browse(rq_id)
-        await refresh_lead_card(_BOT, env, lead)
+    from .aiogram_app import _BOT
+    await get_coalescer().flush(_BOT, rq_id)
     await state.clear()
     await c.answer()
 
 
-@router.callback_query(F.data.startswith("zp:pick:"), Work.PartsPick)
+@router.callback_query(F.data.startswith("zp:pick:"), _PARTS_PICKER)
 async def zp_pick(c: types.CallbackQuery, state: FSMContext):
     _, _, rq_id, zp_id, page = c.data.split(":")
     await state.update_data(rq_id=int(rq_id), zp_id=int(zp_id), parts_page=int(page))
@@ -613,21 +735,22 @@ async def zp_pick(c: types.CallbackQuery, state: FSMContext):
 @router.callback_query(F.data.startswith("rq:finish_yes:"))
 async def rq_finish_yes(c: types.CallbackQuery):
     rq_id = int(c.data.split(":")[2])
-    with open_env() as env:
+
+    def _done(env):
         lead = env["crm.lead"].sudo().browse(rq_id)
-        ok = move_lead_to_stage(env, lead, get_stage_ids(env)["done"])
-        await c.message.edit_reply_markup(reply_markup=None)
-        await c.message.answer("✅ Zayavka yakunlandi." if ok else "❗️ Yakunlab bo‘lmadi.")
+        return move_lead_to_stage(env, lead, get_stage_ids(env)["done"])
+
+    ok = await run_in_env(_done)
+    await c.message.edit_reply_markup(reply_markup=None)
+    await c.message.answer("✅ Zayavka yakunlandi." if ok else "❗️ Yakunlab bo‘lmadi.")
     await c.answer()
 
 
 @router.callback_query(F.data.startswith("rq:finish_no:"))
 async def rq_finish_no(c: types.CallbackQuery):
     rq_id = int(c.data.split(":")[2])
-    with open_env() as env:
-        from .aiogram_app import _BOT
-        lead = env["crm.lead"].sudo().browse(rq_id)
-        await refresh_lead_card(_BOT, env, lead)
+    from .aiogram_app import _BOT
+    await get_coalescer().flush(_BOT, rq_id)
     await c.answer("Bekor qilindi.")
 
 
@@ -645,7 +768,7 @@ async def zp_qty(m: types.Message, state: FSMContext):
 
 
 @router.message(Work.PartsPrice)
-async def zp_price(m: types.Message, state: FSMContext):
+async def zp_price(m: types.Message, state: FSMContext, usta: UstaInfo | None = None):
     raw = (m.text or "").replace(" ", "")
     if not raw.isdigit():
         return await m.answer("Iltimos, butun UZS kiriting (masalan: 120000) yoki 0.")
@@ -656,20 +779,18 @@ async def zp_price(m: types.Message, state: FSMContext):
     zp_id = int(data["zp_id"])
     qty = float(data["qty"])
 
-    with open_env() as env:
-        usta = find_usta_by_tg(env, m.from_user.id)
-        if not usta:
-            await state.clear()
-            return await m.answer("Ro‘yxatdan o‘ting: /start")
+    if not usta:
+        await state.clear()
+        return await m.answer("Ro‘yxatdan o‘ting: /start")
 
+    def _save(env, reply):
         line = env["cc.employee.zapchast"].sudo().search(
             [("employee_id", "=", usta.id), ("zapchast_id", "=", zp_id)], limit=1
         )
         avail = float(getattr(line, "qty", 0) or 0)
         if qty > avail:
-            await m.answer(f"❌ Qoldiq yetarli emas.\nMavjud: {avail:g}\nQayta miqdor kiriting (≤ {avail:g}).")
-            await state.set_state(Work.PartsQty)
-            return
+            reply.message(f"❌ Qoldiq yetarli emas.\nMavjud: {avail:g}\nQayta miqdor kiriting (≤ {avail:g}).")
+            return "short"
 
         vals = {
             "date": fields.Datetime.now(),
@@ -683,13 +804,16 @@ async def zp_price(m: types.Message, state: FSMContext):
             "note": "Telegram: ustadan sarf",
         }
         env["cc.zapchast.move"].sudo().create(vals)
-
-        from .aiogram_app import _BOT
-        lead = env["crm.lead"].sudo().browse(rq_id)
-        await refresh_lead_card(_BOT, env, lead)
-
-    await state.clear()
-    await m.answer("Zapchast sarfi saqlandi ✅")
+        reply.refresh(rq_id)
+        reply.message("Zapchast sarfi saqlandi ✅")
+        return "ok"
+
+    reply = await db_phase(_save)
+    if reply.result == "short":
+        await state.set_state(Work.PartsQty)
+    else:
+        await state.clear()
+    await reply.send(m)
 
 
 # =========================
@@ -721,10 +845,8 @@ async def exp_pick_fare(c: types.CallbackQuery, state: FSMContext):
 @router.callback_query(F.data.startswith("exp:type:back:"), Work.ExpType)
 async def exp_type_back(c: types.CallbackQuery, state: FSMContext):
     rq_id = int(c.data.split(":")[3])
-    with open_env() as env:
-        from .aiogram_app import _BOT
-        lead = env["crm.lead"].sudo().browse(rq_id)
-        await refresh_lead_card(_BOT, env, lead)
+    from .aiogram_app import _BOT
+    await get_coalescer().flush(_BOT, rq_id)
     await state.clear()
     await c.answer()
 
@@ -740,7 +862,7 @@ async def exp_type_free_text(m: types.Message, state: FSMContext):
 
 
 @router.message(Work.ExpAmount)
-async def expense_amount(m: types.Message, state: FSMContext):
+async def expense_amount(m: types.Message, state: FSMContext, usta: UstaInfo | None = None):
     raw = m.text.replace(" ", "")
     if not raw.isdigit():
         return await m.answer("Raqam kiriting. Masalan: 45000")
@@ -749,21 +871,21 @@ async def expense_amount(m: types.Message, state: FSMContext):
     note = (data.get("exp_note") or "").strip()
     await state.update_data(exp_amount=amount)
     if note:
-        return await _create_finance_and_refresh(m, state)
+        return await _create_finance_and_refresh(m, state, usta)
     await state.set_state(Work.ExpNote)
     await m.answer("Xarajat izohini yozing (masalan: 'Benzin', 'Mayda detallar' ...).")
 
 
 @router.message(Work.ExpNote)
-async def expense_note(m: types.Message, state: FSMContext):
+async def expense_note(m: types.Message, state: FSMContext, usta: UstaInfo | None = None):
     note = (m.text or "").strip()
     if not note:
         return await m.answer("Izoh yozing.")
     await state.update_data(exp_note=note, exp_direction="expense")
-    await _create_finance_and_refresh(m, state)
+    await _create_finance_and_refresh(m, state, usta)
 
 
-async def _create_finance_and_refresh(m: types.Message, state: FSMContext):
+async def _create_finance_and_refresh(m: types.Message, state: FSMContext, usta: UstaInfo | None):
     data = await state.get_data()
     rq_id = data.get("rq_id")
     amount = int(data.get("exp_amount") or 0)
@@ -772,12 +894,11 @@ async def _create_finance_and_refresh(m: types.Message, state: FSMContext):
     if amount <= 0:
         return await m.answer("Summani to‘g‘ri kiriting.")
 
-    with open_env() as env:
-        usta = find_usta_by_tg(env, m.from_user.id)
-        if not usta:
-            await state.clear()
-            return await m.answer("Ro‘yxatdan o‘ting: /start")
+    if not usta:
+        await state.clear()
+        return await m.answer("Ro‘yxatdan o‘ting: /start")
 
+    def _save(env, reply):
         env["cc.finance"].sudo().create({
             "date": fields.Date.context_today(env.user),
             "employee_id": usta.id,
@@ -786,14 +907,13 @@ async def _create_finance_and_refresh(m: types.Message, state: FSMContext):
             "lead_id": rq_id,
             "note": note,
         })
+        reply.refresh(rq_id)
+        sign = "+" if direction == "income" else "−"
+        reply.message(f"{note} {sign}{amount:,} saqlandi ✅".replace(",", " "))
 
-        from .aiogram_app import _BOT
-        lead = env["crm.lead"].sudo().browse(rq_id)
-        await refresh_lead_card(_BOT, env, lead)
-
+    reply = await db_phase(_save)
     await state.clear()
-    sign = "+" if direction == "income" else "−"
-    await m.answer(f"{note} {sign}{amount:,} saqlandi ✅".replace(",", " "))
+    await reply.send(m)
 
 
 @router.callback_query(F.data.startswith("rq:photo:"))
@@ -805,43 +925,69 @@ async def rq_photo(c: types.CallbackQuery, state: FSMContext):
     await c.answer()
 
 
+async def _save_album(m: types.Message, rq_id: int, parts):
+    """Albom: parallel yuklab olish, bitta tranzaksiya, bitta javob va bitta kartochka refresh."""
+    try:
+        photos = [photo for photo, _ in parts]
+        known = await run_in_env(photos_known, rq_id, [p.file_unique_id for p in photos])
+        photos = [p for p in photos if p.file_unique_id not in known]
+        bufs = await asyncio.gather(*(m.bot.download(p, destination=io.BytesIO()) for p in photos))
+        # siqish/miniatyuralar process pool'da, parallel
+        images = await asyncio.gather(*(get_image_processor().process(buf.getvalue()) for buf in bufs))
+        items = [(img, p.file_unique_id) for img, p in zip(images, photos)]
+
+        def _save(env, reply):
+            saved = ingest_photos(env, rq_id, items) if items else 0
+            if not saved:
+                reply.message("Bu rasmlar avval saqlangan ✅")
+                return
+            reply.refresh(rq_id)
+            reply.message(f"{saved} ta rasm saqlandi ✅")
+
+        reply = await db_phase(_save)
+        await reply.send(m)
+    except Exception as e:
+        _logger.error(f"[ALB] lead {rq_id} album save error: {e}", exc_info=True)
+        await m.answer("❗️ Rasmlarni saqlab bo'lmadi, iltimos qayta yuboring.")
+    finally:
+        # albom qismlarining update'lari faqat endi ack qilinadi
+        for _, release in parts:
+            if release:
+                release()
+
+
 @router.message(Work.Photo, F.photo)
 async def on_photo(m: types.Message, state: FSMContext):
     data = await state.get_data()
     rq_id = int(data["rq_id"])
     photo = m.photo[-1]
-    file = await m.bot.get_file(photo.file_id)
 
-    fd, tmp = tempfile.mkstemp(suffix=".jpg")
-    os.close(fd)
-    await m.bot.download(file, destination=tmp)
-
-    with open(tmp, "rb") as f:
-        bin_data = f.read()
-    os.unlink(tmp)
-    data_b64 = base64.b64encode(bin_data).decode()
-
-    with open_env() as env:
-        att = env["ir.attachment"].sudo().create({
-            "name": "photo.jpg",
-            "datas": data_b64,
-            "res_model": "crm.lead",
-            "res_id": rq_id,
-            "mimetype": "image/jpeg",
-        })
-        env["crm.lead.photo"].sudo().create({
-            "lead_id": rq_id,
-            "name": "Foto",
-            "image_1920": data_b64,
-            "note": "",
-        })
-        lead = env["crm.lead"].sudo().browse(rq_id)
-        lead.write({"photo_attachment_ids": [(4, att.id)]})
+    if m.media_group_id:
+        # albom qismlari yig'iladi va oxirida bitta partiya bo'lib saqlanadi;
+        # update albom saqlanguncha ack qilinmaydi (restart'da qayta o'qiladi)
+        get_album_collector().add(
+            (m.chat.id, m.media_group_id), (photo, defer_ack()),
+            lambda photos: _save_album(m, rq_id, photos),
+        )
+        return
+
+    # qayta yuborilgan rasm — yuklab olmaymiz ham
+    if await run_in_env(photo_known, rq_id, photo.file_unique_id):
+        return await m.answer("Bu rasm avval saqlangan ✅")
 
-        from .aiogram_app import _BOT
-        await refresh_lead_card(_BOT, env, lead)
+    # temp fayl va diskka yozishsiz: to'g'ridan-to'g'ri xotiraga
+    buf = await m.bot.download(photo, destination=io.BytesIO())
+    img = await get_image_processor().process(buf.getvalue())
+
+    def _save(env, reply):
+        if not ingest_photo(env, rq_id, img, photo.file_unique_id):
+            reply.message("Bu rasm avval saqlangan ✅")
+            return
+        reply.refresh(rq_id)
+        reply.message("Rasm saqlandi ✅")
 
-    await m.answer("Rasm saqlandi ✅")
+    reply = await db_phase(_save)
+    await reply.send(m)
 
 
 @router.message(Work.Photo, F.text == "✅ Tayyor")
@@ -860,10 +1006,12 @@ async def photo_cancel(m: types.Message, state: FSMContext):
 @router.callback_query(F.data.startswith("rq:confirm:"))
 async def rq_confirm(c: types.CallbackQuery):
     rq_id = int(c.data.split(":")[2])
-    with open_env() as env:
+
+    def _confirm(env, reply):
         lead = env["crm.lead"].sudo().browse(rq_id)
         if not is_ready_to_start(lead):
-            return await c.answer("❗️ Iltimos, hamma ma'lumotlarni to'ldiring.", show_alert=True)
+            reply.callback("❗️ Iltimos, hamma ma'lumotlarni to'ldiring.", show_alert=True)
+            return
         stage_ids = get_stage_ids(env)
         current_stage = request_stage(lead)
         if current_stage == "accepted":
@@ -874,21 +1022,21 @@ async def rq_confirm(c: types.CallbackQuery):
             lead.message_post(body="⏳ Usta ma'lumotlarni yubordi. Operator tasdiqini kutmoqda.",
                               message_type="notification")
             msg = "✅ Ma'lumotlar operatorga yuborildi"
+        reply.card(render_lead_card(lead), lead.id)
+        reply.callback(msg if ok else "❗️ Xatolik", show_alert=True)
 
-        from .aiogram_app import _BOT
-        await refresh_lead_card(_BOT, env, lead)
-    await c.answer(msg if ok else "❗️ Xatolik", show_alert=True)
+    reply = await db_phase(_confirm)
+    await reply.send(c)
 
 
 @router.message(F.text == "💼 Balansim")
-async def show_balance(m: types.Message, state: FSMContext):
-    with open_env() as env:
-        usta = find_usta_by_tg(env, m.from_user.id)
-        if not usta:
-            await state.set_state(Reg.Phone)
-            return await m.answer("Ro‘yxatdan o‘tish uchun telefon raqamingizni yuboring.", reply_markup=share_phone_kb())
-
-        emp = usta.sudo()
+async def show_balance(m: types.Message, state: FSMContext, usta: UstaInfo | None = None):
+    if not usta:
+        await state.set_state(Reg.Phone)
+        return await m.answer("Ro‘yxatdan o‘tish uchun telefon raqamingizni yuboring.", reply_markup=share_phone_kb())
+
+    def _load(env):
+        emp = usta.record(env)
         text = (
             f"💼 <b>Balans</b>\n"
             f"— Hozirgi balans: <b>{round(emp.balance_total):,}</b>\n\n"
@@ -900,6 +1048,9 @@ async def show_balance(m: types.Message, state: FSMContext):
                 text += f"• {l.zapchast_id.name} — {l.qty} {l.uom}\n"
         else:
             text += "— Yo‘q"
+        return text
+
+    text = await run_in_env(_load)
     await m.answer(text, parse_mode="HTML", reply_markup=main_kb())
 
 
@@ -912,72 +1063,35 @@ async def history_menu(m: types.Message):
 
 
 @router.callback_query(F.data == "hist:export:xlsx")
-async def history_export(c: types.CallbackQuery):
-    import xlsxwriter
-    with open_env() as env:
-        usta = find_usta_by_tg(env, c.from_user.id)
-        if not usta:
-            return await c.answer("Ro‘yxatdan o‘ting.", show_alert=True)
-
-        Lead = env["crm.lead"].sudo()
-        dom = [
-            ("type", "=", "opportunity"),
-            "|",
-            ("usta_id", "=", usta.id),
-            ("user_id", "=", (usta.user_id.id if usta.user_id else False)),
-        ]
-        leads = Lead.search(dom, order="create_date desc", limit=2000)
-
-        fd, path = tempfile.mkstemp(suffix=".xlsx")
-        os.close(fd)
-        wb = xlsxwriter.Workbook(path)
-
-        f_hdr = wb.add_format({"bold": True, "bg_color": "#F2F2F2", "border": 1})
-        f_txt = wb.add_format({"border": 1})
-        f_num = wb.add_format({"border": 1, "num_format": "# ##0"})
-        f_date = wb.add_format({"border": 1, "num_format": "yyyy-mm-dd hh:mm"})
-        ws = wb.add_worksheet("Zayavkalar")
-
-        headers = ["Servis #", "Nomi", "Mijoz", "Telefon", "Manzil",
-                   "Yaratilgan", "Holati", "Ish summasi", "Xarajatlar (jami)",
-                   "Zapchastlar (soni)", "Izoh"]
-        ws.write_row(0, 0, headers, f_hdr)
-        widths = [12, 28, 22, 18, 40, 20, 18, 14, 18, 18, 50]
-        for i, w in enumerate(widths):
-            ws.set_column(i, i, w)
-
-        r = 1
-        for l in leads:
-            addr = _lead_address(l)
-            exp_total = expense_total_for_lead(l)
-            parts_cnt = int(getattr(l, "cc_move_out_count", 0) or 0)
-            amount = float(getattr(l, "work_amount", 0.0) or 0.0)
-            stage = (l.stage_id and l.stage_id.name) or ""
-
-            ws.write(r, 0, (l.service_number or ""), f_txt)
-            ws.write(r, 1, (l.name or ""), f_txt)
-            ws.write(r, 2, (l.partner_name or (l.partner_id and l.partner_id.name) or ""), f_txt)
-            ws.write(r, 3, (l.phone or l.partner_phone or (l.partner_id and l.partner_id.phone) or ""), f_txt)
-            ws.write(r, 4, addr, f_txt)
-            if l.create_date:
-                ws.write_datetime(r, 5, l.create_date, f_date)
-            else:
-                ws.write(r, 5, "", f_txt)
-            ws.write(r, 6, stage, f_txt)
-            ws.write_number(r, 7, amount, f_num)
-            ws.write_number(r, 8, exp_total, f_num)
-            ws.write_number(r, 9, parts_cnt, f_num)
-            ws.write(r, 10, (l.description or "")[:2000], f_txt)
-            r += 1
-
-        wb.close()
-
-    await c.message.answer_document(
-        types.FSInputFile(path, filename="usta_zayavkalar_tarixi.xlsx"),
-        caption=f"Jami yozuvlar: {len(leads)}"
-    )
-    os.unlink(path)
-    await c.answer("Eksport tayyor ✅")
+async def history_export(c: types.CallbackQuery, usta: UstaInfo | None = None):
+    if not usta:
+        return await c.answer("Ro‘yxatdan o‘ting.", show_alert=True)
+
+    # katta tarix bir necha soniya olishi mumkin — callback'ni oldin yopamiz
+    await c.answer("Eksport tayyorlanmoqda…")
+    exports = get_export_cache()
+    stamp = await run_in_env(history_stamp, usta)
+    found, cached = exports.get(usta.id)
+    if found and cached[0] == stamp:
+        # tarix o'zgarmagan — avval yuklangan faylni file_id bilan qayta yuboramiz
+        try:
+            await c.message.answer_document(cached[1], caption=f"Jami yozuvlar: {cached[2]}")
+            return
+        except TelegramBadRequest:
+            exports.invalidate([usta.id])
+
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        count = await run_in_env(build_history_xlsx, usta, path)
+        msg = await c.message.answer_document(
+            types.FSInputFile(path, filename="usta_zayavkalar_tarixi.xlsx"),
+            caption=f"Jami yozuvlar: {count}"
+        )
+    finally:
+        os.unlink(path)
+    if msg.document:
+        exports.put(usta.id, (stamp, msg.document.file_id, count))
 
 
 @router.message(F.text == "⚙️ Sozlamalar")
@@ -990,10 +1104,11 @@ async def settings_menu(m: types.Message):
 
 
 @router.callback_query(F.data == "logout")
-async def logout(c: types.CallbackQuery):
-    with open_env() as env:
-        usta = find_usta_by_tg(env, c.from_user.id)
-        if usta:
-            usta.sudo().write({"tg_user_id": False, "tg_chat_id": False})
+async def logout(c: types.CallbackQuery, usta: UstaInfo | None = None):
+    def _unlink(env):
+        usta.record(env).write({"tg_user_id": False, "tg_chat_id": False})
+
+    if usta:
+        await run_in_env(_unlink)
     await c.message.answer("Hisob ajratildi. Qayta ulash uchun /start bosing.")
     await c.answer()
@@ -1,15 +1,48 @@
 # -*- coding: utf-8 -*-
 import logging
-from typing import Optional
+from typing import NamedTuple, Optional
+
+from .stage_registry import get_registry
 
 _logger = logging.getLogger(__name__)
 
+class UstaInfo(NamedTuple):
+    """Handler'larga uzatiladigan yengil usta snapshot'i (recordset emas)."""
+    id: int
+    active: bool
+    usta_status: bool
+    company_id: int
+    user_id: int
+    lang: str
+
+    @property
+    def allowed(self) -> bool:
+        return self.active and self.usta_status
+
+    def record(self, env):
+        return env["cc.employee"].sudo().browse(self.id)
+
 def find_usta_by_tg(env, tg_user_id):
     return env["cc.employee"].sudo().search(
         [("tg_user_id", "=", str(tg_user_id)), ("is_usta", "=", True)],
         limit=1
     )
 
+def usta_snapshot(usta) -> Optional[UstaInfo]:
+    if not usta:
+        return None
+    return UstaInfo(
+        id=usta.id,
+        active=bool(usta.active),
+        usta_status=bool(getattr(usta, "usta_status", False)),
+        company_id=usta.company_id.id if getattr(usta, "company_id", False) else False,
+        user_id=usta.user_id.id if usta.user_id else False,
+        lang=getattr(usta, "tg_lang", None) or "uz",
+    )
+
+def find_usta_snapshot(env, tg_user_id) -> Optional[UstaInfo]:
+    return usta_snapshot(find_usta_by_tg(env, tg_user_id))
+
 def find_usta_by_phone(env, phone):
     return env["cc.employee"].sudo().search(
         [("phone", "=", phone), ("is_usta", "=", True)],
@@ -28,32 +61,9 @@ def list_active_requests(env, usta):
 
 def request_stage(rq):
     """Return one of: new | waiting | accepted | progress | done"""
-    try:
-        ids = get_stage_ids(rq.env)
-        sid = rq.stage_id.id if rq.stage_id else 0
-        if sid and ids.get("done") and sid == ids["done"]:
-            return "done"
-        if sid and ids.get("progress") and sid == ids["progress"]:
-            return "progress"
-        if sid and ids.get("waiting") and sid == ids["waiting"]:
-            return "waiting"
-        if sid and ids.get("accept") and sid == ids["accept"]:
-            return "accepted"
-    except Exception:
-        pass
-
-    name = (rq.stage_id.name or "").lower()
-    if "yakunlandi" in name or "done" in name or "finished" in name:
-        return "done"
-    if "jarayonda" in name or "progress" in name:
-        return "progress"
-    if "kutilmoqda" in name or "waiting" in name or "pending" in name:
-        return "waiting"
-    if "qabul" in name or "accept" in name:
-        return "accepted"
-    return "new"
-
-def _lead_address(rq):
+    return get_registry(rq.env).stage_class(rq.stage_id.id)
+
+def lead_address(rq):
     # keep as-is if you still use it elsewhere; safe to leave unchanged
     parts = []
     for val in [rq.street, rq.city, getattr(rq.state_id, "name", None), getattr(rq.country_id, "name", None)]:
@@ -75,57 +85,112 @@ def _sanitize_url(u: str) -> str:
     except Exception:
         return ""
 
-def format_rq_card(rq):
-    addr = _lead_address(rq)
-
+def _money(v):
     try:
-        tags = [t.name.strip() for t in rq.tag_ids if (t.name or "").strip()]
+        return f"{int(v):,}".replace(",", " ")
     except Exception:
-        tags = []
+        return str(v)
+
+def _finance_totals(leads):
+    """
+    Bitta read_group: {lead_id: (xarajat summasi, >0 yozuv bormi)}.
+    expense_total_for_lead / finance_exists_for_lead'ning partiyaviy varianti.
+    """
+    env = leads.env
+    company_ids = leads.company_id.ids
+    if company_ids:
+        env = env(context=dict(env.context or {}, allowed_company_ids=company_ids))
+    totals = {}
+    try:
+        groups = env["cc.finance"].sudo()._read_group(
+            [("lead_id", "in", leads.ids)],
+            groupby=["lead_id", "direction"],
+            aggregates=["amount:sum", "amount:max"],
+        )
+    except Exception as e:
+        _logger.warning(f"[CARD] finance read_group error: {e}")
+        groups = []
+    for lead, direction, amount_sum, amount_max in groups:
+        exp_total, has_finance = totals.get(lead.id, (0.0, False))
+        if direction == "expense":
+            exp_total += amount_sum or 0.0
+        totals[lead.id] = (exp_total, has_finance or (amount_max or 0) > 0)
+    return {lid: (int(round(exp or 0)), has) for lid, (exp, has) in totals.items()}
+
+def load_card_data(leads) -> dict:
+    """
+    Kartochka uchun kerakli hamma narsani leads recordset'i bo'yicha bir nechta
+    so'rovda yuklaydi (lead soniga bog'liq emas): {lead_id: dict}.
+    """
+    leads = leads.sudo()
+    if not leads:
+        return {}
+    # prefetch: har bir relatsiya butun recordset uchun bitta so'rovda o'qiladi
+    for path in ("tag_ids.name", "partner_id.name", "state_id.name", "country_id.name",
+                 "product_line_ids.product_id.default_code", "product_line_ids.sync_line_id.sale_date"):
+        try:
+            leads.mapped(path)
+        except Exception:
+            pass
+    for fname in ("cc_move_out_count", "photo_attachment_ids"):
+        if fname in leads._fields:
+            leads.mapped(fname)
+
+    finance = _finance_totals(leads)
+    data = {}
+    for rq in leads:
+        exp_total, has_finance = finance.get(rq.id, (0, False))
+        try:
+            tags = [t.name.strip() for t in rq.tag_ids if (t.name or "").strip()]
+        except Exception:
+            tags = []
+        products = []
+        for l in getattr(rq, "product_line_ids", []) or []:
+            p = getattr(l, "product_id", None)
+            if not p:
+                continue
+            code = (p.default_code or "").strip() or f"#{p.id}"
+            sale_dt = ""
+            try:
+                sync_line = getattr(l, "sync_line_id", None)
+                if sync_line and sync_line.sale_date:
+                    sale_dt = sync_line.sale_date.strftime("%Y-%m-%d %H:%M:%S")
+            except Exception:
+                sale_dt = ""
+            products.append((code, p.name or "", sale_dt))
+        data[rq.id] = {
+            "address": lead_address(rq),
+            "tags": tags,
+            "products": products,
+            "has_amount": bool(getattr(rq, "work_amount", False)),
+            "has_parts": int(getattr(rq, "cc_move_out_count", 0) or 0) > 0,
+            "has_photos": bool(getattr(rq, "photo_attachment_ids", [])),
+            "exp_total": exp_total,
+            "has_finance": has_finance or exp_total > 0,
+        }
+    return data
+
+def format_rq_card(rq, data=None):
+    if data is None:
+        data = load_card_data(rq)[rq.id]
+    addr = data["address"]
+    tags = data["tags"]
 
     sn = (getattr(rq, "service_number", None) or rq.id or "")
     title = f"⚙️ <b>#{sn}</b>\n"
 
-    has_amount  = bool(getattr(rq, "work_amount", False))
-    has_parts   = int(getattr(rq, "cc_move_out_count", 0) or 0) > 0
-    exp_total   = expense_total_for_lead(rq)
-    try:
-        has_finance = finance_exists_for_lead(rq)
-    except Exception:
-        has_finance = (exp_total > 0)
-    has_photos  = bool(getattr(rq, "photo_attachment_ids", []))
-    desc        = (getattr(rq, "work_text", None) or "")
+    exp_total = data["exp_total"]
+    desc = (getattr(rq, "work_text", None) or "")
 
     # >>>>>>> ONLY USE THE SAVED FIELD <<<<<<<
     # No geocoding, no address fallback.
     raw_url = getattr(rq, "location_url", "") or ""
     map_url = _sanitize_url(raw_url)
 
-    # optional product list...
-    product_lines = []
-    try:
-        pls = list(getattr(rq, "product_line_ids", []) or [])
-        i = 1
-        for l in pls:
-            p = getattr(l, "product_id", None)
-            if not p:
-                continue
-            code = (getattr(p, "default_code", None) or "").strip() or (f"#{getattr(p, 'id', '')}" if getattr(p, "id", None) else "—")
-            product_lines.append(f"{i}. {code}")
-            i += 1
-    except Exception:
-        product_lines = []
-
-    def _money(v):
-        try:
-            return f"{int(v):,}".replace(",", " ")
-        except Exception:
-            return str(v)
-
-    amount_txt = _money(rq.work_amount) if has_amount else "—"
-    parts_txt  = "✅" if has_parts else "—"
-    exp_txt    = _money(exp_total) if exp_total > 0 else ("✅" if has_finance else "—")
-    photo_txt  = "✅" if has_photos else "—"
+    amount_txt = _money(rq.work_amount) if data["has_amount"] else "—"
+    parts_txt  = "✅" if data["has_parts"] else "—"
+    exp_txt    = _money(exp_total) if exp_total > 0 else ("✅" if data["has_finance"] else "—")
+    photo_txt  = "✅" if data["has_photos"] else "—"
 
     parts = [
         title,
@@ -138,34 +203,15 @@ def format_rq_card(rq):
     # Show ONLY the stored link if present
     if map_url:
         parts.append(f"🔗 <a href=\"{map_url}\">Manzil URL</a>")
-            
-    if pls:
-        product_lines = []
-        i = 1
-        for l in pls:
-            p = getattr(l, "product_id", None)
-            if not p:
-                continue
-            code = (getattr(p, "default_code", None) or "").strip() or (f"#{getattr(p, 'id', '')}" if getattr(p, "id", None) else "—")
-            name = getattr(p, "name", "")
-            sale_dt = ""
-            # Try to get sale datetime from sync_line_id
-            try:
-                sync_line = getattr(l, "sync_line_id", None)
-                if sync_line and getattr(sync_line, "sale_date", None):
-                    # full timestamp with minutes and seconds
-                    sale_dt = sync_line.sale_date.strftime("%Y-%m-%d %H:%M:%S")
-            except Exception:
-                sale_dt = ""
-            line_txt = f"{i}. {code} — {name}"
-            if sale_dt:
-                line_txt += f"\n🗓 {sale_dt}"
-            product_lines.append(line_txt)
-            i += 1
-
-        if product_lines:
-            parts.append("\n📦 Mahsulotlar:\n" + "\n".join(product_lines))
 
+    product_lines = []
+    for i, (code, name, sale_dt) in enumerate(data["products"], 1):
+        line_txt = f"{i}. {code} — {name}"
+        if sale_dt:
+            line_txt += f"\n🗓 {sale_dt}"
+        product_lines.append(line_txt)
+    if product_lines:
+        parts.append("\n📦 Mahsulotlar:\n" + "\n".join(product_lines))
 
     extras = [
         "📋 Qo'shimchalar",
@@ -183,105 +229,118 @@ def format_rq_card(rq):
 
     return "\n".join(parts)
 
+def is_ready_to_start(lead, data=None) -> bool:
+    if data is None:
+        data = load_card_data(lead)[lead.id]
+    return all([data["has_amount"], data["has_parts"], data["exp_total"] > 0, data["has_photos"]])
+
+OPEN_LEADS_ORDER = "priority desc, create_date desc, id desc"
+
+def lead_cursor(lead):
+    """Keyset pagination kaliti (OPEN_LEADS_ORDER bo'yicha): (priority, create_date, id)."""
+    return (lead.priority or "0", lead.create_date, lead.id)
+
+def _keyset_domain(cursor, op):
+    """(priority, create_date, id) op cursor — hammasi bitta yo'nalishda (desc)."""
+    priority, create_date, lead_id = cursor
+    return [
+        "|", ("priority", op, priority),
+        "&", ("priority", "=", priority),
+        "|", ("create_date", op, create_date),
+        "&", ("create_date", "=", create_date), ("id", op, lead_id),
+    ]
 
-def is_ready_to_start(lead) -> bool:
-    has_amount = bool(getattr(lead, "work_amount", False))
-    has_parts  = int(getattr(lead, "cc_move_out_count", 0) or 0) > 0
-    exp_total  = expense_total_for_lead(lead)
-    has_photos = bool(getattr(lead, "photo_attachment_ids", []))
-    return all([has_amount, has_parts, exp_total > 0, has_photos])
+def open_leads_domain(env, usta):
+    """Usta'ning ochiq lead'lari: usta_id YOKI user_id, yopiq bosqichlar SQL'da chiqarib tashlanadi."""
+    Lead = env["crm.lead"]
+    domain = [("type", "=", "opportunity"), ("active", "=", True)]
+    uid = usta.user_id.id if usta.user_id else False
+    if uid:
+        domain += ["|", ("usta_id", "=", usta.id), ("user_id", "=", uid)]
+    else:
+        domain.append(("usta_id", "=", usta.id))
+    closed_ids = get_registry(env).closed_ids
+    if closed_ids:
+        domain.append(("stage_id", "not in", list(closed_ids)))
+    if "probability" in Lead._fields:
+        domain.append(("probability", "<", 100))
+    return domain
 
-def list_usta_open_leads(env, usta, limit=20):
+def list_usta_open_leads(env, usta, limit=20, after=None, before=None):
+    """
+    Bitta indekslangan so'rov. after/before — lead_cursor() qiymati:
+    after keyingi sahifa, before oldingi sahifa (natija har doim OPEN_LEADS_ORDER'da).
+    """
     if getattr(usta, "company_id", False) and usta.company_id:
         env = env(context=dict(env.context or {}, allowed_company_ids=[usta.company_id.id]))
 
     Lead = env["crm.lead"].sudo()
-    Stage = env["crm.stage"]
-
-    closed_dom = []
-    stage_fields = Stage._fields
-    if "is_won" in stage_fields:
-        closed_dom.append(("stage_id.is_won", "=", False))
-    if "is_lost" in stage_fields:
-        closed_dom.append(("stage_id.is_lost", "=", False))
-    if "fold" in stage_fields:
-        closed_dom.append(("stage_id.fold", "=", False))
-
-    domain = [("type", "=", "opportunity"), ("active", "=", True), ("usta_id", "=", usta.id)] + closed_dom
-    if "probability" in Lead._fields:
-        domain.append(("probability", "<", 100))
-
-    leads = Lead.search(domain, order="priority desc, create_date desc", limit=limit)
-    closed_keywords = ["done", "finished", "closed", "cancel", "lost", "won", "yopildi", "tugadi", "bekor"]
-    leads = leads.filtered(lambda l: all(kw not in (l.stage_id.name or "").lower() for kw in closed_keywords))
-
-    if not leads:
-        uid = usta.user_id.id if usta.user_id else False
-        if uid:
-            alt_domain = [("type", "=", "opportunity"), ("active", "=", True), ("user_id", "=", uid)] + closed_dom
-            if "probability" in Lead._fields:
-                alt_domain.append(("probability", "<", 100))
-            leads = Lead.search(alt_domain, order="priority desc, create_date desc", limit=limit)
-            leads = leads.filtered(lambda l: all(kw not in (l.stage_id.name or "").lower() for kw in closed_keywords))
-    return leads
-
-def _team_domain(Stage, team_id):
-    dom = []
-    if not team_id:
-        return dom
-    fields = Stage._fields
-    if "team_ids" in fields:
-        dom += ["|", ("team_ids", "=", False), ("team_ids", "in", [team_id])]
-    elif "team_id" in fields:
-        dom += ["|", ("team_id", "=", False), ("team_id", "=", team_id)]
+    domain = open_leads_domain(env, usta)
+    if after:
+        return Lead.search(domain + _keyset_domain(after, "<"), order=OPEN_LEADS_ORDER, limit=limit)
+    if before:
+        leads = Lead.search(domain + _keyset_domain(before, ">"),
+                            order="priority asc, create_date asc, id asc", limit=limit)
+        return leads[::-1]
+    return Lead.search(domain, order=OPEN_LEADS_ORDER, limit=limit)
+
+PARTS_PAGE_SIZE = 8
+PARTS_ORDER = "zapchast_code asc, zapchast_name asc, id asc"
+
+def _like_escape(q: str) -> str:
+    return q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def parts_domain(usta_id, query=None):
+    """Ustada qoldig'i bor zapchastlar; query — kod boshi yoki nom bo'lagi."""
+    dom = [("employee_id", "=", usta_id), ("qty", ">", 0)]
+    q = (query or "").strip()
+    if q:
+        q = _like_escape(q)
+        dom += ["|", ("zapchast_code", "=ilike", f"{q}%"), ("zapchast_name", "ilike", q)]
     return dom
 
+def list_usta_parts(env, usta_id, page=0, query=None, per_page=PARTS_PAGE_SIZE):
+    """
+    (qatorlar, jami, sahifa) — search_count + offset/limit, ro'yxat Python'da
+    kesilmaydi. Sahifa chegaradan chiqsa (qoldiq tugagan) oxirgisiga tushiriladi.
+    qatorlar: [(zapchast_id, "[kod] nom", uom, qty)].
+    """
+    Line = env["cc.employee.zapchast"].sudo()
+    dom = parts_domain(usta_id, query)
+    total = Line.search_count(dom)
+    max_page = (total - 1) // per_page if total else 0
+    page = min(max(int(page), 0), max_page)
+    rows = Line.search_read(
+        dom, ["zapchast_id", "zapchast_code", "zapchast_name", "uom", "qty"],
+        order=PARTS_ORDER, offset=page * per_page, limit=per_page,
+    )
+    items = []
+    for r in rows:
+        uom = r["uom"][1] if isinstance(r["uom"], (list, tuple)) else (r["uom"] or "")
+        items.append((r["zapchast_id"][0] if r["zapchast_id"] else False,
+                      f"[{r['zapchast_code'] or ''}] {r['zapchast_name'] or ''}", uom, r["qty"]))
+    return items, total, page
+
 def _with_company(env, company_id):
     if company_id:
         return env(context=dict(env.context or {}, allowed_company_ids=[company_id]))
     return env
 
 def _find_stage_for_team(env, team_id, company_id, names_like: list[str]) -> Optional[int]:
-    env = _with_company(env, company_id)
-    Stage = env["crm.stage"].sudo()
-    base_dom = _team_domain(Stage, team_id)
-    for frag in names_like:
-        sid = Stage.search(base_dom + [("name", "ilike", frag)], order="sequence asc", limit=1)
-        if sid:
-            return sid.id
-    return None
+    return get_registry(env).find_stage(team_id, company_id, names_like)
 
 def _fallback_next_open_stage(env, lead):
-    env = _with_company(env, lead.company_id.id if lead.company_id else False)
-    Stage = env["crm.stage"].sudo()
-    dom = []
-    if "fold" in Stage._fields:
-        dom.append(("fold", "=", False))
-    dom += _team_domain(Stage, lead.team_id.id if lead.team_id else False)
-    stages = Stage.search(dom, order="sequence asc", limit=100)
-    if not stages:
-        return None
-    cur_seq = getattr(lead.stage_id, "sequence", -1) if lead.stage_id else -1
-    for st in stages:
-        if getattr(st, "sequence", 999999) >= cur_seq and (not lead.stage_id or st.id != lead.stage_id.id):
-            return st.id
-    for st in stages:
-        if not lead.stage_id or st.id != lead.stage_id.id:
-            return st.id
-    return None
+    return get_registry(env).next_open_stage(
+        lead.team_id.id if lead.team_id else False,
+        lead.company_id.id if lead.company_id else False,
+        lead.stage_id.id,
+    )
 
 def transition_lead_stage(env, lead, target: str) -> Optional[int]:
     env = _with_company(env, lead.company_id.id if lead.company_id else False)
-    name_map = {
-        "accepted": ["Qabul", "Accept"],
-        "waiting":  ["Kutilmoqda", "Waiting", "Pending", "Qabul"],
-        "progress": ["Boshlandi", "Progress", "In Progress"],
-        "done":     ["Tasdiq", "Done", "Yakun", "Finished"],
-    }
-    names_like = name_map.get(target, [])
-    stage_id = _find_stage_for_team(env, lead.team_id.id if lead.team_id else False,
-                                    lead.company_id.id if lead.company_id else False,
-                                    names_like)
+    team_id = lead.team_id.id if lead.team_id else False
+    company_id = lead.company_id.id if lead.company_id else False
+    stage_id = get_registry(env).target_stage(target, team_id, company_id)
     if not stage_id:
         stage_id = _fallback_next_open_stage(env, lead)
     if stage_id and (not lead.stage_id or lead.stage_id.id != stage_id):
@@ -289,36 +348,20 @@ def transition_lead_stage(env, lead, target: str) -> Optional[int]:
         return stage_id
     return None
 
-def _get_param_int(env, key, default=0):
-    ICP = env["ir.config_parameter"].sudo()
-    val = ICP.get_param(key, default and str(default) or "")
-    try:
-        return int(val)
-    except Exception:
-        return int(default or 0)
-
 def get_stage_ids(env):
-    return {
-        "waiting":  _get_param_int(env, "warranty_bot.stage_waiting_id", 0),
-        "accept":   _get_param_int(env, "warranty_bot.stage_waiting_id", 0),
-        "progress": _get_param_int(env, "warranty_bot.stage_progress_id", 0),
-        "done":     _get_param_int(env, "warranty_bot.stage_done_id", 0),
-    }
+    return dict(get_registry(env).config)
 
 def move_lead_to_stage(env, lead, target_stage_id):
-    Stage = env["crm.stage"].sudo()
-    st = Stage.browse(target_stage_id)
-    if not st or not st.exists():
+    stage_id = get_registry(env).same_name_for_team(
+        target_stage_id, lead.team_id.id if lead.team_id else False)
+    if not stage_id:
         return False
 
-    team_dom = _team_domain(Stage, lead.team_id.id if lead.team_id else False)
-    st_for_team = Stage.search([("name", "=", st.name)] + team_dom, limit=1) or st
-
     ctx = dict(env.context or {})
     if getattr(lead, "company_id", False) and lead.company_id:
         ctx["allowed_company_ids"] = [lead.company_id.id]
 
-    lead.with_context(ctx).sudo().write({"stage_id": st_for_team.id})
+    lead.with_context(ctx).sudo().write({"stage_id": stage_id})
     return True
 
 def expense_total_for_lead(rq) -> int: